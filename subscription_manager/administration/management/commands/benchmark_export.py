@@ -0,0 +1,102 @@
+import gc
+import os
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+
+from subscription_manager.subscription.admin import ActiveSubscriptionResource
+from subscription_manager.subscription.models import Plan, Subscription
+from subscription_manager.utils.export import write_xlsx
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures peak memory and wall time of the .xlsx export with tablib and with the write-only '
+        'writer. The subscriptions are created inside a transaction which is rolled back afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--subscriptions',
+            type=int,
+            nargs='+',
+            default=[10000, 100000, 500000],
+            help='Numbers of generated active subscriptions (default: 10000 100000 500000)'
+        )
+
+    def handle(self, *args, **options):
+        # The peak memory is read from and reset through /proc
+        if not os.path.exists('/proc/self/clear_refs'):
+            raise CommandError('This benchmark requires Linux.')
+
+        writers = [
+            ('write-only', self.write_only),
+            ('tablib', self.tablib),
+        ]
+
+        for number in options['subscriptions']:
+            with transaction.atomic():
+                self.generate(number)
+                self.stdout.write('{} active subscriptions:'.format(number))
+
+                for name, writer in writers:
+                    gc.collect()
+                    self.reset_peak_memory()
+                    memory_before = self.memory('VmRSS')
+                    started_at = time.perf_counter()
+                    writer()
+                    duration = time.perf_counter() - started_at
+                    peak = self.memory('VmHWM') - memory_before
+
+                    self.stdout.write('  {:<12} {:>9.2f} s  {:>9.1f} MB peak'.format(name, duration, peak / 1024))
+
+                transaction.set_rollback(True)
+
+    def write_only(self):
+        resource = ActiveSubscriptionResource()
+        with tempfile.TemporaryFile() as file:
+            write_xlsx(file, resource.get_export_headers(), resource.export_rows())
+
+    def tablib(self):
+        with tempfile.TemporaryFile() as file:
+            file.write(ActiveSubscriptionResource().export().xlsx)
+
+    @staticmethod
+    def reset_peak_memory():
+        with open('/proc/self/clear_refs', 'w') as file:
+            file.write('5')
+
+    @staticmethod
+    def memory(field):
+        """
+        Returns the given memory field of the current process in kB.
+        """
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+        raise CommandError('{} is missing in /proc/self/status.'.format(field))
+
+    def generate(self, number):
+        """
+        Creates the given number of active subscriptions.
+        """
+        plan = Plan.objects.create(name='Benchmark', slug='benchmark', price=20)
+        first_id = (Subscription.objects.aggregate(pk=Max('pk'))['pk'] or 0) + 1
+
+        Subscription.objects.bulk_create((
+            Subscription(
+                pk=first_id + i,
+                plan=plan,
+                first_name='Vorname {}'.format(i),
+                last_name='Nachname {}'.format(i),
+                address_line='Strasse {}'.format(i),
+                additional_address_line='c/o {}'.format(i) if i % 10 == 0 else '',
+                postcode='8000',
+                town='Zürich',
+                is_active=True
+            ) for i in range(number)
+        ), batch_size=5000)
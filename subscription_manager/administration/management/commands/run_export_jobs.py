@@ -0,0 +1,60 @@
+import logging
+import time
+import traceback
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+
+from subscription_manager.administration.models import ExportJob
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Renders requested exports in the background. Runs until it is stopped unless --once is given.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Process all waiting jobs and exit.'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=5,
+            help='Seconds to wait between checks for new jobs (default: 5)'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            ExportJob.objects.requeue_stale()
+
+            job = ExportJob.objects.claim()
+            if job is not None:
+                self.run(job)
+                continue
+
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+
+    def run(self, job):
+        """
+        Runs a job and marks it as failed if an error occurs.
+        """
+        self.stdout.write('Running {}'.format(job))
+        try:
+            job.run()
+        except Exception:
+            logger.exception('Export job #%s failed', job.pk)
+            job.status = ExportJob.FAILED
+            job.error = traceback.format_exc()
+            job.finished_at = timezone.now()
+            job.save()
+            self.stderr.write('{} failed'.format(job))
+            return
+        self.stdout.write('{} finished with {} rows'.format(job, job.exported_rows))
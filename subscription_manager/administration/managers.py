@@ -0,0 +1,70 @@
+from django.conf import settings
+from django.db import models, IntegrityError, transaction
+from django.utils import timezone
+
+
+class ExportJobManager(models.Manager):
+
+    def request(self, format, user=None):
+        """
+        Returns the waiting or running job of the given format. If there
+        is none, a new job is created. The second return value is true if
+        the job has been created.
+        """
+        unfinished = self.filter(format=format, status__in=[self.model.PENDING, self.model.RUNNING])
+
+        while True:
+            job = unfinished.first()
+            if job is not None:
+                return job, False
+
+            # The unique constraint prevents a second unfinished job of the
+            # same format if two requests arrive at the same time. If the
+            # other job has finished in the meantime, a new one is created.
+            try:
+                with transaction.atomic():
+                    return self.create(format=format, requested_by=user), True
+            except IntegrityError:
+                pass
+
+    def claim(self):
+        """
+        Marks the oldest waiting job as running and returns it. Returns
+        None if no job is waiting. A job can only be claimed once, even
+        if several workers are running.
+        """
+        for job in self.filter(status=self.model.PENDING).order_by('created_at')[:10]:
+            now = timezone.now()
+            claimed = self.filter(pk=job.pk, status=self.model.PENDING).update(
+                status=self.model.RUNNING,
+                started_at=now,
+                updated_at=now
+            )
+            if claimed:
+                job.refresh_from_db()
+                return job
+        return None
+
+    def requeue_stale(self):
+        """
+        Marks running jobs whose progress has not been updated within
+        EXPORT_JOB_TIMEOUT as waiting again, e.g. after the worker has
+        been restarted.
+        """
+        return self.filter(
+            status=self.model.RUNNING,
+            updated_at__lt=timezone.now() - settings.EXPORT_JOB_TIMEOUT
+        ).update(status=self.model.PENDING, exported_rows=0)
+
+    def delete_expired(self):
+        """
+        Deletes finished and failed jobs older than EXPORT_RETENTION
+        together with their documents.
+        """
+        jobs = self.filter(
+            status__in=[self.model.FINISHED, self.model.FAILED],
+            created_at__lt=timezone.now() - settings.EXPORT_RETENTION
+        )
+        for job in jobs:
+            job.delete_file()
+        return jobs.delete()
@@ -0,0 +1,43 @@
+# Generated by Django 3.1.1 on 2026-10-18 14:40
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('format', models.CharField(choices=[('ods', 'Open Document Sheet (.ods)'), ('xlsx', 'Excel-Datei (.xlsx)')], max_length=10, verbose_name='Format')),
+                ('status', models.CharField(choices=[('pending', 'Wartend'), ('running', 'In Bearbeitung'), ('finished', 'Abgeschlossen'), ('failed', 'Fehlgeschlagen')], db_index=True, default='pending', max_length=10, verbose_name='Status')),
+                ('total_rows', models.PositiveIntegerField(blank=True, null=True, verbose_name='Anzahl Zeilen')),
+                ('exported_rows', models.PositiveIntegerField(default=0, verbose_name='Exportierte Zeilen')),
+                ('file_name', models.CharField(blank=True, max_length=100, verbose_name='Dateiname')),
+                ('error', models.TextField(blank=True, verbose_name='Fehler')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Erstellt am')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Gestartet am')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Abgeschlossen am')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Aktualisiert am')),
+                ('requested_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='Angefordert von')),
+            ],
+            options={
+                'verbose_name': 'Export',
+                'verbose_name_plural': 'Exporte',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='exportjob',
+            constraint=models.UniqueConstraint(condition=models.Q(status__in=['pending', 'running']), fields=('format',), name='unique_unfinished_export_job_per_format'),
+        ),
+    ]
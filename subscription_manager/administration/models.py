@@ -0,0 +1,183 @@
+import os
+
+import tablib
+
+from django.conf import settings
+from django.db import models
+from django.utils import timezone
+
+from subscription_manager.utils.export import write_xlsx
+
+from .managers import ExportJobManager
+
+
+class ExportJob(models.Model):
+    """
+    Model that holds an export of the active subscriptions' addresses
+    as a document. The document is rendered in the background by the
+    run_export_jobs command and stored in the export directory.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    FINISHED = 'finished'
+    FAILED = 'failed'
+
+    format = models.CharField(
+        max_length=10,
+        choices=(
+            ('ods', 'Open Document Sheet (.ods)'),
+            ('xlsx', 'Excel-Datei (.xlsx)')
+        ),
+        verbose_name='Format'
+    )
+    status = models.CharField(
+        max_length=10,
+        choices=(
+            (PENDING, 'Wartend'),
+            (RUNNING, 'In Bearbeitung'),
+            (FINISHED, 'Abgeschlossen'),
+            (FAILED, 'Fehlgeschlagen')
+        ),
+        default=PENDING,
+        db_index=True,
+        verbose_name='Status'
+    )
+    requested_by = models.ForeignKey(
+        to=settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        verbose_name='Angefordert von'
+    )
+    total_rows = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        verbose_name='Anzahl Zeilen'
+    )
+    exported_rows = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Exportierte Zeilen'
+    )
+    file_name = models.CharField(
+        max_length=100,
+        blank=True,
+        verbose_name='Dateiname'
+    )
+    error = models.TextField(
+        blank=True,
+        verbose_name='Fehler'
+    )
+    created_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name='Erstellt am'
+    )
+    started_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Gestartet am'
+    )
+    finished_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Abgeschlossen am'
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Aktualisiert am'
+    )
+
+    objects = ExportJobManager()
+
+    class Meta:
+        verbose_name = 'Export'
+        verbose_name_plural = 'Exporte'
+        constraints = [
+            # At most one unfinished job per format
+            models.UniqueConstraint(
+                fields=['format'],
+                condition=models.Q(status__in=['pending', 'running']),
+                name='unique_unfinished_export_job_per_format'
+            )
+        ]
+
+    def __str__(self):
+        return 'Export #{} ({}, {})'.format(self.pk, self.format, self.get_status_display())
+
+    @property
+    def path(self):
+        """
+        Absolute path of the rendered document.
+        """
+        return os.path.join(settings.EXPORT_ROOT, self.file_name)
+
+    def progress(self):
+        """
+        Returns the progress of the export in percent.
+        """
+        if self.status == self.FINISHED:
+            return 100
+        if not self.total_rows:
+            return 0
+        return min(100, self.exported_rows * 100 // self.total_rows)
+
+    def is_unfinished(self):
+        """
+        True if the job is waiting or running.
+        """
+        return self.status in [self.PENDING, self.RUNNING]
+
+    def update_progress(self, exported_rows):
+        """
+        Stores the number of exported rows. Also signals that
+        the job is still alive.
+        """
+        self.exported_rows = exported_rows
+        self.save(update_fields=['exported_rows', 'updated_at'])
+
+    def run(self):
+        """
+        Renders the document row by row, reporting the progress, and
+        writes it to the export directory. The file only appears under
+        its final name once it is complete.
+        """
+        from subscription_manager.subscription.admin import ActiveSubscriptionResource
+
+        resource = ActiveSubscriptionResource()
+        queryset = resource.get_queryset()
+
+        self.total_rows = queryset.count()
+        self.exported_rows = 0
+        self.save(update_fields=['total_rows', 'exported_rows', 'updated_at'])
+
+        def rows():
+            for number, row in enumerate(resource.export_rows(queryset), start=1):
+                yield row
+                if number % settings.EXPORT_PROGRESS_INTERVAL == 0:
+                    self.update_progress(number)
+
+        file_name = '{}-active-subscriptions-{}.{}'.format(timezone.localtime().strftime('%Y-%m-%d'), self.pk, self.format)
+        os.makedirs(settings.EXPORT_ROOT, exist_ok=True)
+        temporary_path = os.path.join(settings.EXPORT_ROOT, '.{}.part'.format(file_name))
+
+        if self.format == 'xlsx':
+            # Written row by row with constant memory
+            exported_rows = write_xlsx(temporary_path, resource.get_export_headers(), rows())
+        else:
+            dataset = tablib.Dataset(*rows(), headers=resource.get_export_headers())
+            with open(temporary_path, 'wb') as file:
+                file.write(dataset.export(self.format))
+            exported_rows = len(dataset)
+        os.replace(temporary_path, os.path.join(settings.EXPORT_ROOT, file_name))
+
+        self.file_name = file_name
+        self.exported_rows = exported_rows
+        self.status = self.FINISHED
+        self.finished_at = timezone.now()
+        self.save()
+
+    def delete_file(self):
+        """
+        Removes the rendered document, if there is one.
+        """
+        if self.file_name and os.path.exists(self.path):
+            os.remove(self.path)
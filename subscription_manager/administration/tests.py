@@ -0,0 +1,224 @@
+import datetime
+import os
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import IntegrityError
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from subscription_manager.payment.models import Payment
+from subscription_manager.subscription.models import MonthlySubscriptionStats, Period, Plan, Subscription
+from subscription_manager.user.models import User
+
+from .models import ExportJob
+
+
+class ConditionalResponseTests(TestCase):
+    """
+    Tests the ETags of the statistics data and the .csv export.
+    """
+
+    def setUp(self):
+        admin_user = User.objects.create_superuser('admin@example.com', 'password', first_name='A', last_name='B')
+        self.client.force_login(admin_user)
+
+        self.plan = Plan.objects.create(name='Studierende', slug='studierende', price=20)
+        subscription = Subscription.objects.create(
+            plan=self.plan,
+            first_name='Vorname',
+            last_name='Nachname',
+            address_line='Strasse 1',
+            postcode='8000',
+            town='Zürich'
+        )
+        self.period = Period.objects.create(
+            subscription=subscription,
+            start_date=datetime.date(2020, 3, 1),
+            end_date=datetime.date(2021, 3, 1)
+        )
+        Payment.objects.create(period=self.period, amount=20, due_on=datetime.date(2020, 3, 1), paid_at=timezone.now())
+
+    def get_statistics(self, **headers):
+        return self.client.get(
+            reverse('administration_statistics_data'), {'start': '2020-01', 'end': '2020-06'}, **headers
+        )
+
+    def test_statistics_etag_after_refresh(self):
+        MonthlySubscriptionStats.objects.all().delete()
+
+        # The first request computes the months, which changes the version
+        response = self.get_statistics()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['new'][2], 1)
+
+        response = self.get_statistics(HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_statistics_etag_changes_with_data(self):
+        etag = self.get_statistics()['ETag']
+
+        self.period.end_date = datetime.date(2020, 5, 15)
+        self.period.save()
+
+        response = self.get_statistics(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['expired'][4], 1)
+
+    def test_csv_export_etag(self):
+        url = reverse('administration_subscription_export', kwargs={'format': 'csv'})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_ods_export_redirect_has_no_etag(self):
+        url = reverse('administration_subscription_export', kwargs={'format': 'ods'})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH='*')
+        self.assertRedirects(response, reverse('administration_home'), fetch_redirect_response=False)
+        self.assertFalse(response.has_header('ETag'))
+
+
+class ExportJobTests(TestCase):
+    """
+    Tests requesting, claiming, running and downloading export jobs.
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        export_root = override_settings(EXPORT_ROOT=directory.name)
+        export_root.enable()
+        self.addCleanup(export_root.disable)
+
+        self.admin_user = User.objects.create_superuser('admin@example.com', 'password', first_name='A', last_name='B')
+        self.client.force_login(self.admin_user)
+
+        today = timezone.now().date()
+        subscription = Subscription.objects.create(
+            plan=Plan.objects.create(name='Studierende', slug='studierende', price=20),
+            first_name='Vorname',
+            last_name='Nachname',
+            address_line='Strasse 1',
+            postcode='8000',
+            town='Zürich'
+        )
+        period = Period.objects.create(
+            subscription=subscription,
+            start_date=today - datetime.timedelta(days=30),
+            end_date=today + datetime.timedelta(days=335)
+        )
+        Payment.objects.create(period=period, amount=20, due_on=today, paid_at=timezone.now())
+
+    def test_identical_requests_reuse_job(self):
+        job, created = ExportJob.objects.request('xlsx', self.admin_user)
+        self.assertTrue(created)
+        self.assertEqual(ExportJob.objects.request('xlsx'), (job, False))
+
+        # Other formats and finished jobs are not reused
+        self.assertTrue(ExportJob.objects.request('ods')[1])
+        job.status = ExportJob.FINISHED
+        job.save()
+        other, created = ExportJob.objects.request('xlsx')
+        self.assertTrue(created)
+        self.assertNotEqual(other, job)
+        self.assertEqual(ExportJob.objects.count(), 3)
+
+    def test_request_after_other_job_finished(self):
+        create = ExportJob.objects.create
+
+        def create_after_conflict(**kwargs):
+            # Another request created a job first, which finished before it could be fetched
+            if patched.call_count == 1:
+                raise IntegrityError()
+            return create(**kwargs)
+
+        with mock.patch.object(ExportJob.objects, 'create', side_effect=create_after_conflict) as patched:
+            job, created = ExportJob.objects.request('xlsx')
+        self.assertTrue(created)
+        self.assertEqual(patched.call_count, 2)
+        self.assertEqual(job.status, ExportJob.PENDING)
+
+    def test_claim(self):
+        first, created = ExportJob.objects.request('ods')
+        second, created = ExportJob.objects.request('xlsx')
+
+        self.assertEqual(ExportJob.objects.claim(), first)
+        job = ExportJob.objects.claim()
+        self.assertEqual((job, job.status), (second, ExportJob.RUNNING))
+        self.assertIsNotNone(job.started_at)
+        self.assertIsNone(ExportJob.objects.claim())
+
+    def test_requeue_stale(self):
+        stale, created = ExportJob.objects.request('ods')
+        running, created = ExportJob.objects.request('xlsx')
+        ExportJob.objects.update(status=ExportJob.RUNNING, exported_rows=10)
+        ExportJob.objects.filter(pk=stale.pk).update(
+            updated_at=timezone.now() - settings.EXPORT_JOB_TIMEOUT - datetime.timedelta(minutes=1)
+        )
+
+        self.assertEqual(ExportJob.objects.requeue_stale(), 1)
+        stale.refresh_from_db()
+        running.refresh_from_db()
+        self.assertEqual((stale.status, stale.exported_rows), (ExportJob.PENDING, 0))
+        self.assertEqual((running.status, running.exported_rows), (ExportJob.RUNNING, 10))
+        self.assertEqual(ExportJob.objects.claim(), stale)
+
+    def test_run_export_jobs(self):
+        job, created = ExportJob.objects.request('xlsx')
+        stdout = StringIO()
+        call_command('run_export_jobs', '--once', stdout=stdout)
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.exported_rows, job.progress()), (ExportJob.FINISHED, 1, 100))
+        self.assertTrue(os.path.exists(job.path))
+        self.assertIn('finished with 1 rows', stdout.getvalue())
+
+        response = self.client.get(reverse('administration_export_job_download', args=[job.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="{}"'.format(job.file_name))
+        response.close()
+
+    def test_failed_export_job(self):
+        job, created = ExportJob.objects.request('ods')
+        with mock.patch.object(ExportJob, 'run', side_effect=RuntimeError('Fehler')), \
+                self.assertLogs('subscription_manager.administration.management.commands.run_export_jobs'):
+            call_command('run_export_jobs', '--once', stdout=StringIO(), stderr=StringIO())
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, ExportJob.FAILED)
+        self.assertIn('RuntimeError: Fehler', job.error)
+        self.assertIsNotNone(job.finished_at)
+
+    def test_download_unfinished_job(self):
+        job, created = ExportJob.objects.request('xlsx')
+        url = reverse('administration_export_job_download', args=[job.pk])
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+        ExportJob.objects.claim()
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+        # Finished, but the document has been removed
+        ExportJob.objects.filter(pk=job.pk).update(status=ExportJob.FINISHED, file_name='missing.xlsx')
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_delete_expired(self):
+        ExportJob.objects.request('xlsx')
+        call_command('run_export_jobs', '--once', stdout=StringIO())
+        expired = ExportJob.objects.get()
+        recent, created = ExportJob.objects.request('xlsx')
+        recent.status = ExportJob.FAILED
+        recent.save()
+        pending, created = ExportJob.objects.request('xlsx')
+        ExportJob.objects.exclude(pk=recent.pk).update(
+            created_at=timezone.now() - settings.EXPORT_RETENTION - datetime.timedelta(days=1)
+        )
+
+        ExportJob.objects.delete_expired()
+        self.assertEqual(set(ExportJob.objects.all()), {recent, pending})
+        self.assertFalse(os.path.exists(expired.path))
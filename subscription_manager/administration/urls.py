@@ -1,12 +1,15 @@
 from django.urls import path
 
 from .views import AdministrationHomeView, AdministrationStatisticsView, AdministrationStatisticsDataView,\
-    AdministrationPaymentListView, AdministrationSubscriptionExportView, payment_confirm
+    AdministrationPaymentListView, AdministrationSubscriptionExportView, export_job_download, payment_confirm, \
+    payments_confirm
 
 urlpatterns = [
     path('', AdministrationHomeView.as_view(), name='administration_home'),
     path('exportieren/<str:format>/', AdministrationSubscriptionExportView.as_view(), name='administration_subscription_export'),
+    path('exporte/<int:export_job_id>/herunterladen/', export_job_download, name='administration_export_job_download'),
     path('zahlungen/', AdministrationPaymentListView.as_view(), name='administration_payment_list'),
+    path('zahlungen/bestätigen/', payments_confirm, name='administration_payments_confirm'),
     path('zahlungen/<int:payment_id>/bestätigen/', payment_confirm, name='administration_payment_confirm'),
     path('statistik/', AdministrationStatisticsView.as_view(), name='administration_statistics'),
     path('statistik/daten/', AdministrationStatisticsDataView.as_view(), name='administration_statistics_data'),
@@ -6,16 +6,21 @@ from django.contrib import messages
 from django.contrib.admin.views.decorators import staff_member_required
 from django.core.exceptions import ValidationError
 from django.db.models import Q
-from django.http import JsonResponse
-from django.shortcuts import get_object_or_404, redirect, HttpResponse, Http404
+from django.http import FileResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, redirect, Http404
 from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
+from django.views.decorators.http import condition, require_POST
 from django.views.generic import ListView, TemplateView, View
 from django.utils import timezone
 
 from subscription_manager.payment.models import Payment
-from subscription_manager.subscription.models import Subscription, Period
+from subscription_manager.subscription.models import MonthlySubscriptionStats, Subscription
 from subscription_manager.subscription.admin import ActiveSubscriptionResource
+from subscription_manager.utils.conditional import versioned_etag
+from subscription_manager.utils.pagination import KeysetPaginator
+
+from .models import ExportJob
+
 
 @method_decorator(staff_member_required(login_url='login'), name='dispatch')
 class AdministrationHomeView(TemplateView):
@@ -27,9 +32,11 @@ class AdministrationHomeView(TemplateView):
 
     def get_context_data(self, **kwargs):
         """
-        Adds number of active subscriptions to the context.
+        Adds number of active subscriptions and the latest
+        exports to the context.
         """
         kwargs['active_subscriptions'] = Subscription.objects.filter(is_active=True).count()
+        kwargs['export_jobs'] = ExportJob.objects.order_by('-created_at')[:5]
 
         return super().get_context_data(**kwargs)
 
@@ -41,7 +48,7 @@ class AdministrationPaymentListView(ListView):
     """
     context_object_name = 'payments'
     template_name = 'administration/administration_payment_list.html'
-    ordering = '-created_at'
+    ordering = ('-created_at', '-pk')
     paginate_by = 10
 
     def get_queryset(self):
@@ -52,24 +59,39 @@ class AdministrationPaymentListView(ListView):
         queryset = Payment.objects.filter(paid_at__isnull=True, amount__gt=0).select_related('period__subscription__user')
 
         # If a query is specified filter results for payments that have the query
-        # as first name, last name or code
-        user_query = self.request.GET.get('query')
-        if user_query is not None and user_query != '':
+        # as code or whose subscription's names, email address or address contain it
+        user_query = self.get_search_query()
+        if user_query:
             payment_codes = re.findall(r'\d+', user_query)
             queryset = queryset.filter(
                 Q(pk__in=payment_codes) |
-                Q(period__subscription__first_name__icontains=user_query) | Q(period__subscription__last_name__icontains=user_query) |
-                Q(period__subscription__user__first_name__icontains=user_query) | Q(period__subscription__user__last_name__icontains=user_query)
+                Subscription.objects.get_search_condition(user_query, prefix='period__subscription__')
+            ).annotate(
+                search_rank=Subscription.objects.get_search_rank(user_query, prefix='period__subscription__')
             )
 
-        ordering = self.get_ordering()
-        if ordering:
-            if isinstance(ordering, str):
-                ordering = (ordering,)
-            queryset = queryset.order_by(*ordering)
-
         return queryset
 
+    def get_search_query(self):
+        return self.request.GET.get('query', '').strip()
+
+    def get_ordering(self):
+        """
+        Orders search results by the rank of their subscription first.
+        """
+        if self.get_search_query():
+            return ('-search_rank',) + self.ordering
+        return self.ordering
+
+    def paginate_queryset(self, queryset, page_size):
+        """
+        Paginates the payments with cursors instead of page numbers,
+        so that later pages are as fast as the first one.
+        """
+        paginator = KeysetPaginator(queryset, page_size, self.get_ordering())
+        page = paginator.get_page(self.request.GET.get('after'), self.request.GET.get('before'))
+        return paginator, page, page.object_list, page.has_other_pages()
+
 
 @staff_member_required(login_url='login')
 def payment_confirm(request, payment_id):
@@ -83,11 +105,35 @@ def payment_confirm(request, payment_id):
     return redirect('administration_payment_list')
 
 
+@staff_member_required(login_url='login')
+@require_POST
+def payments_confirm(request):
+    """
+    Confirms all selected unpaid payments at once.
+    """
+    payment_ids = [payment_id for payment_id in request.POST.getlist('payment') if payment_id.isdigit()]
+    payments = Payment.objects.confirm_many(Payment.objects.filter(pk__in=payment_ids, amount__gt=0))
+    if payments:
+        messages.success(request, '{} Zahlungen wurden bestätigt.'.format(len(payments)))
+    return redirect('administration_payment_list')
+
+
+def get_export_versions(request, *args, **kwargs):
+    """
+    Returns the values on which the .csv export depends: the
+    subscriptions and the date in the file name.
+    """
+    return kwargs.get('format'), Subscription.objects.get_data_version(), timezone.now().date()
+
+
 @method_decorator(staff_member_required(login_url='login'), name='dispatch')
 class AdministrationSubscriptionExportView(View):
     """
-    Exports active subscriptions' addresses as .csv,
-    .ods, and .xlsx documents.
+    Exports active subscriptions' addresses. .csv documents are
+    streamed directly, whereas .ods and .xlsx documents are rendered
+    in the background by an export job. A .csv document which has
+    not changed since the last download is answered with 304 Not
+    Modified.
     """
     format = 'csv'  # Default format is .csv
 
@@ -106,37 +152,24 @@ class AdministrationSubscriptionExportView(View):
 
         return super().dispatch(request, *args, **kwargs)
 
-    def content_type(self):
-        """
-        Return the format's corresponding content type.
-        """
-        if self.format == 'csv':
-            return 'text/csv'
-        elif self.format == 'ods':
-            return 'application/vnd.oasis.opendocument.spreadsheet'
-        elif self.format == 'xlsx':
-            return 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        return ''
-
-    def content(self):
+    def get(self, request, *args, **kwargs):
         """
-        Return the content formatted as the requested document.
+        Return the .csv document as an attachement, streamed line by
+        line. Other formats have to be requested via post.
         """
-        if self.format == 'csv':
-            return ActiveSubscriptionResource().export().csv
-        elif self.format == 'ods':
-            return ActiveSubscriptionResource().export().ods
-        elif self.format == 'xlsx':
-            return ActiveSubscriptionResource().export().xlsx
-        return ''
+        if self.format != 'csv':
+            return redirect('administration_home')
+        return self.export_csv(request, *args, **kwargs)
 
-    def get(self, request, *args, **kwargs):
+    @method_decorator(condition(etag_func=versioned_etag(get_export_versions)))
+    def export_csv(self, request, *args, **kwargs):
         """
-        Return the document as an attachement.
+        Streams the .csv document. Unchanged documents are answered
+        with 304 Not Modified.
         """
-        response = HttpResponse(
-            content=self.content(),
-            content_type=self.content_type()
+        response = StreamingHttpResponse(
+            ActiveSubscriptionResource().export_csv_lines(),
+            content_type='text/csv'
         )
         response['Content-Disposition'] = 'attachment; filename="{}-active-subscriptions.{}"'.format(
             timezone.now().strftime('%Y-%m-%d'),
@@ -144,6 +177,35 @@ class AdministrationSubscriptionExportView(View):
         )
         return response
 
+    def post(self, request, *args, **kwargs):
+        """
+        Request an export job for the .ods or .xlsx document. If such
+        a job is already waiting or running, it is reused.
+        """
+        if self.format == 'csv':
+            return redirect('administration_subscription_export', format='csv')
+
+        job, created = ExportJob.objects.request(self.format, request.user)
+        if created:
+            messages.success(request, 'Der Export als .{}-Datei wird erstellt. Sobald er fertig ist, kannst du ihn unten herunterladen.'.format(self.format))
+        else:
+            messages.info(request, 'Der Export als .{}-Datei wird bereits erstellt.'.format(self.format))
+        return redirect('administration_home')
+
+
+@staff_member_required(login_url='login')
+def export_job_download(request, export_job_id):
+    """
+    Returns the document of a finished export job as an attachment.
+    If the job or its document does not exist, a 404 page is shown.
+    """
+    job = get_object_or_404(ExportJob, pk=export_job_id, status=ExportJob.FINISHED)
+    try:
+        file = open(job.path, 'rb')
+    except FileNotFoundError:
+        raise Http404()
+    return FileResponse(file, as_attachment=True, filename=job.file_name)
+
 
 @method_decorator(staff_member_required(login_url='login'), name='dispatch')
 class AdministrationStatisticsView(TemplateView):
@@ -154,15 +216,31 @@ class AdministrationStatisticsView(TemplateView):
     template_name = 'administration/administration_statistics.html'
 
 
+def get_statistics_versions(request, *args, **kwargs):
+    """
+    Returns the values on which the statistics data depends. Missing
+    and stale months of the requested time frame are recomputed first,
+    as this changes the version.
+    """
+    try:
+        start_year, start_month, end_year, end_month = AdministrationStatisticsDataView.validate_parameters(request)
+    except ValidationError:
+        return request.GET.get('start'), request.GET.get('end')
+
+    MonthlySubscriptionStats.objects.refresh_missing(
+        datetime.date(start_year, start_month, 1),
+        datetime.date(end_year, end_month, 1)
+    )
+    return request.GET['start'], request.GET['end'], MonthlySubscriptionStats.objects.get_data_version()
+
+
 @method_decorator(staff_member_required(login_url='login'), name='dispatch')
-@method_decorator(cache_page(24*60*60), name='dispatch')
+@method_decorator(condition(etag_func=versioned_etag(get_statistics_versions)), name='get')
 class AdministrationStatisticsDataView(View):
     """
-    Returns statistics data in JSON format.
+    Returns statistics data in JSON format. Unchanged data is
+    answered with 304 Not Modified.
     """
-    lower_bound_date = datetime.date.min
-    upper_bound_date = datetime.date.max
-
     def get(self, request, *args, **kwargs):
         """
         Returns a JSON response containing all the statistics data
@@ -177,13 +255,6 @@ class AdministrationStatisticsDataView(View):
                 'error': e.message
             })
 
-        # Store the lower and upper bound of subscription periods in order to
-        # not unnecessarily query the database
-        periods = Period.objects.filter(start_date__isnull=False, end_date__isnull=False).order_by('start_date')
-        if periods is not None:
-            self.lower_bound_date = periods.first().start_date
-            self.upper_bound_date = periods.last().end_date
-
         # Get data
         data_list_of_dicts = self.get_data(start_year, start_month, end_year, end_month)
 
@@ -193,7 +264,8 @@ class AdministrationStatisticsDataView(View):
 
         return JsonResponse(data_dict_of_lists)
 
-    def validate_parameters(self, request):
+    @staticmethod
+    def validate_parameters(request):
         """
         Checks whether the start and end parameter are in a valid
         format. If they are, it trims them to the period in which
@@ -227,51 +299,21 @@ class AdministrationStatisticsDataView(View):
 
     def get_data(self, start_year, start_month, end_year, end_month):
         """
-        Loops over each month, gathers the relevant data and
-        arranges it into a dictionary.
+        Gathers the stored statistics of all months in the requested
+        time frame and arranges them into a dictionary.
         """
-        data = dict()
-
-        if start_year == end_year:
-            year = start_year
-            for month in range(start_month, end_month + 1):
-                data.update(self.get_data_by_month(year, month))
-        else:
-            for year in range(start_year, end_year + 1):
-                if year == start_year:
-                    for month in range(start_month, 12 + 1):
-                        data.update(self.get_data_by_month(year, month))
-                elif year == end_year:
-                    for month in range(1, end_month + 1):
-                        data.update(self.get_data_by_month(year, month))
-                else:
-                    for month in range(1, 12 + 1):
-                        data.update(self.get_data_by_month(year, month))
-
-        return data
+        statistics = MonthlySubscriptionStats.objects.get_statistics(
+            datetime.date(start_year, start_month, 1),
+            datetime.date(end_year, end_month, 1)
+        )
 
-    def get_data_by_month(self, year, month):
-        """
-        Returns a dictionary containing the aggregated values of the
-        requested month.
-        """
-        if self.lower_bound_date.year > year or (self.lower_bound_date.year == year and self.lower_bound_date.month > month) \
-                or self.upper_bound_date.year < year or (self.upper_bound_date.year == year and self.lower_bound_date.month < month):
-            # If request month is out of range, return zero values.
-            return {
-                '{} {}'.format(calendar.month_abbr[month], year % 100): {
-                    'active': 0,
-                    'new': 0,
-                    'renewed': 0,
-                    'expired': 0,
-                }
+        data = dict()
+        for month, values in statistics.items():
+            data['{} {}'.format(calendar.month_abbr[month.month], month.year % 100)] = {
+                'active': values['active'],
+                'new': values['new'],
+                'renewed': values['renewed'],
+                'expired': values['expired'] + values['canceled'],
             }
 
-        return {
-            '{} {}'.format(calendar.month_abbr[month], year % 100): {
-                'active': Subscription.objects.get_active_by_month(year, month).count(),
-                'new': Subscription.objects.get_new_by_month(year, month).count(),
-                'renewed': Subscription.objects.get_renewed_by_month(year, month).count(),
-                'expired': Subscription.objects.get_expired_by_month(year, month).count() + Subscription.objects.get_canceled_by_month(year, month).count(),
-            }
-        }
+        return data
@@ -0,0 +1,8 @@
+import os
+
+from django.core.asgi import get_asgi_application
+
+# Load production settings
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'subscription_manager.settings.production')
+
+application = get_asgi_application()
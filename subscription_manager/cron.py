@@ -2,18 +2,23 @@ from django_cron import CronJobBase, Schedule
 
 from django.core.management import call_command
 
+from subscription_manager.administration.models import ExportJob
+from subscription_manager.mail.models import OutboundEmail
+from subscription_manager.subscription.models import MonthlySubscriptionStats, Subscription
 from subscription_manager.subscription.tasks import send_expiration_emails
 from subscription_manager.user.models import Token
 
 
 class SendEmails(CronJobBase):
-    schedule = Schedule(run_at_times=['07:00'])
+    schedule = Schedule(run_at_times=['07:00', '12:00', '17:00'])
     code = 'send_emails'
 
     def do(self):
         """
         Send notification emails to users whose subscriptions are
-        expiring within 30 days or whose subscription end in 1 day.
+        expiring within 30 days or whose subscription end in 1 day
+        and who have not been reminded yet. Later runs of the day
+        catch up on reminders missed by earlier ones.
         """
         send_expiration_emails(remaining_days=30)
         send_expiration_emails(remaining_days=1)
@@ -25,8 +30,34 @@ class CleanDatabase(CronJobBase):
 
     def do(self):
         """
-        Clear expired sessions and remove expired tokens
-        each day at 4 am.
+        Clear expired sessions and remove expired tokens,
+        old exports and old sent emails each day at 4 am.
         """
         call_command('clearsessions', '--verbosity=0')
-        Token.objects.all_expired().delete()
\ No newline at end of file
+        Token.objects.all_expired().delete()
+        ExportJob.objects.delete_expired()
+        OutboundEmail.objects.delete_sent()
+
+
+class UpdateSubscriptionStatus(CronJobBase):
+    schedule = Schedule(run_every_mins=60)
+    code = 'update_subscription_status'
+
+    def do(self):
+        """
+        Update the stored status of subscriptions whose periods
+        have started or ended since the last run.
+        """
+        Subscription.objects.update_active_status()
+
+
+class UpdateStatistics(CronJobBase):
+    schedule = Schedule(run_every_mins=60)
+    code = 'update_statistics'
+
+    def do(self):
+        """
+        Recompute the statistics of the current and the previous month
+        and of all months affected by changes, e.g. late payments.
+        """
+        MonthlySubscriptionStats.objects.refresh_outdated()
@@ -0,0 +1,28 @@
+from django.contrib import admin
+from django.utils import timezone
+
+from subscription_manager.utils.pagination import ApproximateCountPaginator
+
+from .models import OutboundEmail
+
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    """
+    Outbound email model admin
+    """
+    list_display = ['subject', 'to', 'status', 'attempts', 'created_at', 'sent_at']
+    list_filter = ['status']
+    search_fields = ['subject', 'to']
+    readonly_fields = ['attempts', 'last_error', 'created_at', 'sent_at']
+    actions = ['retry']
+    paginator = ApproximateCountPaginator
+    show_full_result_count = False
+
+    def retry(self, request, queryset):
+        queryset.exclude(status=OutboundEmail.SENT).update(
+            status=OutboundEmail.QUEUED,
+            attempts=0,
+            next_attempt_at=timezone.now()
+        )
+    retry.short_description = 'Ausgewählte E-Mails erneut senden'
@@ -0,0 +1,111 @@
+import logging
+import queue
+import smtplib
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from subscription_manager.mail.models import OutboundEmail
+
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionPool:
+    """
+    Pool of email backend connections which are kept open between
+    emails. Every connection is only used by one thread at a time.
+    """
+    def __init__(self, size):
+        self.connections = queue.Queue()
+        for _ in range(size):
+            self.connections.put(get_connection(fail_silently=False))
+
+    def send(self, message):
+        """
+        Sends a message over one of the connections. If the server has
+        closed the connection in the meantime, it is opened again once.
+        """
+        connection = self.connections.get()
+        try:
+            try:
+                connection.open()
+                connection.send_messages([message])
+            except smtplib.SMTPServerDisconnected:
+                connection.close()
+                connection.open()
+                connection.send_messages([message])
+        except Exception:
+            connection.close()
+            raise
+        finally:
+            self.connections.put(connection)
+
+    def close(self):
+        """
+        Closes all connections. They are opened again when needed.
+        """
+        for connection in list(self.connections.queue):
+            connection.close()
+
+
+class Command(BaseCommand):
+    help = 'Sends queued emails concurrently. Runs until it is stopped unless --once is given.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Send all due emails and exit.'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=2,
+            help='Seconds to wait between checks for new emails (default: 2)'
+        )
+
+    def handle(self, *args, **options):
+        workers = settings.EMAIL_QUEUE_WORKERS
+        pool = ConnectionPool(workers)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while True:
+                close_old_connections()
+                emails = OutboundEmail.objects.claim(settings.EMAIL_QUEUE_BATCH_SIZE)
+
+                if emails:
+                    self.send(executor, pool, emails)
+                    continue
+
+                # Do not keep idle connections to the mail server open
+                pool.close()
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+
+    def send(self, executor, pool, emails):
+        """
+        Sends the emails in parallel and stores the result of each email
+        as soon as it is known, so that sent emails are not sent again if
+        the worker is stopped before the batch is complete.
+        """
+        futures = {executor.submit(pool.send, email.message()): email for email in emails}
+
+        sent = 0
+        for future in as_completed(futures):
+            email = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                logger.warning('Sending email #%s failed: %s', email.pk, e)
+                OutboundEmail.objects.mark_failed(email, '{}: {}'.format(type(e).__name__, e))
+            else:
+                OutboundEmail.objects.mark_sent([email])
+                sent += 1
+
+        self.stdout.write('Sent {} of {} emails'.format(sent, len(emails)))
@@ -0,0 +1,97 @@
+from django.conf import settings
+from django.db import models
+from django.utils import timezone
+
+
+class OutboundEmailManager(models.Manager):
+
+    def queue(self, message):
+        """
+        Stores an email message (django.core.mail.EmailMessage) in the
+        queue. It is sent by the worker once the current transaction
+        has been committed.
+        """
+        return self.create(
+            subject=message.subject,
+            body=message.body,
+            from_email=message.from_email,
+            to=list(message.to),
+            cc=list(message.cc),
+            bcc=list(message.bcc),
+            reply_to=list(message.reply_to)
+        )
+
+    def queue_many(self, messages):
+        """
+        Stores several email messages in the queue with one query.
+        """
+        return self.bulk_create([
+            self.model(
+                subject=message.subject,
+                body=message.body,
+                from_email=message.from_email,
+                to=list(message.to),
+                cc=list(message.cc),
+                bcc=list(message.bcc),
+                reply_to=list(message.reply_to)
+            )
+            for message in messages
+        ])
+
+    def claim(self, limit):
+        """
+        Marks up to limit due emails as being sent and returns them.
+        Emails which are claimed by another worker in the meantime are
+        skipped. Emails which have been sending for longer than
+        EMAIL_QUEUE_SENDING_TIMEOUT, e.g. because a worker has been
+        killed, are due again.
+        """
+        now = timezone.now()
+        due = self.filter(
+            models.Q(status=self.model.QUEUED, next_attempt_at__lte=now) |
+            models.Q(status=self.model.SENDING, next_attempt_at__lte=now - settings.EMAIL_QUEUE_SENDING_TIMEOUT)
+        ).order_by('next_attempt_at').values_list('pk', 'status', 'next_attempt_at')[:limit]
+
+        claimed = []
+        for pk, status, next_attempt_at in due:
+            # Only succeeds if no other worker has claimed the email in the meantime
+            if self.filter(pk=pk, status=status, next_attempt_at=next_attempt_at).update(
+                status=self.model.SENDING,
+                next_attempt_at=now
+            ):
+                claimed.append(pk)
+        return list(self.filter(pk__in=claimed).order_by('next_attempt_at', 'pk'))
+
+    def mark_sent(self, emails):
+        """
+        Marks the given emails as sent.
+        """
+        return self.filter(pk__in=[email.pk for email in emails]).update(
+            status=self.model.SENT,
+            sent_at=timezone.now(),
+            last_error=''
+        )
+
+    def mark_failed(self, email, error):
+        """
+        Schedules another attempt to send the email with exponential
+        backoff. After EMAIL_QUEUE_MAX_ATTEMPTS attempts, the email is
+        marked as failed.
+        """
+        email.attempts += 1
+        email.last_error = error
+        if email.attempts >= settings.EMAIL_QUEUE_MAX_ATTEMPTS:
+            email.status = self.model.FAILED
+        else:
+            email.status = self.model.QUEUED
+            email.next_attempt_at = timezone.now() + settings.EMAIL_QUEUE_RETRY_DELAY * 2 ** (email.attempts - 1)
+        email.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at'])
+
+    def delete_sent(self):
+        """
+        Deletes sent emails older than EMAIL_QUEUE_RETENTION.
+        """
+        return self.filter(
+            status=self.model.SENT,
+            sent_at__lt=timezone.now() - settings.EMAIL_QUEUE_RETENTION
+        ).delete()
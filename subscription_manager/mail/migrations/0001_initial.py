@@ -0,0 +1,42 @@
+# Generated by Django 3.1.1 on 2026-10-18 15:04
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboundEmail',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject', models.CharField(max_length=255, verbose_name='Betreff')),
+                ('body', models.TextField(verbose_name='Nachricht')),
+                ('from_email', models.CharField(max_length=255, verbose_name='Absender')),
+                ('to', models.JSONField(default=list, verbose_name='Empfänger')),
+                ('cc', models.JSONField(default=list, verbose_name='Kopie')),
+                ('bcc', models.JSONField(default=list, verbose_name='Blindkopie')),
+                ('reply_to', models.JSONField(default=list, verbose_name='Antwort an')),
+                ('status', models.CharField(choices=[('queued', 'In Warteschlange'), ('sending', 'Wird gesendet'), ('sent', 'Gesendet'), ('failed', 'Fehlgeschlagen')], default='queued', max_length=10, verbose_name='Status')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Versuche')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Nächster Versuch am')),
+                ('last_error', models.TextField(blank=True, verbose_name='Letzter Fehler')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Erstellt am')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='Gesendet am')),
+            ],
+            options={
+                'verbose_name': 'Ausgehende E-Mail',
+                'verbose_name_plural': 'Ausgehende E-Mails',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='outboundemail',
+            index=models.Index(fields=['status', 'next_attempt_at'], name='outbound_email_due_idx'),
+        ),
+    ]
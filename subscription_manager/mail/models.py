@@ -0,0 +1,104 @@
+from django.core.mail import EmailMessage
+from django.db import models
+from django.utils import timezone
+
+from .managers import OutboundEmailManager
+
+
+class OutboundEmail(models.Model):
+    """
+    Model that holds an email which is waiting to be sent or has been
+    sent. Emails are queued within the transaction of the request and
+    sent by the send_queued_emails command, so they only go out once
+    the transaction has been committed.
+    """
+    QUEUED = 'queued'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+
+    subject = models.CharField(
+        max_length=255,
+        verbose_name='Betreff'
+    )
+    body = models.TextField(
+        verbose_name='Nachricht'
+    )
+    from_email = models.CharField(
+        max_length=255,
+        verbose_name='Absender'
+    )
+    to = models.JSONField(
+        default=list,
+        verbose_name='Empfänger'
+    )
+    cc = models.JSONField(
+        default=list,
+        verbose_name='Kopie'
+    )
+    bcc = models.JSONField(
+        default=list,
+        verbose_name='Blindkopie'
+    )
+    reply_to = models.JSONField(
+        default=list,
+        verbose_name='Antwort an'
+    )
+    status = models.CharField(
+        max_length=10,
+        choices=(
+            (QUEUED, 'In Warteschlange'),
+            (SENDING, 'Wird gesendet'),
+            (SENT, 'Gesendet'),
+            (FAILED, 'Fehlgeschlagen')
+        ),
+        default=QUEUED,
+        verbose_name='Status'
+    )
+    attempts = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Versuche'
+    )
+    next_attempt_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name='Nächster Versuch am'
+    )
+    last_error = models.TextField(
+        blank=True,
+        verbose_name='Letzter Fehler'
+    )
+    created_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name='Erstellt am'
+    )
+    sent_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Gesendet am'
+    )
+
+    objects = OutboundEmailManager()
+
+    class Meta:
+        verbose_name = 'Ausgehende E-Mail'
+        verbose_name_plural = 'Ausgehende E-Mails'
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbound_email_due_idx')
+        ]
+
+    def __str__(self):
+        return '{} an {}'.format(self.subject, ', '.join(self.to))
+
+    def message(self):
+        """
+        Returns the email as a message which can be sent.
+        """
+        return EmailMessage(
+            subject=self.subject,
+            body=self.body,
+            from_email=self.from_email,
+            to=self.to,
+            cc=self.cc,
+            bcc=self.bcc,
+            reply_to=self.reply_to
+        )
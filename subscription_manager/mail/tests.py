@@ -0,0 +1,113 @@
+import datetime
+import smtplib
+from io import StringIO
+from unittest import mock
+
+from django.core import mail
+from django.core.mail import EmailMessage
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
+from django.db import transaction
+from django.db.models import QuerySet
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from .models import OutboundEmail
+
+
+def message(to):
+    return EmailMessage(subject='Betreff', body='Nachricht', from_email='server@example.com', to=[to])
+
+
+@override_settings(
+    EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+    EMAIL_QUEUE_MAX_ATTEMPTS=3,
+    EMAIL_QUEUE_RETRY_DELAY=datetime.timedelta(minutes=1)
+)
+class OutboundEmailTests(TestCase):
+    """
+    Tests queueing, claiming and sending emails.
+    """
+
+    def queue(self, count):
+        return [OutboundEmail.objects.queue(message('abo-{}@example.com'.format(i))) for i in range(count)]
+
+    def test_queue_in_rolled_back_transaction(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            OutboundEmail.objects.queue(message('abo@example.com'))
+            raise RuntimeError
+        self.assertFalse(OutboundEmail.objects.exists())
+        self.assertEqual(OutboundEmail.objects.claim(10), [])
+
+    def test_claims_do_not_overlap(self):
+        emails = self.queue(5)
+        self.assertEqual(OutboundEmail.objects.claim(2), emails[:2])
+        self.assertEqual(OutboundEmail.objects.claim(10), emails[2:])
+        self.assertEqual(OutboundEmail.objects.claim(10), [])
+
+        # Emails whose sending has timed out are due again
+        OutboundEmail.objects.filter(pk=emails[0].pk).update(
+            next_attempt_at=timezone.now() - datetime.timedelta(hours=1)
+        )
+        self.assertEqual(OutboundEmail.objects.claim(10), emails[:1])
+
+    def test_concurrent_claims_do_not_overlap(self):
+        emails = self.queue(5)
+        update = QuerySet.update
+        claimed_by_other = []
+
+        def update_after_other_claim(queryset, **kwargs):
+            # Another worker claims emails after the due emails have been fetched
+            if patched.call_count == 1:
+                claimed_by_other.extend(OutboundEmail.objects.claim(3))
+            return update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', autospec=True, side_effect=update_after_other_claim) as patched:
+            claimed = OutboundEmail.objects.claim(10)
+
+        self.assertEqual(claimed_by_other, emails[:3])
+        self.assertEqual(claimed, emails[3:])
+
+    def test_mark_failed(self):
+        email, = self.queue(1)
+        for attempt, delay in ((1, 1), (2, 2)):
+            before = timezone.now()
+            OutboundEmail.objects.mark_failed(email, 'Fehler {}'.format(attempt))
+            email.refresh_from_db()
+            self.assertEqual((email.status, email.attempts), (OutboundEmail.QUEUED, attempt))
+            self.assertGreaterEqual(email.next_attempt_at, before + datetime.timedelta(minutes=delay))
+            self.assertLessEqual(email.next_attempt_at, timezone.now() + datetime.timedelta(minutes=delay))
+            self.assertEqual(OutboundEmail.objects.claim(10), [])
+
+        OutboundEmail.objects.mark_failed(email, 'Fehler 3')
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts, email.last_error), (OutboundEmail.FAILED, 3, 'Fehler 3'))
+        OutboundEmail.objects.update(next_attempt_at=timezone.now() - datetime.timedelta(days=1))
+        self.assertEqual(OutboundEmail.objects.claim(10), [])
+
+    def test_send_queued_emails(self):
+        emails = self.queue(3)
+        OutboundEmail.objects.queue(message('fehler@example.com'))
+        send_messages = EmailBackend.send_messages
+
+        def refuse_recipient(backend, messages):
+            if messages[0].to == ['fehler@example.com']:
+                raise smtplib.SMTPRecipientsRefused({'fehler@example.com': (550, b'Unbekannt')})
+            return send_messages(backend, messages)
+
+        stdout = StringIO()
+        with mock.patch.object(EmailBackend, 'send_messages', autospec=True, side_effect=refuse_recipient), \
+                mock.patch.object(OutboundEmail.objects, 'mark_sent', wraps=OutboundEmail.objects.mark_sent) as mark_sent, \
+                self.assertLogs('subscription_manager.mail.management.commands.send_queued_emails', 'WARNING'):
+            call_command('send_queued_emails', '--once', stdout=stdout)
+
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), [email.to[0] for email in emails])
+        self.assertIn('Sent 3 of 4 emails', stdout.getvalue())
+
+        # Every email is marked as sent on its own
+        self.assertEqual(sorted(args[0][0].pk for args, kwargs in mark_sent.call_args_list), [email.pk for email in emails])
+        self.assertEqual(
+            sorted(OutboundEmail.objects.values_list('to', 'status', 'attempts')),
+            sorted([(email.to, OutboundEmail.SENT, 0) for email in emails] + [(['fehler@example.com'], OutboundEmail.QUEUED, 1)])
+        )
+        self.assertTrue(OutboundEmail.objects.get(status=OutboundEmail.QUEUED).last_error.startswith('SMTPRecipientsRefused'))
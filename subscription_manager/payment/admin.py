@@ -1,6 +1,17 @@
-from django.contrib import admin
+import re
 
+from django.contrib import admin, messages
+from django.db.models import Q
+from django.template.response import TemplateResponse
+from django.urls import path
+
+from subscription_manager.subscription.admin import SearchRankChangeList
+from subscription_manager.subscription.models import Subscription
+from subscription_manager.utils.pagination import ApproximateCountPaginator
+
+from .forms import StatementUploadForm
 from .models import Payment
+from .statements import Reconciliation, StatementError
 
 
 class IsPaidListFilter(admin.SimpleListFilter):
@@ -40,6 +51,8 @@ class PaymentAdmin(admin.ModelAdmin):
     ]
     actions = ['confirm_payments']
     list_filter = [IsPaidListFilter, 'method', 'amount']
+    paginator = ApproximateCountPaginator
+    show_full_result_count = False
 
     def account_name_field(self, obj):
         return obj.period.subscription.user.full_name()
@@ -50,9 +63,63 @@ class PaymentAdmin(admin.ModelAdmin):
     address_name_field.short_description = 'Name (Adresse)'
 
     def confirm_payments(self, request, queryset):
-        for obj in queryset:
-            obj.confirm()
+        payments = Payment.objects.confirm_many(queryset)
+        self.message_user(request, '{} Zahlungen wurden bestätigt.'.format(len(payments)), messages.SUCCESS)
     confirm_payments.short_description = 'Ausgewählte Zahlungen bestätigen'
 
+    def get_urls(self):
+        return [
+            path(
+                'kontoauszug/',
+                self.admin_site.admin_view(self.import_statement_view),
+                name='payment_payment_import_statement'
+            )
+        ] + super().get_urls()
+
+    def import_statement_view(self, request):
+        """
+        Imports an uploaded bank statement and confirms the paid
+        payments. Lists the confirmed payments and the transactions
+        which could not be matched.
+        """
+        form = StatementUploadForm(request.POST or None, request.FILES or None)
+        reconciliation = None
+        if request.method == 'POST' and form.is_valid():
+            reconciliation = Reconciliation()
+            try:
+                reconciliation.add_file(form.cleaned_data['file'])
+            except StatementError as error:
+                form.add_error('file', str(error))
+                reconciliation = None
+            else:
+                reconciliation.run(dry_run=form.cleaned_data['dry_run'])
+
+        return TemplateResponse(request, 'admin/payment/payment/import_statement.html', {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Kontoauszug importieren',
+            'form': form,
+            'reconciliation': reconciliation
+        })
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Searches the subscriptions' search documents, which contain all
+        names, instead of each field. Numbers also match the id and the
+        amount. The results are ordered by the rank of their subscription.
+        """
+        if not search_term.strip():
+            return queryset, False
+        numbers = re.findall(r'\d+', search_term)
+        return queryset.filter(
+            Q(pk__in=numbers) | Q(amount__in=numbers) |
+            Subscription.objects.get_search_condition(search_term, prefix='period__subscription__')
+        ).annotate(
+            search_rank=Subscription.objects.get_search_rank(search_term, prefix='period__subscription__')
+        ), False
+
+    def get_changelist(self, request, **kwargs):
+        return SearchRankChangeList
+
     def get_queryset(self, request):
         return super().get_queryset(request).prefetch_related('period__subscription__user')
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class PaymentConfig(AppConfig):
     name = 'subscription_manager.payment'
+
+    def ready(self):
+        # Connect signal receivers
+        from . import signals  # noqa: F401
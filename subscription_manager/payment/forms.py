@@ -52,3 +52,18 @@ class PaymentForm(forms.ModelForm):
             self.add_error('amount', 'Der Preis muss mindestens {} Franken betragen.'.format(self.plan.price))
 
         return amount
+
+
+class StatementUploadForm(forms.Form):
+    """
+    Upload form for camt.053 and camt.054 bank statements.
+    """
+    file = forms.FileField(
+        label='Kontoauszug',
+        help_text='ISO-20022-Datei im Format camt.053 oder camt.054'
+    )
+    dry_run = forms.BooleanField(
+        required=False,
+        label='Nur prüfen',
+        help_text='Zeigt die Zahlungen an, ohne sie zu bestätigen.'
+    )
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from subscription_manager.payment.statements import Reconciliation, StatementError
+
+
+class Command(BaseCommand):
+    help = (
+        'Imports camt.053 or camt.054 bank statements and confirms all open payments whose codes occur '
+        'in incoming transactions with a sufficient amount. Other transactions with payment codes are reported.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+', help='camt.053 or camt.054 XML files')
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report the payments which would be confirmed.'
+        )
+
+    def handle(self, *args, **options):
+        reconciliation = Reconciliation()
+        for path in options['files']:
+            try:
+                with open(path, 'rb') as file:
+                    reconciliation.add_file(file)
+            except (OSError, StatementError) as error:
+                raise CommandError('{}: {}'.format(path, error))
+
+        payments = reconciliation.run(dry_run=options['dry_run'])
+
+        for transaction, message in reconciliation.problems:
+            self.stdout.write(self.style.WARNING('{}, {} {}, "{}": {}'.format(
+                transaction.booking_date, transaction.amount, transaction.currency, transaction.text, message
+            )))
+        self.stdout.write('{} transactions with payment codes, {} payments {}, {} reported.'.format(
+            len(reconciliation.transactions),
+            len(payments),
+            'to confirm' if options['dry_run'] else 'confirmed',
+            len(reconciliation.problems)
+        ))
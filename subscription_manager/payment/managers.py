@@ -0,0 +1,94 @@
+from django.apps import apps
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.db import models, transaction
+from django.db.models import Exists, OuterRef
+from django.template.loader import get_template
+from django.utils import timezone
+
+
+class PaymentManager(models.Manager):
+
+    def with_renewal(self, queryset=None):
+        """
+        Annotates the given payments (or all payments) with whether they
+        are for a renewal, i.e. whether their subscription has more than
+        one period.
+        """
+        if queryset is None:
+            queryset = self.all()
+
+        period_model = apps.get_model('subscription', 'Period')
+        return queryset.annotate(
+            renewal=Exists(
+                period_model.objects.filter(
+                    subscription=OuterRef('period__subscription')
+                ).exclude(pk=OuterRef('period'))
+            )
+        )
+
+    @transaction.atomic
+    def confirm_many(self, queryset):
+        """
+        Confirms all unpaid payments of the given queryset at once: sets
+        their paid at datetime, moves the periods of payments received
+        after the start date, queues a confirmation email per payment and
+        updates the subscriptions. The number of queries does not depend
+        on the number of payments. Returns the confirmed payments.
+        """
+        period_model = apps.get_model('subscription', 'Period')
+        subscription_model = apps.get_model('subscription', 'Subscription')
+
+        # Lock the payments, so that a payment cannot be confirmed twice
+        payments = list(
+            self.with_renewal(queryset.filter(paid_at__isnull=True))
+            .select_related('period__subscription__plan', 'period__subscription__user')
+            .select_for_update(of=('self',))
+            .order_by('pk')
+        )
+        if not payments:
+            return []
+
+        now = timezone.now()
+        self.filter(pk__in=[payment.pk for payment in payments]).update(paid_at=now)
+
+        # Adjust period intervals if payments are received after already set start dates
+        periods = []
+        for payment in payments:
+            payment.paid_at = now
+            period = payment.period
+            if period.start_date is None or now.date() > period.start_date:
+                period.start_date = now.date()
+                period.end_date = (now + period.subscription.plan.duration).date()
+                periods.append(period)
+        period_model.objects.bulk_update(periods, ['start_date', 'end_date'], batch_size=500)
+
+        # Queue confirmation emails, rendered with the same template instances
+        templates = {
+            False: ('Abo aktiviert', get_template('emails/payment_confirmation_new.txt')),
+            True: ('Abo verlängert', get_template('emails/payment_confirmation_renewal.txt'))
+        }
+        messages = []
+        for payment in payments:
+            subscription = payment.period.subscription
+            if subscription.user is None:
+                continue
+            subject, template = templates[payment.renewal]
+            messages.append(EmailMessage(
+                subject=settings.EMAIL_SUBJECT_PREFIX + subject,
+                body=template.render({
+                    'to_name': subscription.user.first_name,
+                    'payment': payment
+                }),
+                from_email=settings.DEFAULT_FROM_EMAIL,
+                reply_to=[settings.DEFAULT_REPLY_TO_EMAIL],
+                to=[subscription.user.email]
+            ))
+        apps.get_model('mail', 'OutboundEmail').objects.queue_many(messages)
+
+        # Saving payments one by one updates their subscriptions through
+        # signals, which are not sent for bulk updates
+        subscription_model.objects.handle_changes(
+            subscription_model.objects.filter(pk__in={payment.period.subscription_id for payment in payments})
+        )
+        return payments
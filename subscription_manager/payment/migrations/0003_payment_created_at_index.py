@@ -0,0 +1,17 @@
+# Generated by Django 3.1.1 on 2026-10-18 15:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment', '0002_payment_period'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['created_at', 'id'], name='payment_pay_created_a0fd38_idx'),
+        ),
+    ]
@@ -4,8 +4,11 @@ from django.db import models, IntegrityError, transaction
 from django.template.loader import render_to_string
 from django.utils import timezone
 
+from subscription_manager.mail.models import OutboundEmail
 from subscription_manager.subscription.models import Period, Subscription
 
+from .managers import PaymentManager
+
 
 class Payment(models.Model):
     period = models.OneToOneField(
@@ -39,9 +42,13 @@ class Payment(models.Model):
         verbose_name='Erstellt am'
     )
 
+    objects = PaymentManager()
+
     class Meta:
         verbose_name = 'Zahlung'
         verbose_name_plural = 'Zahlungen'
+        # Used by the keyset pagination of the payment list
+        indexes = [models.Index(fields=['created_at', 'id'])]
 
     def __str__(self):
         return 'Zahlung #{} ({} Franken, {}, {})'.format(self.pk, self.amount, self.get_method_display(), self.paid_at)
@@ -62,8 +69,12 @@ class Payment(models.Model):
 
     def is_renewal(self):
         """
-        Returns true if the payment is for a renewal.
+        Returns true if the payment is for a renewal. Uses the
+        annotation of PaymentManager.with_renewal if the payment
+        has been loaded with it.
         """
+        if hasattr(self, 'renewal'):
+            return self.renewal
         return self.period.subscription.period_set.count() > 1
     is_renewal.boolean = True
 
@@ -100,7 +111,7 @@ class Payment(models.Model):
 
     def send_invoice(self):
         """
-        Sends an email that contains the payment details
+        Queues an email that contains the payment details
         for this payment.
         """
         if not self.is_renewal():
@@ -121,41 +132,15 @@ class Payment(models.Model):
             to=[self.period.subscription.user.email],
             bcc=[settings.ACCOUNTING_EMAIL]  # Add accounting email
         )
-        email.send(fail_silently=False)
+        OutboundEmail.objects.queue(email)
 
     def confirm(self):
         """
         Confirms a payment by activating the subscription
-        and sending a confirmation email.
+        and queueing a confirmation email. See
+        PaymentManager.confirm_many.
         """
-        # Confirm payment
-        self.paid_at = timezone.now()
-        self.save()
-
-        # Adjust period interval if payment is received after already set start date
-        if self.paid_at.date() > self.period.start_date:
-            self.period.start_date = self.paid_at.date()
-            self.period.end_date = (self.paid_at + self.period.subscription.plan.duration).date()
-            self.period.save()
-
-        if not self.is_renewal():
-            # New subscription
-            subject = 'Abo aktiviert'
-            template = 'emails/payment_confirmation_new.txt'
-        else:
-            # Renewal subscription
-            subject = 'Abo verlängert'
-            template = 'emails/payment_confirmation_renewal.txt'
-
-        # Send confirmation email
-        email = EmailMessage(
-            subject=settings.EMAIL_SUBJECT_PREFIX + subject,
-            body=render_to_string(template, {
-                'to_name': self.period.subscription.user.first_name,
-                'payment': self
-            }),
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            reply_to=[settings.DEFAULT_REPLY_TO_EMAIL],
-            to=[self.period.subscription.user.email]
-        )
-        email.send(fail_silently=False)
+        payments = Payment.objects.confirm_many(Payment.objects.filter(pk=self.pk))
+        if payments:
+            self.paid_at = payments[0].paid_at
+            self.period = payments[0].period
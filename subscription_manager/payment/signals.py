@@ -0,0 +1,16 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from subscription_manager.subscription.models import Subscription
+
+from .models import Payment
+
+
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+def payment_changed(sender, instance, **kwargs):
+    """
+    Updates the stored status and statistics of the subscription
+    to which a created, confirmed, changed or deleted payment belongs.
+    """
+    Subscription.objects.handle_changes(Subscription.objects.filter(period=instance.period_id))
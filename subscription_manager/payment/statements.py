@@ -0,0 +1,212 @@
+import collections
+import datetime
+import decimal
+import re
+
+from defusedxml import DefusedXmlException
+from defusedxml.ElementTree import ParseError, iterparse
+
+from .models import Payment
+
+
+# Payment codes (see Payment.code) in remittance information, e.g. "ZS-123" or "zs 123".
+# Longer numbers are no payment ids and would exceed the integer range of the database.
+CODE_PATTERN = re.compile(r'\bZS[-\s]?(\d{1,9})\b', re.IGNORECASE)
+
+# Root elements of ISO 20022 bank to customer statements (camt.053)
+# and debit/credit notifications (camt.054)
+DOCUMENT_TYPES = ('BkToCstmrStmt', 'BkToCstmrDbtCdtNtfctn')
+
+Transaction = collections.namedtuple('Transaction', ['payment_ids', 'amount', 'currency', 'booking_date', 'text'])
+
+
+class StatementError(ValueError):
+    """
+    Raised if a file is not a valid camt.053 or camt.054 document.
+    """
+
+
+def local_name(element):
+    """
+    Returns the tag of an element without namespace.
+    """
+    return element.tag.rsplit('}', 1)[-1]
+
+
+def find(element, *path):
+    """
+    Returns the first descendant of an element at the given path
+    of tags without namespaces, or None.
+    """
+    for name in path:
+        element = next((child for child in element if local_name(child) == name), None)
+        if element is None:
+            break
+    return element
+
+
+def find_text(element, *path):
+    element = find(element, *path)
+    if element is None or element.text is None:
+        return None
+    return element.text.strip()
+
+
+def parse_transaction(element, amount_element, booking_date):
+    """
+    Returns the transaction of an entry or of an entry's transaction
+    details. All remittance information is searched for payment codes.
+    """
+    texts = [
+        child.text.strip()
+        for child in element.iter()
+        if local_name(child) in ('Ustrd', 'Ref', 'AddtlNtryInf', 'AddtlTxInf') and child.text
+    ]
+    text = ' '.join(texts)
+    try:
+        amount = decimal.Decimal(amount_element.text.strip())
+    except (AttributeError, decimal.InvalidOperation):
+        raise StatementError('Ungültiger Betrag in der Buchung "{}".'.format(text))
+
+    return Transaction(
+        payment_ids=frozenset(int(payment_id) for payment_id in CODE_PATTERN.findall(text)),
+        amount=amount,
+        currency=amount_element.get('Ccy', ''),
+        booking_date=booking_date,
+        text=text
+    )
+
+
+def parse_entry(entry):
+    """
+    Returns the incoming transactions of an entry (Ntry). A batch
+    booking contains several transactions, each with its own details.
+    Reversals and outgoing payments are skipped.
+    """
+    if find_text(entry, 'CdtDbtInd') != 'CRDT' or find_text(entry, 'RvslInd') == 'true':
+        return []
+
+    booking_date = find_text(entry, 'BookgDt', 'Dt') or find_text(entry, 'BookgDt', 'DtTm')
+    if booking_date is not None:
+        try:
+            booking_date = datetime.datetime.strptime(booking_date[:10], '%Y-%m-%d').date()
+        except ValueError:
+            raise StatementError('Ungültiges Buchungsdatum "{}".'.format(booking_date))
+
+    details = [
+        child
+        for entry_details in entry if local_name(entry_details) == 'NtryDtls'
+        for child in entry_details if local_name(child) == 'TxDtls'
+    ]
+    if len(details) <= 1:
+        return [parse_transaction(entry, find(entry, 'Amt'), booking_date)]
+
+    transactions = []
+    for transaction in details:
+        if find_text(transaction, 'CdtDbtInd') == 'DBIT':
+            continue
+        amount = find(transaction, 'Amt')
+        if amount is None:
+            amount = find(transaction, 'AmtDtls', 'TxAmt', 'Amt')
+        transactions.append(parse_transaction(transaction, amount, booking_date))
+    return transactions
+
+
+def parse_statement(file):
+    """
+    Parses a camt.053 or camt.054 file and yields its incoming
+    transactions. The file is parsed incrementally: every entry is
+    discarded once it has been read, so the memory use does not grow
+    with the size of the file. Raises StatementError if the file
+    cannot be parsed.
+    """
+    parents = []
+    try:
+        for event, element in iterparse(file, events=('start', 'end'), forbid_dtd=True):
+            if event == 'start':
+                if (
+                    len(parents) == 0 and local_name(element) != 'Document' or
+                    len(parents) == 1 and local_name(element) not in DOCUMENT_TYPES
+                ):
+                    raise StatementError('Die Datei ist kein camt.053- oder camt.054-Dokument.')
+                parents.append(element)
+                continue
+
+            parents.pop()
+            if local_name(element) == 'Ntry':
+                yield from parse_entry(element)
+                # Discard the entry
+                parents[-1].remove(element)
+    except (ParseError, DefusedXmlException) as error:
+        raise StatementError('Die Datei konnte nicht gelesen werden ({}).'.format(error))
+
+
+class Reconciliation:
+    """
+    Matches the transactions of bank statements with open payments
+    by their payment codes and confirms the payments which have been
+    paid in full.
+    """
+    currency = 'CHF'
+
+    def __init__(self):
+        self.transactions = []
+        self.confirmed = []
+        self.problems = []
+
+    def add_file(self, file):
+        """
+        Reads the transactions of a camt.053 or camt.054 file.
+        """
+        self.transactions.extend(
+            transaction for transaction in parse_statement(file) if transaction.payment_ids
+        )
+
+    def report(self, transaction, message):
+        self.problems.append((transaction, message))
+
+    def run(self, dry_run=False):
+        """
+        Matches all transactions with open payments in one query and
+        confirms the matched payments at once. Transactions with several
+        payment codes, payment codes occurring in several transactions,
+        unknown or already paid payments, other currencies and amounts
+        below the payment's amount are reported instead. Returns the
+        confirmed payments (or the payments which would be confirmed).
+        """
+        occurrences = collections.Counter(
+            payment_id for transaction in self.transactions for payment_id in transaction.payment_ids
+        )
+        open_payments = dict(
+            Payment.objects.filter(
+                pk__in=list(occurrences), paid_at__isnull=True, amount__gt=0
+            ).values_list('pk', 'amount')
+        )
+
+        matched = []
+        for transaction in self.transactions:
+            if len(transaction.payment_ids) > 1:
+                self.report(transaction, 'Mehrere Zahlungscodes')
+                continue
+
+            payment_id, = transaction.payment_ids
+            code = Payment(pk=payment_id).code
+            if occurrences[payment_id] > 1:
+                self.report(transaction, '{} kommt in mehreren Buchungen vor'.format(code))
+            elif payment_id not in open_payments:
+                self.report(transaction, '{} ist keine offene Zahlung'.format(code))
+            elif transaction.currency != self.currency:
+                self.report(transaction, 'Betrag in {} statt {}'.format(transaction.currency, self.currency))
+            elif transaction.amount < open_payments[payment_id]:
+                self.report(transaction, '{} beträgt {} Franken, bezahlt wurden {} Franken'.format(
+                    code, open_payments[payment_id], transaction.amount
+                ))
+            else:
+                matched.append(payment_id)
+
+        queryset = Payment.objects.filter(pk__in=matched)
+        if dry_run:
+            self.confirmed = list(queryset.select_related('period__subscription__user').order_by('pk'))
+        else:
+            self.confirmed = Payment.objects.confirm_many(queryset)
+        return self.confirmed
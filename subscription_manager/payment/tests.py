@@ -0,0 +1,193 @@
+import datetime
+from io import BytesIO
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from subscription_manager.mail.models import OutboundEmail
+from subscription_manager.subscription.models import Period, Plan, Subscription
+from subscription_manager.user.models import User
+
+from .models import Payment
+from .statements import Reconciliation
+
+
+def statement(*entries):
+    """
+    Returns a camt.053 file with incoming entries of the given
+    amounts and remittance information.
+    """
+    return BytesIO('''<?xml version="1.0" encoding="UTF-8"?>
+<Document xmlns="urn:iso:std:iso:20022:tech:xsd:camt.053.001.04">
+  <BkToCstmrStmt>
+    <Stmt>{}</Stmt>
+  </BkToCstmrStmt>
+</Document>'''.format(''.join(
+        '''
+      <Ntry>
+        <Amt Ccy="CHF">{}</Amt>
+        <CdtDbtInd>CRDT</CdtDbtInd>
+        <BookgDt><Dt>2020-10-01</Dt></BookgDt>
+        <NtryDtls><TxDtls><RmtInf><Ustrd>{}</Ustrd></RmtInf></TxDtls></NtryDtls>
+      </Ntry>'''.format(amount, text)
+        for amount, text in entries
+    )).encode())
+
+
+class ReconciliationTests(TestCase):
+    """
+    Tests matching bank statements with open payments.
+    """
+
+    def setUp(self):
+        plan = Plan.objects.create(name='Studierende', slug='studierende', price=20)
+        user = User.objects.create_user('abo@example.com', first_name='Vorname', last_name='Nachname')
+        subscription = Subscription.objects.create(
+            user=user,
+            plan=plan,
+            first_name='Vorname',
+            last_name='Nachname',
+            address_line='Strasse 1',
+            postcode='8000',
+            town='Zürich'
+        )
+        period = Period.objects.create(subscription=subscription)
+        self.payment = Payment.objects.create(period=period, amount=20, due_on=datetime.date(2020, 10, 31))
+
+    def reconcile(self, *entries):
+        reconciliation = Reconciliation()
+        reconciliation.add_file(statement(*entries))
+        reconciliation.run()
+        return reconciliation
+
+    def test_overpaid_payment_is_confirmed(self):
+        reconciliation = self.reconcile(('25.50', 'Abo {}'.format(self.payment.code)))
+        self.assertEqual([payment.pk for payment in reconciliation.confirmed], [self.payment.pk])
+        self.assertEqual(reconciliation.problems, [])
+        self.payment.refresh_from_db()
+        self.assertTrue(self.payment.is_paid())
+
+    def test_underpaid_payment_is_reported(self):
+        reconciliation = self.reconcile(('19.00', self.payment.code))
+        self.assertEqual(reconciliation.confirmed, [])
+        self.assertEqual(len(reconciliation.problems), 1)
+
+    def test_overlong_code_is_ignored(self):
+        reconciliation = self.reconcile(
+            ('20.00', 'ZS-{}'.format('9' * 30)),
+            ('20.00', 'ZS 12345678901234567890 und {}'.format(self.payment.code))
+        )
+        self.assertEqual(len(reconciliation.transactions), 1)
+        self.assertEqual(reconciliation.transactions[0].payment_ids, {self.payment.pk})
+        self.assertEqual([payment.pk for payment in reconciliation.confirmed], [self.payment.pk])
+
+
+class ConfirmManyTests(TestCase):
+    """
+    Tests confirming several payments at once.
+    """
+
+    def setUp(self):
+        self.plan = Plan.objects.create(name='Studierende', slug='studierende', price=20)
+        self.today = timezone.now().date()
+
+    def create_payment(self, start_date=None, user=True, renewal=False, paid=False):
+        if user:
+            user = User.objects.create_user(
+                'abo-{}@example.com'.format(User.objects.count()), first_name='Vorname', last_name='Nachname'
+            )
+        subscription = Subscription.objects.create(
+            user=user or None,
+            plan=self.plan,
+            first_name='Vorname',
+            last_name='Nachname',
+            address_line='Strasse 1',
+            postcode='8000',
+            town='Zürich'
+        )
+        if renewal:
+            period = Period.objects.create(
+                subscription=subscription,
+                start_date=self.today - datetime.timedelta(days=365),
+                end_date=self.today - datetime.timedelta(days=1)
+            )
+            Payment.objects.create(period=period, amount=20, due_on=self.today, paid_at=timezone.now())
+        end_date = start_date + self.plan.duration if start_date else None
+        period = Period.objects.create(subscription=subscription, start_date=start_date, end_date=end_date)
+        return Payment.objects.create(
+            period=period,
+            amount=20,
+            due_on=self.today,
+            paid_at=timezone.now() - datetime.timedelta(days=3) if paid else None
+        )
+
+    def confirm(self, payments):
+        return Payment.objects.confirm_many(Payment.objects.filter(pk__in=[payment.pk for payment in payments]))
+
+    def test_constant_number_of_queries(self):
+        payment = self.create_payment()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(len(self.confirm([payment])), 1)
+
+        payments = [
+            self.create_payment(
+                start_date=self.today + datetime.timedelta(days=10) if i % 3 == 0 else None,
+                user=i % 4 != 0,
+                renewal=i % 2 == 0
+            )
+            for i in range(20)
+        ]
+        with self.assertNumQueries(len(queries)):
+            self.assertEqual(len(self.confirm(payments)), 20)
+
+    def test_confirmation(self):
+        unpaid = self.create_payment()
+        past = self.create_payment(start_date=self.today - datetime.timedelta(days=30))
+        future = self.create_payment(start_date=self.today + datetime.timedelta(days=10))
+        renewal = self.create_payment(start_date=self.today, renewal=True)
+        without_user = self.create_payment(user=False)
+        paid = self.create_payment(paid=True)
+        paid_at = paid.paid_at
+
+        confirmed = self.confirm([unpaid, past, future, renewal, without_user, paid])
+        self.assertEqual(
+            [payment.pk for payment in confirmed],
+            [unpaid.pk, past.pk, future.pk, renewal.pk, without_user.pk]
+        )
+
+        # Periods which should have started already start today
+        for payment in (unpaid, past, future, renewal, without_user):
+            payment.refresh_from_db()
+            self.assertTrue(payment.is_paid())
+        for payment in (unpaid, past, without_user):
+            self.assertEqual(
+                (payment.period.start_date, payment.period.end_date),
+                (self.today, self.today + self.plan.duration)
+            )
+        self.assertEqual(future.period.start_date, self.today + datetime.timedelta(days=10))
+        self.assertEqual(renewal.period.start_date, self.today)
+
+        # One email per payment of a subscription with a user
+        emails = OutboundEmail.objects.order_by('pk')
+        self.assertEqual(
+            [email.to for email in emails],
+            [[payment.period.subscription.user.email] for payment in (unpaid, past, future, renewal)]
+        )
+        self.assertEqual(
+            [email.subject.endswith('Abo verlängert') for email in emails],
+            [False, False, False, True]
+        )
+
+        # The stored status of the subscriptions has been updated
+        for payment, is_active in ((unpaid, True), (past, True), (future, False), (renewal, True), (without_user, True)):
+            subscription = Subscription.objects.get(pk=payment.period.subscription_id)
+            self.assertTrue(subscription.is_paid)
+            self.assertEqual(subscription.is_active, is_active)
+
+        # Paid payments are not confirmed again
+        paid.refresh_from_db()
+        self.assertEqual(paid.paid_at, paid_at)
+        self.assertEqual(self.confirm([paid, unpaid]), [])
+        self.assertEqual(OutboundEmail.objects.count(), 4)
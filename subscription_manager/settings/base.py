@@ -18,7 +18,9 @@ env = environ.Env(
     EMAIL_PORT=(int, 587),
     EMAIL_HOST_USER=(int, ''),
     EMAIL_HOST_PASSWORD=(int, ''),
-    EMAIL_USE_SSL=(bool, True)
+    EMAIL_USE_SSL=(bool, True),
+
+    REDIS_URL=(str, 'redis://localhost:6379/0')
 )
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -39,6 +41,7 @@ INSTALLED_APPS = [
     'django_cron',
     'import_export',
     'subscription_manager.administration.apps.AdministrationConfig',
+    'subscription_manager.mail.apps.MailConfig',
     'subscription_manager.payment.apps.PaymentConfig',
     'subscription_manager.subscription.apps.SubscriptionConfig',
     'subscription_manager.user.apps.UserConfig'
@@ -99,6 +102,24 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Cache: a small memory cache per process in front of the cache shared by all
+# processes. The shared cache is a memory cache in development and Redis in
+# production. Data which has to be current in all processes at once (sessions,
+# rate limits, cache versions) is stored in the shared cache directly.
+CACHES = {
+    'default': {
+        'BACKEND': 'subscription_manager.utils.cache.TieredCache',
+        'OPTIONS': {
+            'SHARED_ALIAS': 'shared',
+            'LOCAL_TIMEOUT': 5,  # Seconds for which other processes may see outdated entries
+            'MAX_ENTRIES': 1000
+        }
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'
+    }
+}
+
 LOGIN_URL = '/anmelden/'
 LOGIN_REDIRECT_URL = ''
 
@@ -126,9 +147,18 @@ SERVER_EMAIL = 'server@zs-online.ch'
 ADMINS = [('ZS Informatik', 'informatik@medienverein.ch')]
 ACCOUNTING_EMAIL = 'abo@zs-online.ch'
 
+EMAIL_QUEUE_WORKERS = 4  # Parallel connections to the mail server
+EMAIL_QUEUE_BATCH_SIZE = 100
+EMAIL_QUEUE_MAX_ATTEMPTS = 8
+EMAIL_QUEUE_RETRY_DELAY = timezone.timedelta(minutes=1)  # Doubled after every failed attempt
+EMAIL_QUEUE_SENDING_TIMEOUT = timezone.timedelta(minutes=10)
+EMAIL_QUEUE_RETENTION = timezone.timedelta(days=30)
+
 CRON_CLASSES = [
     'subscription_manager.cron.SendEmails',
-    'subscription_manager.cron.CleanDatabase'
+    'subscription_manager.cron.CleanDatabase',
+    'subscription_manager.cron.UpdateSubscriptionStatus',
+    'subscription_manager.cron.UpdateStatistics'
 ]
 
 COMPRESS_ENABLED = True
@@ -143,4 +173,16 @@ LIBSASS_SOURCEMAPS = True
 
 TOKENS_PER_USER_PER_HOUR = 20
 TOKEN_EXPIRATION = timezone.timedelta(days=1)
+# 'database' stores tokens in the database, 'signed' sends signed links instead. The latter requires a
+# shared cache which is not cleared, as used links are remembered in it.
+TOKEN_MODE = 'database'
+EXPIRATION_REMINDER_BATCH_SIZE = 200  # Subscriptions per transaction
+EXPIRATION_REMINDERS_PER_RUN = 2000  # Per kind, the rest follows in the next run
 PERIOD_OF_PAYMENT = timezone.timedelta(days=30)
+
+EXPORT_ROOT = os.path.join(os.path.dirname(BASE_DIR), 'exports')  # Not publicly accessible
+EXPORT_PROGRESS_INTERVAL = 1000  # Rows
+EXPORT_JOB_TIMEOUT = timezone.timedelta(minutes=10)
+EXPORT_RETENTION = timezone.timedelta(days=7)
+
+STATISTICS_BACKEND = 'subscription_manager.subscription.statistics.PythonBackend'
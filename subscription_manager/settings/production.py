@@ -12,6 +12,7 @@ CSRF_COOKIE_SECURE = True
 
 # Server
 WSGI_APPLICATION = 'subscription_manager.wsgi.application'
+ASGI_APPLICATION = 'subscription_manager.asgi.application'
 
 # Database
 DATABASES = {
@@ -26,10 +27,23 @@ DATABASES = {
 }
 CONN_MAX_AGE = None
 
+# Cache
+# Shared by all workers, see CACHES in base.py
+CACHES['shared'] = {
+    'BACKEND': 'django_redis.cache.RedisCache',
+    'LOCATION': env('REDIS_URL'),
+    'OPTIONS': {
+        'CLIENT_CLASS': 'django_redis.client.DefaultClient'
+    }
+}
+
 SESSION_ENGINE = "django.contrib.sessions.backends.cache"
-SESSION_CACHE_ALIAS = "default"
+SESSION_CACHE_ALIAS = "shared"
 SESSION_COOKIE_SECURE = True
 
+# Exports
+EXPORT_ROOT = '/srv/subscription-manager/exports'
+
 # Email
 EMAIL_HOST = env('EMAIL_HOST')
 EMAIL_PORT = env('EMAIL_PORT')
@@ -58,6 +72,11 @@ LOGGING = {
             'handlers': ['file', 'mail_admins'],
             'level': 'DEBUG',
             'propagate': True
+        },
+        'subscription_manager': {
+            'handlers': ['file', 'mail_admins'],
+            'level': 'INFO',
+            'propagate': True
         }
     }
 }
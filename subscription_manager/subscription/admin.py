@@ -1,14 +1,50 @@
+import csv
+import tempfile
+
 from django.contrib import admin
+from django.contrib.admin.views.main import ORDER_VAR, ChangeList
+from django.core.exceptions import PermissionDenied
+from django.http import FileResponse
 from django.shortcuts import reverse
 from django.utils.safestring import mark_safe
 
 from import_export import resources
 from import_export.admin import ExportMixin
+from import_export.formats.base_formats import XLSX
+from import_export.forms import ExportForm
+from import_export.signals import post_export
+
+from subscription_manager.utils.export import write_xlsx
+from subscription_manager.utils.pagination import ApproximateCountPaginator
 
-from .models import Period, Plan, Subscription
+from .models import ExpirationReminder, Period, Plan, PlanEmailDomain, Subscription
 from .tasks import send_expiration_emails
 
 
+class Echo:
+    """
+    File-like object which returns what is written to it instead of
+    storing it. Used to stream CSV lines.
+    """
+    def write(self, value):
+        return value
+
+
+class SearchRankChangeList(ChangeList):
+    """
+    Change list which orders search results by their search rank (see
+    SubscriptionManager.search) unless a column has been chosen to
+    order by. The search results of the model admin have to be
+    annotated with search_rank.
+    """
+    def get_queryset(self, request):
+        # The search results are annotated after the ordering has been applied
+        queryset = super().get_queryset(request)
+        if self.query.strip() and ORDER_VAR not in self.params:
+            queryset = queryset.order_by('-search_rank', *self.get_ordering(request, queryset))
+        return queryset
+
+
 class SubscriptionResource(resources.ModelResource):
     """
     Defines the data resource which can be exported.
@@ -17,19 +53,38 @@ class SubscriptionResource(resources.ModelResource):
         model = Subscription
         fields = ('first_name', 'last_name', 'address_line', 'additional_address_line', 'postcode', 'town')
 
+    def export_rows(self, queryset=None, chunk_size=2000):
+        """
+        Yields the exported values row by row. In contrast to export(),
+        the rows are read in chunks and never kept in memory all at once.
+        """
+        if queryset is None:
+            queryset = self.get_queryset()
+
+        attributes = [field.attribute for field in self.get_export_fields()]
+        for row in queryset.prefetch_related(None).values_list(*attributes).iterator(chunk_size=chunk_size):
+            yield ['' if value is None else value for value in row]
+
+    def export_csv_lines(self, queryset=None):
+        """
+        Yields the exported data as CSV lines, headers first.
+        """
+        writer = csv.writer(Echo())
+
+        yield writer.writerow(self.get_export_headers())
+        for row in self.export_rows(queryset):
+            yield writer.writerow(row)
+
 
 class ActiveSubscriptionResource(SubscriptionResource):
     """
     Defines the data resource for active subscriptions which can be exported.
     """
-    def export(self, queryset=None, *args, **kwargs):
+    def get_queryset(self):
         """
         Only export active subscriptions.
         """
-        if queryset is None:
-            queryset = Subscription.objects.filter(is_active=True)
-
-        return super().export(queryset, *args, **kwargs)
+        return Subscription.objects.filter(is_active=True)
 
 
 class IsActiveListFilter(admin.SimpleListFilter):
@@ -111,8 +166,8 @@ class SubscriptionAdmin(ExportMixin, admin.ModelAdmin):
     Subscription model admin
     """
     list_display = [
-        'account_name_field', 'address_name_field', 'plan', 'is_active_field', 'is_paid_field',
-        'start_date_field', 'end_date_field', 'is_canceled_field'
+        'account_name_field', 'address_name_field', 'plan', 'is_active', 'is_paid', 'start_date', 'end_date',
+        'is_canceled_field', 'is_renewable_field'
     ]
     list_filter = [IsActiveListFilter, IsPaidListFilter, 'plan']
     search_fields = [
@@ -121,10 +176,68 @@ class SubscriptionAdmin(ExportMixin, admin.ModelAdmin):
     ]
     actions = ['send_renewal_notification']
     resource_class = SubscriptionResource
+    paginator = ApproximateCountPaginator
+    show_full_result_count = False
     inlines = [PeriodInline]
 
     def get_queryset(self, request):
-        return super().get_queryset(request).prefetch_related('user')
+        return Subscription.objects.with_renewability(super().get_queryset(request).prefetch_related('user'))
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Searches the stored search documents, which contain all search
+        fields, instead of each field. The results are ordered by rank.
+        """
+        if not search_term.strip():
+            return queryset, False
+        return Subscription.objects.search(search_term, queryset), False
+
+    def get_changelist(self, request, **kwargs):
+        return SearchRankChangeList
+
+    def export_action(self, request, *args, **kwargs):
+        """
+        Streams .xlsx files from the temporary file written by
+        get_export_data, so that the document is never held in memory.
+        Other formats are exported as usual.
+        """
+        if not self.has_export_permission(request):
+            raise PermissionDenied
+
+        formats = self.get_export_formats()
+        form = ExportForm(formats, request.POST or None)
+        if not form.is_valid() or not issubclass(formats[int(form.cleaned_data['file_format'])], XLSX):
+            return super().export_action(request, *args, **kwargs)
+
+        file_format = formats[int(form.cleaned_data['file_format'])]()
+        queryset = self.get_export_queryset(request)
+        response = FileResponse(
+            self.get_export_data(file_format, queryset, request=request),
+            as_attachment=True,
+            filename=self.get_export_filename(request, queryset, file_format),
+            content_type=file_format.get_content_type()
+        )
+        post_export.send(sender=None, model=self.model)
+        return response
+
+    def get_export_data(self, file_format, queryset, *args, **kwargs):
+        """
+        Writes .xlsx files row by row into a write-only workbook in a
+        temporary file instead of building a tablib dataset first and
+        returns the file. Other formats are exported as usual.
+        """
+        if not isinstance(file_format, XLSX):
+            return super().get_export_data(file_format, queryset, *args, **kwargs)
+
+        request = kwargs.pop('request')
+        if not self.has_export_permission(request):
+            raise PermissionDenied
+
+        resource = self.get_export_resource_class()(**self.get_export_resource_kwargs(request))
+        file = tempfile.TemporaryFile()
+        write_xlsx(file, resource.get_export_headers(), resource.export_rows(queryset))
+        file.seek(0)
+        return file
 
     def account_name_field(self, obj):
         return obj.user.full_name()
@@ -140,36 +253,42 @@ class SubscriptionAdmin(ExportMixin, admin.ModelAdmin):
     is_canceled_field.admin_order_field = 'is_canceled'
     is_canceled_field.boolean = True
 
-    def is_active_field(self, obj):
-        return obj.is_active
-    is_active_field.short_description = 'Ist aktiv'
-    is_active_field.admin_order_field = 'is_active'
-    is_active_field.boolean = True
-
-    def is_paid_field(self, obj):
-        return obj.is_paid
-    is_paid_field.short_description = 'Ist bezahlt'
-    is_paid_field.admin_order_field = 'is_paid'
-    is_paid_field.boolean = True
-
-    def start_date_field(self, obj):
-        return obj.start_date
-    start_date_field.short_description = 'Anfangsdatum'
-    start_date_field.admin_order_field = 'start_date'
-
-    def end_date_field(self, obj):
-        return obj.end_date
-    end_date_field.short_description = 'Enddatum'
-    end_date_field.admin_order_field = 'end_date'
+    def is_renewable_field(self, obj):
+        return obj.renewable
+    is_renewable_field.short_description = 'Verlängerbar'
+    is_renewable_field.admin_order_field = 'renewable'
+    is_renewable_field.boolean = True
 
     def send_renewal_notification(self, request, queryset):
         send_expiration_emails(queryset=queryset)
     send_renewal_notification.short_description = 'Verlängerungserinnerung senden'
 
 
+class PlanEmailDomainInline(admin.TabularInline):
+    """
+    Eligible email domains of a plan
+    """
+    model = PlanEmailDomain
+    extra = 1
+
+
 @admin.register(Plan)
 class PlanAdmin(admin.ModelAdmin):
     """
     Plan model admin
     """
     list_display = ['name', 'price']
+    inlines = [PlanEmailDomainInline]
+
+
+@admin.register(ExpirationReminder)
+class ExpirationReminderAdmin(admin.ModelAdmin):
+    """
+    Expiration reminder model admin
+    """
+    list_display = ['subscription', 'kind', 'end_date', 'sent_at']
+    list_filter = ['kind']
+    search_fields = ['subscription__first_name', 'subscription__last_name', 'subscription__user__email']
+    raw_id_fields = ['subscription']
+    paginator = ApproximateCountPaginator
+    show_full_result_count = False
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class SubscriptionConfig(AppConfig):
     name = 'subscription_manager.subscription'
+
+    def ready(self):
+        # Connect signal receivers
+        from . import signals  # noqa: F401
@@ -0,0 +1,134 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from subscription_manager.payment.models import Payment
+from subscription_manager.subscription.models import Period, Plan, Subscription
+from subscription_manager.subscription.statistics import get_monthly_statistics_by_plan
+
+
+BACKENDS = [
+    'subscription_manager.subscription.statistics.QueryBackend',
+    'subscription_manager.subscription.statistics.PythonBackend',
+    'subscription_manager.subscription.statistics.NumpyBackend',
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures the statistics backends on generated periods. The data is '
+        'created inside a transaction which is rolled back afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--periods',
+            type=int,
+            nargs='+',
+            default=[10000, 100000, 1000000],
+            help='Numbers of generated periods (default: 10000 100000 1000000)'
+        )
+        parser.add_argument(
+            '--months',
+            type=int,
+            default=24,
+            help='Number of months up to the current one (default: 24)'
+        )
+        parser.add_argument(
+            '--backends',
+            nargs='+',
+            default=BACKENDS,
+            help='Dotted paths of the measured backends (default: all)'
+        )
+        parser.add_argument(
+            '--max-query-periods',
+            type=int,
+            default=100000,
+            help='Skip the QueryBackend above this number of periods (default: 100000)'
+        )
+        parser.add_argument('--seed', type=int, default=1, help='Seed of the random generator')
+
+    def handle(self, *args, **options):
+        end = timezone.now().date().replace(day=1)
+        start = end
+        for _ in range(options['months'] - 1):
+            start = (start - timezone.timedelta(days=1)).replace(day=1)
+
+        random.seed(options['seed'])
+
+        for number in options['periods']:
+            with transaction.atomic():
+                self.generate(number)
+                self.stdout.write('{} periods, {:%Y-%m} to {:%Y-%m}:'.format(number, start, end))
+
+                reference = None
+                for path in options['backends']:
+                    name = path.rsplit('.', 1)[-1]
+                    if name == 'QueryBackend' and number > options['max_query_periods']:
+                        self.stdout.write('  {:<16} skipped'.format(name))
+                        continue
+
+                    started_at = time.perf_counter()
+                    statistics = get_monthly_statistics_by_plan(start, end, path)
+                    duration = time.perf_counter() - started_at
+
+                    if reference is None:
+                        reference = statistics
+                    result = 'identical' if statistics == reference else 'DIFFERENT'
+                    self.stdout.write('  {:<16} {:>9.3f} s  {}'.format(name, duration, result))
+
+                transaction.set_rollback(True)
+
+    def generate(self, number):
+        """
+        Creates subscriptions with a total of about the given number of
+        periods over the last five years, most of them paid.
+        """
+        today = timezone.now().date()
+        plans = [
+            Plan.objects.create(name='Benchmark {}'.format(i), slug='benchmark-{}'.format(i), price=20)
+            for i in range(3)
+        ]
+
+        subscription_id = (Subscription.objects.aggregate(pk=Max('pk'))['pk'] or 0) + 1
+        period_id = (Period.objects.aggregate(pk=Max('pk'))['pk'] or 0) + 1
+
+        subscriptions = []
+        periods = []
+        payments = []
+        while len(periods) < number:
+            created_at = timezone.now() - timezone.timedelta(days=random.randint(0, 5 * 365))
+            subscription = Subscription(
+                pk=subscription_id,
+                plan=random.choice(plans),
+                first_name='Vorname',
+                last_name='Nachname',
+                address_line='Strasse 1',
+                postcode='8000',
+                town='Zürich',
+                created_at=created_at
+            )
+            if random.random() < 0.1:
+                subscription.canceled_at = created_at + timezone.timedelta(days=random.randint(0, 365))
+            subscriptions.append(subscription)
+
+            start_date = created_at.date()
+            for _ in range(min(random.randint(1, 4), number - len(periods))):
+                end_date = start_date + timezone.timedelta(days=365)
+                periods.append(Period(pk=period_id, subscription_id=subscription_id, start_date=start_date, end_date=end_date))
+                payment = Payment(period_id=period_id, amount=20, due_on=today)
+                if random.random() < 0.9:
+                    payment.paid_at = timezone.now()
+                payments.append(payment)
+                period_id += 1
+                start_date = end_date + timezone.timedelta(days=1)
+            subscription_id += 1
+
+        Subscription.objects.bulk_create(subscriptions, batch_size=5000)
+        Period.objects.bulk_create(periods, batch_size=5000)
+        Payment.objects.bulk_create(payments, batch_size=5000)
+        Subscription.objects.update_status(Subscription.objects.filter(plan__in=plans))
@@ -0,0 +1,115 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import BooleanField, Case, DateField, IntegerField, Max, Min, Sum, When
+from django.utils import timezone
+
+from subscription_manager.subscription.models import Subscription
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the stored status fields of all subscriptions or verifies them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Only compare the stored status fields with the values computed from periods and payments.'
+        )
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            self.verify()
+            return
+
+        count = Subscription.objects.update_status()
+        self.stdout.write('Updated the status of {} subscriptions.'.format(count))
+
+    def verify(self):
+        """
+        Compares the stored status fields with the values aggregated
+        over all periods and payments of each subscription. Raises an
+        error if at least one subscription is out of date.
+        """
+        fields = ['is_active', 'is_paid', 'start_date', 'end_date']
+        mismatches = 0
+        for subscription in self.computed_status().iterator():
+            differences = [
+                '{}: {} != {}'.format(field, getattr(subscription, field), getattr(subscription, 'computed_' + field))
+                for field in fields if getattr(subscription, field) != getattr(subscription, 'computed_' + field)
+            ]
+            if differences:
+                mismatches += 1
+                self.stdout.write('Subscription #{}: {}'.format(subscription.pk, ', '.join(differences)))
+
+        if mismatches > 0:
+            raise CommandError('The status of {} subscriptions is out of date.'.format(mismatches))
+        self.stdout.write('The status of all subscriptions is up to date.')
+
+    def computed_status(self):
+        """
+        Annotates all subscriptions with their status computed from
+        their periods and payments.
+        """
+        today = timezone.now().date()
+        return Subscription.objects.annotate(
+            active_periods_sum=Sum(
+                Case(
+                    When(
+                        canceled_at__isnull=True,
+                        period__start_date__isnull=False,
+                        period__end_date__isnull=False,
+                        period__start_date__lte=today,
+                        period__end_date__gt=today,
+                        period__payment__paid_at__isnull=False,
+                        then=1
+                    ),
+                    default=0,
+                    output_field=IntegerField()
+                )
+            ),
+            computed_is_active=Case(
+                When(
+                    active_periods_sum__gte=1,
+                    then=True
+                ),
+                default=False,
+                output_field=BooleanField()
+            ),
+            unpaid_payments_sum=Sum(
+                Case(
+                    When(
+                        period__payment__paid_at__isnull=True,
+                        then=1
+                    ),
+                    default=0,
+                    output_field=IntegerField()
+                )
+            ),
+            computed_is_paid=Case(
+                When(
+                    unpaid_payments_sum=0,
+                    then=True
+                ),
+                default=False,
+                output_field=BooleanField()
+            ),
+            computed_start_date=Min(
+                Case(
+                    When(
+                        period__payment__paid_at__isnull=False,
+                        then='period__start_date'
+                    ),
+                    default=None,
+                    output_field=DateField()
+                )
+            ),
+            computed_end_date=Max(
+                Case(
+                    When(
+                        period__payment__paid_at__isnull=False,
+                        then='period__end_date'
+                    ),
+                    default=None,
+                    output_field=DateField()
+                )
+            )
+        ).order_by('pk')
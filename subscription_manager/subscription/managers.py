@@ -1,81 +1,214 @@
 import calendar
 import datetime
+import unicodedata
 
 from django.apps import apps
 from django.conf import settings
-from django.core.mail import send_mass_mail
-from django.db import models
-from django.db.models import BooleanField, Case, DateField, IntegerField, Q, Max, Min, Sum, When
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.db import models, transaction
+from django.db.models import BooleanField, Case, Exists, IntegerField, Max, Min, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
 from django.template.loader import render_to_string
 from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+
+from subscription_manager.utils.cache import bump_versions, bump_versions_on_commit, get_versions
+
+
+class Fragment:
+    """
+    Subscription whose page fragment may be cached, as prepared by
+    SubscriptionManager.get_fragments.
+    """
+    def __init__(self, pk, version, subscription=None):
+        self.pk = pk
+        self.version = version
+        self.subscription = subscription
+
+
+class PlanCatalog:
+    """
+    All plans with their eligible email domains, as loaded by
+    PlanManager.get_catalog. Plans can be looked up without queries.
+    """
+    def __init__(self, version, plans):
+        self.version = version
+        self.plans = plans
+        self.plans_by_id = {plan.pk: plan for plan in plans}
+        self.plans_by_slug = {plan.slug: plan for plan in plans}
+
+    def get(self, pk=None, slug=None):
+        """
+        Returns the plan with the given id or slug, or None
+        if it does not exist.
+        """
+        if pk is not None:
+            return self.plans_by_id.get(pk)
+        return self.plans_by_slug.get(slug)
+
+    def filter(self, ids):
+        """
+        Returns the plans with the given ids.
+        """
+        return [plan for plan in self.plans if plan.pk in ids]
+
+    def exclude(self, ids):
+        """
+        Returns all plans except for those with the given ids.
+        """
+        return [plan for plan in self.plans if plan.pk not in ids]
 
 
 class PlanManager(models.Manager):
+    # Catalog of the current process, see get_catalog
+    catalog = None
 
     def filter_eligible(self, user=None, purpose='purchase'):
         """
-        Returns plans for which a user is eligible.
+        Returns plans for which a user is eligible. All rules are
+        evaluated by the database in one query, independently of the
+        number of plans:
+        - The plan must be purchasable or renewable, respectively.
+        - If the plan has eligible email domains, the user needs a
+          recently verified email address with one of them.
+        - For purchases, the user must not have reached the maximum
+          number of active subscriptions of the plan.
         """
         if purpose == 'purchase':
             # Filter purchasable plans
-            plans = self.filter(
-                is_purchasable=True
-            ).exclude(
-                eligible_active_subscriptions_per_user=0
-            )
-
-            # If user is logged in, perform additional checks
-            if user is not None and user.is_authenticated:
-
-                # Exclude plans for which the user has reached the maximum allowed amount
-                subscription_model = apps.get_model('subscription', 'Subscription')
-                now = timezone.now().date()
-                plans = plans.exclude(
-                    subscription__in=subscription_model.objects.filter(
-                        user=user,
-                        period__end_date__gt=now,
-                        period__start_date__lte=now,
-                        canceled_at__isnull=True
-                    ).annotate(
-                        num_subs_of_plan=models.Count('plan__id')
-                    ).exclude(
-                        num_subs_of_plan__lt=models.F('plan__eligible_active_subscriptions_per_user')
-                    )
-                )
-
+            plans = self.filter(is_purchasable=True)
         elif purpose == 'renewal':
             # Filter renewable plans
-            plans = self.filter(
-                is_renewable=True
-            ).exclude(
-                eligible_active_subscriptions_per_user=0
-            )
+            plans = self.filter(is_renewable=True)
         else:
             return None
 
+        plans = plans.exclude(eligible_active_subscriptions_per_user=0)
+
         # If user is logged in, perform additional checks
         if user is not None and user.is_authenticated:
 
             # Exclude plans for which the user's email domain is not eligible
-            verified_email_domains = user.verified_email_domains()
-            for plan in plans:
-                eligible_email_domains = plan.get_eligible_email_domains()
-                if eligible_email_domains and not any(email in verified_email_domains for email in eligible_email_domains):
-                    plans = plans.exclude(id=plan.id)
+            plans = plans.filter(self.get_email_domain_condition(user, OuterRef('pk')))
+
+            if purpose == 'purchase':
+                # Exclude plans for which the user has reached the maximum allowed amount
+                subscription_model = apps.get_model('subscription', 'Subscription')
+                now = timezone.now().date()
+                active_subscriptions = subscription_model.objects.filter(
+                    user=user,
+                    plan=OuterRef('pk'),
+                    canceled_at__isnull=True,
+                    period__start_date__lte=now,
+                    period__end_date__gt=now
+                ).order_by().values('plan').annotate(
+                    count=models.Count('pk', distinct=True)
+                ).values('count')
+                plans = plans.filter(
+                    Q(eligible_active_subscriptions_per_user__isnull=True) |
+                    Q(eligible_active_subscriptions_per_user__gt=Coalesce(Subquery(active_subscriptions), 0))
+                )
 
         return plans
 
+    def get_catalog(self):
+        """
+        Returns the catalog of all plans. It is loaded once per process
+        and reloaded when the version 'plans' has been bumped by any
+        process after a plan has been changed. Apart from checking the
+        version in the cache, no queries are made.
+        """
+        version, = get_versions('plans')
+        catalog = PlanManager.catalog
+        if catalog is None or catalog.version != version:
+            # The version is read before the plans, so changes during
+            # the loading cause another reload
+            catalog = PlanCatalog(version, list(self.prefetch_related('email_domains').order_by('pk')))
+            PlanManager.catalog = catalog
+        return catalog
+
+    def get_email_domain_condition(self, user, plan):
+        """
+        Returns a condition which is true if the plan is not restricted
+        to email domains or if the user has a recently verified email
+        address with one of them. The user and the plan can be given as
+        objects or as references to the outer query.
+        """
+        email_address_model = apps.get_model('user', 'EmailAddress')
+        plan_email_domain_model = apps.get_model('subscription', 'PlanEmailDomain')
+
+        # The email addresses are filtered one level deeper
+        if isinstance(user, OuterRef):
+            user = OuterRef(user)
+
+        plan_email_domains = plan_email_domain_model.objects.filter(plan=plan)
+        verified_email_domains = email_address_model.objects.filter_recently_verified().filter(user=user).values('domain')
+        return ~Exists(plan_email_domains) | Exists(plan_email_domains.filter(domain__in=verified_email_domains))
+
+    def get_eligible_ids(self, user=None, purpose='purchase'):
+        """
+        Returns the ids of the plans for which a user is eligible. The
+        result is cached per user and purpose until the user's email
+        addresses or subscriptions or any plan change (see
+        invalidate_eligibility) or until the day ends. Verifications
+        expire at the end of a day, too, so the cache never outlasts
+        the earliest expiring verification.
+        """
+        user_id = user.pk if user is not None and user.is_authenticated else None
+        user_version, plans_version = self.get_eligibility_versions(user)
+
+        now = timezone.now()
+        key = 'eligible-plans:{}:{}:{}:{}:{}'.format(user_id, purpose, now.date().isoformat(), user_version, plans_version)
+        plan_ids = cache.get(key)
+        if plan_ids is None:
+            plan_ids = frozenset(self.filter_eligible(user, purpose).values_list('pk', flat=True))
+            end_of_day = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time(), now.tzinfo)
+            cache.set(key, plan_ids, (end_of_day - now).total_seconds())
+        return plan_ids
+
+    def get_eligibility_versions(self, user=None):
+        """
+        Returns the cache versions of the eligibility of a user and of
+        the plans, which change whenever the plans for which the user
+        is eligible may change (see invalidate_eligibility).
+        """
+        user_id = user.pk if user is not None and user.is_authenticated else None
+        return get_versions('eligibility:user:{}'.format(user_id), 'plans')
+
+    def invalidate_eligibility(self, user_ids=None):
+        """
+        Invalidates the cached eligibility of the given users, or of all
+        users and the plan catalog if no users are given, e.g. after a
+        plan has changed. The versions are bumped once the changes have
+        been committed.
+        """
+        if user_ids is None:
+            bump_versions_on_commit('plans')
+        else:
+            bump_versions_on_commit(*['eligibility:user:{}'.format(user_id) for user_id in set(user_ids)])
+
+
+def normalize_search_text(text):
+    """
+    Returns a text in the form in which it is stored in search documents
+    and searched for: in lower case, without accents and with single
+    spaces, so that e.g. "Müller" is found by "muller".
+    """
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(character for character in text if not unicodedata.combining(character))
+    return ' '.join(text.casefold().split())
+
 
 class SubscriptionManager(models.Manager):
 
     def get_queryset(self):
         """
-        Annotate queryset with computed fields is_canceled, active_periods_sum,
-        is_active, unpaid_payments_sum, is_paid, start_date, and end_date.
+        Annotate queryset with computed field is_canceled. The status fields
+        is_active, is_paid, start_date, and end_date are stored columns, which
+        are kept up to date by update_status.
         """
         queryset = super().get_queryset()
-        # Annotate queryset with columns is_canceled, active_periods_sum,
-        # is_active, unpaid_payments_sum, is_paid, start_date, and end_date.
         queryset = queryset.annotate(
             is_canceled=Case(
                 When(
@@ -84,70 +217,250 @@ class SubscriptionManager(models.Manager):
                 ),
                 default=False,
                 output_field=BooleanField()
-            ),
-            active_periods_sum=Sum(
-                Case(
-                    When(
-                        canceled_at__isnull=True,
-                        period__start_date__isnull=False,
-                        period__end_date__isnull=False,
-                        period__start_date__lte=timezone.now().date(),
-                        period__end_date__gt=timezone.now().date(),
-                        period__payment__paid_at__isnull=False,
-                        then=1
-                    ),
-                    default=0,
-                    output_field=IntegerField()
-                )
-            ),
-            is_active=Case(
+            )
+        )
+        return queryset
+
+    def with_renewability(self, queryset=None):
+        """
+        Annotates the given subscriptions (or all subscriptions) with
+        renewable, which is true if the user can renew the subscription
+        (see Subscription.is_renewable). It is computed for all
+        subscriptions within the same query.
+        """
+        if queryset is None:
+            queryset = self.all()
+
+        plan_model = apps.get_model('subscription', 'Plan')
+        today = timezone.now().date()
+
+        return queryset.annotate(
+            renewable=Case(
                 When(
-                    active_periods_sum__gte=1,
+                    Q(
+                        user__isnull=False,
+                        is_paid=True,
+                        end_date__lte=today + datetime.timedelta(days=30),
+                        plan__is_renewable=True
+                    ) &
+                    ~Q(plan__eligible_active_subscriptions_per_user=0) &
+                    Q(plan_model.objects.get_email_domain_condition(OuterRef('user'), OuterRef('plan'))),
                     then=True
                 ),
                 default=False,
                 output_field=BooleanField()
+            )
+        )
+
+    def update_status(self, queryset=None):
+        """
+        Recomputes the stored status fields is_active, is_paid, start_date,
+        and end_date of the given subscriptions (or of all subscriptions)
+        from their periods and payments. Bumps the version 'subscriptions',
+        which identifies the state of all subscriptions (see
+        get_data_version). Returns the number of updated rows.
+        """
+        if queryset is None:
+            queryset = self.all()
+
+        period_model = apps.get_model('subscription', 'Period')
+        today = timezone.now().date()
+
+        periods = period_model.objects.filter(subscription=OuterRef('pk'))
+        paid_periods = periods.filter(payment__paid_at__isnull=False)
+
+        updated = queryset.update(
+            # Active: not canceled and a paid period covers today
+            is_active=Case(
+                When(
+                    canceled_at__isnull=False,
+                    then=False
+                ),
+                default=Exists(
+                    paid_periods.filter(start_date__lte=today, end_date__gt=today)
+                ),
+                output_field=BooleanField()
             ),
-            unpaid_payments_sum=Sum(
-                Case(
-                    When(
-                        period__payment__paid_at__isnull=True,
-                        then=1
-                    ),
-                    default=0,
-                    output_field=IntegerField()
-                )
-            ),
+            # Paid: at least one period and no period without a paid payment
             is_paid=Case(
                 When(
-                    unpaid_payments_sum=0,
-                    then=True
+                    Exists(periods.filter(payment__paid_at__isnull=True)),
+                    then=False
                 ),
-                default=False,
+                default=Exists(periods),
                 output_field=BooleanField()
             ),
-            start_date=Min(
-                Case(
-                    When(
-                        period__payment__paid_at__isnull=False,
-                        then='period__start_date'
-                    ),
-                    default=None,
-                    output_field=DateField()
-                )
+            # Start date of the first and end date of the last paid period
+            start_date=Subquery(
+                paid_periods.filter(start_date__isnull=False).order_by('start_date').values('start_date')[:1]
             ),
-            end_date=Max(
-                Case(
-                    When(
-                        period__payment__paid_at__isnull=False,
-                        then='period__end_date'
-                    ),
-                    default=None,
-                    output_field=DateField()
-                )
+            end_date=Subquery(
+                paid_periods.filter(end_date__isnull=False).order_by('-end_date').values('end_date')[:1]
             )
         )
-        return queryset
+        bump_versions_on_commit('subscriptions')
+        return updated
+
+    def get_data_version(self):
+        """
+        Returns the cache version which changes whenever a subscription
+        is changed, deleted or changes its status. Views derive their
+        ETags from it, so that unchanged data is not sent again.
+        """
+        version, = get_versions('subscriptions')
+        return version
+
+    def handle_changes(self, queryset):
+        """
+        Updates the stored status of changed subscriptions and marks the
+        statistics of all months which are affected by the changes as stale.
+        Also invalidates the cached page fragments of the subscriptions and
+        the cached eligibility of their users once the changes have been
+        committed.
+        """
+        stats_model = apps.get_model('subscription', 'MonthlySubscriptionStats')
+        plan_model = apps.get_model('subscription', 'Plan')
+
+        dates = self.get_dates(queryset)
+        self.update_status(queryset)
+        dates += self.get_dates(queryset)
+
+        if dates:
+            stats_model.objects.mark_stale(min(dates), max(dates))
+
+        # Cached page fragments of the subscriptions are outdated, and the
+        # number of active subscriptions limits the eligible plans
+        subscriptions = list(queryset.values_list('pk', 'user_id'))
+        bump_versions_on_commit(*['subscription:{}'.format(pk) for pk, user_id in subscriptions])
+        plan_model.objects.invalidate_eligibility(
+            {user_id for pk, user_id in subscriptions if user_id is not None}
+        )
+
+    def get_dates(self, queryset):
+        """
+        Returns the earliest and latest start, end, and cancellation
+        dates of the given subscriptions.
+        """
+        values = queryset.aggregate(
+            Min('start_date'), Max('end_date'), Min('canceled_at'), Max('canceled_at')
+        )
+        dates = []
+        for value in values.values():
+            if isinstance(value, datetime.datetime):
+                value = timezone.localtime(value).date()
+            if value is not None:
+                dates.append(value)
+        return dates
+
+    def update_active_status(self):
+        """
+        Recomputes the status of all subscriptions whose activity can change
+        with the current date: subscriptions that are marked as active and
+        subscriptions with a paid period covering today.
+        """
+        today = timezone.now().date()
+        return self.update_status(self.filter(
+            Q(is_active=True) |
+            Q(canceled_at__isnull=True, start_date__lte=today, end_date__gt=today)
+        ))
+
+    def get_fragments(self, fragment_name, queryset, user):
+        """
+        Prepares the given subscriptions of a user for a template which
+        caches a fragment per subscription:
+
+            {% cache 86400 fragment_name fragment.version %}
+
+        The version changes with the subscription, its periods and
+        payments (see handle_changes), its status, the plans, the user's
+        eligibility and the date. Only the subscriptions whose fragment
+        is not cached are loaded, together with their plans, users and
+        renewability. Returns a list of fragments with the attributes
+        version and subscription.
+        """
+        rows = list(queryset.values_list('pk', 'is_active', 'is_paid', 'end_date'))
+        plans_version, user_version, *versions = get_versions(
+            'plans', 'eligibility:user:{}'.format(user.pk), *['subscription:{}'.format(row[0]) for row in rows]
+        )
+        today = timezone.now().date()
+        fragments = [
+            Fragment(row[0], ':'.join(str(value) for value in (*row, version, plans_version, user_version, today)))
+            for row, version in zip(rows, versions)
+        ]
+
+        # Load the subscriptions whose fragments have to be rendered
+        keys = {fragment.pk: make_template_fragment_key(fragment_name, [fragment.version]) for fragment in fragments}
+        cached_keys = cache.get_many(keys.values())
+        missing = [pk for pk, key in keys.items() if key not in cached_keys]
+        subscriptions = {}
+        if missing:
+            subscriptions = {
+                subscription.pk: subscription
+                for subscription in self.with_renewability(self.filter(pk__in=missing).select_related('plan', 'user'))
+            }
+
+        for fragment in fragments:
+            fragment.subscription = subscriptions.get(fragment.pk) or SimpleLazyObject(
+                # Only used if the fragment has been evicted in the meantime
+                lambda pk=fragment.pk: self.with_renewability(self.select_related('plan', 'user')).get(pk=pk)
+            )
+        return fragments
+
+    def update_search_documents(self, queryset):
+        """
+        Recomputes the stored search documents of the given subscriptions,
+        e.g. after the name or the email address of their user has changed.
+        """
+        subscriptions = list(queryset.select_related('user'))
+        for subscription in subscriptions:
+            subscription.search_document = subscription.get_search_document()
+        self.bulk_update(subscriptions, ['search_document'], batch_size=1000)
+
+    def get_search_condition(self, query, prefix=''):
+        """
+        Returns a condition which matches subscriptions whose search
+        document contains every word of the query. A prefix such as
+        'period__subscription__' applies the condition to a related
+        model. On PostgreSQL, the condition uses the trigram index of
+        the search documents.
+        """
+        condition = Q()
+        for term in normalize_search_text(query).split():
+            condition &= Q(**{prefix + 'search_document__contains': term})
+        return condition
+
+    def get_search_rank(self, query, prefix=''):
+        """
+        Returns the rank of subscriptions for a search query: the number
+        of words of the query with which a word of the search document
+        begins. A prefix applies the rank to a related model, like in
+        get_search_condition.
+        """
+        rank = Value(0, output_field=IntegerField())
+        for term in normalize_search_text(query).split():
+            rank += Case(
+                When(
+                    Q(**{prefix + 'search_document__startswith': term}) |
+                    Q(**{prefix + 'search_document__contains': ' ' + term}),
+                    then=1
+                ),
+                default=0,
+                output_field=IntegerField()
+            )
+        return rank
+
+    def search(self, query, queryset=None):
+        """
+        Filters the given subscriptions (or all subscriptions) by a search
+        query and orders them by rank (annotated as search_rank), then by
+        name.
+        """
+        if queryset is None:
+            queryset = self.all()
+
+        return queryset.filter(self.get_search_condition(query)).annotate(
+            search_rank=self.get_search_rank(query)
+        ).order_by('-search_rank', 'last_name', 'first_name', 'pk')
 
     def get_active_by_month(self, year, month):
         """
@@ -232,6 +545,37 @@ class SubscriptionManager(models.Manager):
         expiring_subscriptions = self.filter(is_canceled=False, end_date=end_date)
         return expiring_subscriptions
 
+    def get_due_for_reminder(self, remaining_days):
+        """
+        Returns all subscriptions which their users can renew (see
+        with_renewability) and which have reached the reminder
+        threshold, i.e. they expire within the given number of days,
+        but which have not been reminded for their current end date
+        yet. The most urgent subscriptions come first.
+
+        The window starts after the window of the next shorter reminder,
+        so a subscription which has been missed for too long gets the
+        shorter reminder instead. Subscriptions missed on one day are
+        therefore caught up on the next run.
+        """
+        ExpirationReminder = apps.get_model('subscription', 'ExpirationReminder')
+        kind = ExpirationReminder.KINDS[remaining_days]
+        shorter_remaining_days = max([days for days in ExpirationReminder.KINDS if days < remaining_days], default=0)
+
+        today = timezone.now().date()
+        return self.with_renewability().filter(
+            is_canceled=False,
+            renewable=True,
+            end_date__gt=today + timezone.timedelta(days=shorter_remaining_days),
+            end_date__lte=today + timezone.timedelta(days=remaining_days)
+        ).exclude(
+            Exists(ExpirationReminder.objects.filter(
+                subscription=OuterRef('pk'),
+                end_date=OuterRef('end_date'),
+                kind=kind
+            ))
+        ).order_by('end_date', 'pk')
+
 
 class PeriodManager(models.Manager):
 
@@ -252,3 +596,101 @@ class PeriodManager(models.Manager):
                        payment__paid_at__isnull=False)
 
         return periods
+
+
+class MonthlySubscriptionStatsManager(models.Manager):
+
+    def mark_stale(self, start_date, end_date):
+        """
+        Marks the stored statistics of all months from start_date
+        to end_date as stale.
+        """
+        bump_versions('statistics')
+        return self.filter(
+            month__gte=start_date.replace(day=1),
+            month__lte=end_date
+        ).update(is_stale=True)
+
+    def refresh(self, months):
+        """
+        Recomputes and stores the statistics of the given months (first
+        days of months), both in total and per plan.
+        """
+        from .statistics import FIELDS, get_monthly_statistics_by_plan
+
+        months = sorted(set(months))
+        if not months:
+            return
+
+        statistics = get_monthly_statistics_by_plan(months[0], months[-1])
+
+        objects = []
+        for month in months:
+            totals = {field: 0 for field in FIELDS}
+            for plan_id, plan_statistics in statistics.items():
+                objects.append(self.model(month=month, plan_id=plan_id, **plan_statistics[month]))
+                for field in FIELDS:
+                    totals[field] += plan_statistics[month][field]
+            objects.append(self.model(month=month, plan=None, **totals))
+
+        with transaction.atomic():
+            self.filter(month__in=months).delete()
+            self.bulk_create(objects, ignore_conflicts=True)
+        bump_versions('statistics')
+
+    def get_data_version(self):
+        """
+        Returns the cache version which changes whenever statistics are
+        marked as stale or recomputed.
+        """
+        version, = get_versions('statistics')
+        return version
+
+    def refresh_outdated(self):
+        """
+        Recomputes the statistics of the current and the previous month
+        and of all months which have been marked as stale.
+        """
+        current_month = timezone.now().date().replace(day=1)
+        previous_month = (current_month - timezone.timedelta(days=1)).replace(day=1)
+
+        months = set(self.filter(is_stale=True).values_list('month', flat=True))
+        months.update([previous_month, current_month])
+        self.refresh(months)
+
+    def refresh_missing(self, start, end):
+        """
+        Recomputes the statistics of all months from start to end which
+        are missing or stale. Returns the stored statistics of all plans
+        by month.
+        """
+        from .statistics import month_range
+
+        months = month_range(start, end)
+
+        def get_rows():
+            rows = self.filter(plan__isnull=True, month__gte=months[0], month__lte=months[-1])
+            return {row.month: row for row in rows}
+
+        rows = get_rows()
+        outdated_months = [month for month in months if month not in rows or rows[month].is_stale]
+        if outdated_months:
+            self.refresh(outdated_months)
+            rows = get_rows()
+        return rows
+
+    def get_statistics(self, start, end):
+        """
+        Returns a dictionary which maps the first day of each month from
+        start to end to the stored statistics of all plans. Missing and
+        stale months are recomputed beforehand.
+        """
+        from .statistics import FIELDS, month_range
+
+        months = month_range(start, end)
+        rows = self.refresh_missing(start, end)
+
+        return {
+            month: {field: getattr(rows[month], field) for field in FIELDS}
+            for month in months
+        }
@@ -0,0 +1,68 @@
+# Generated by Django 3.1.1 on 2026-10-18 14:17
+
+from django.db import migrations, models
+from django.db.models import BooleanField, Case, Exists, OuterRef, Subquery, When
+from django.utils import timezone
+
+
+def update_status(apps, schema_editor):
+    """
+    Fills the status fields of existing subscriptions.
+    """
+    Subscription = apps.get_model('subscription', 'Subscription')
+    Period = apps.get_model('subscription', 'Period')
+    today = timezone.now().date()
+
+    periods = Period.objects.filter(subscription=OuterRef('pk'))
+    paid_periods = periods.filter(payment__paid_at__isnull=False)
+
+    Subscription.objects.update(
+        is_active=Case(
+            When(canceled_at__isnull=False, then=False),
+            default=Exists(paid_periods.filter(start_date__lte=today, end_date__gt=today)),
+            output_field=BooleanField()
+        ),
+        is_paid=Case(
+            When(Exists(periods.filter(payment__paid_at__isnull=True)), then=False),
+            default=Exists(periods),
+            output_field=BooleanField()
+        ),
+        start_date=Subquery(
+            paid_periods.filter(start_date__isnull=False).order_by('start_date').values('start_date')[:1]
+        ),
+        end_date=Subquery(
+            paid_periods.filter(end_date__isnull=False).order_by('-end_date').values('end_date')[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscription', '0002_auto_20200219_1804'),
+        ('payment', '0002_payment_period'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subscription',
+            name='end_date',
+            field=models.DateField(blank=True, db_index=True, editable=False, null=True, verbose_name='Enddatum'),
+        ),
+        migrations.AddField(
+            model_name='subscription',
+            name='is_active',
+            field=models.BooleanField(db_index=True, default=False, editable=False, verbose_name='Ist aktiv'),
+        ),
+        migrations.AddField(
+            model_name='subscription',
+            name='is_paid',
+            field=models.BooleanField(db_index=True, default=False, editable=False, verbose_name='Ist bezahlt'),
+        ),
+        migrations.AddField(
+            model_name='subscription',
+            name='start_date',
+            field=models.DateField(blank=True, db_index=True, editable=False, null=True, verbose_name='Anfangsdatum'),
+        ),
+        migrations.RunPython(update_status, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 3.1.1 on 2026-10-18 14:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscription', '0003_subscription_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlySubscriptionStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(verbose_name='Monat')),
+                ('active', models.PositiveIntegerField(default=0, verbose_name='Aktive Abos')),
+                ('new', models.PositiveIntegerField(default=0, verbose_name='Neue Abos')),
+                ('renewed', models.PositiveIntegerField(default=0, verbose_name='Erneuerte Abos')),
+                ('expired', models.PositiveIntegerField(default=0, verbose_name='Abgelaufene Abos')),
+                ('canceled', models.PositiveIntegerField(default=0, verbose_name='Gekündigte Abos')),
+                ('is_stale', models.BooleanField(db_index=True, default=False, verbose_name='Veraltet')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Aktualisiert am')),
+                ('plan', models.ForeignKey(blank=True, help_text='Kein Wert bedeutet, dass die Statistik alle Abotypen umfasst.', null=True, on_delete=django.db.models.deletion.CASCADE, to='subscription.plan', verbose_name='Abotyp')),
+            ],
+            options={
+                'verbose_name': 'Monatsstatistik',
+                'verbose_name_plural': 'Monatsstatistiken',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='monthlysubscriptionstats',
+            constraint=models.UniqueConstraint(fields=('month', 'plan'), name='unique_monthly_stats_per_plan'),
+        ),
+        migrations.AddConstraint(
+            model_name='monthlysubscriptionstats',
+            constraint=models.UniqueConstraint(condition=models.Q(plan__isnull=True), fields=('month',), name='unique_monthly_stats_total'),
+        ),
+    ]
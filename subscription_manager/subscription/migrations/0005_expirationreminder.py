@@ -0,0 +1,33 @@
+# Generated by Django 3.1.1 on 2026-10-18 15:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscription', '0004_monthlysubscriptionstats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExpirationReminder',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('end_date', models.DateField(verbose_name='Enddatum')),
+                ('kind', models.CharField(choices=[('30_days', '30 Tage vor Ablauf'), ('1_day', '1 Tag vor Ablauf')], max_length=10, verbose_name='Art')),
+                ('sent_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Gesendet am')),
+                ('subscription', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='subscription.subscription', verbose_name='Abo')),
+            ],
+            options={
+                'verbose_name': 'Ablauferinnerung',
+                'verbose_name_plural': 'Ablauferinnerungen',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='expirationreminder',
+            constraint=models.UniqueConstraint(fields=('subscription', 'end_date', 'kind'), name='unique_expiration_reminder'),
+        ),
+    ]
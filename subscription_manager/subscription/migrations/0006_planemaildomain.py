@@ -0,0 +1,53 @@
+# Generated by Django 3.1.1 on 2026-10-18 15:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_email_domains(apps, schema_editor):
+    """
+    Moves the semicolon-separated eligible email domains
+    of the plans into the new model.
+    """
+    Plan = apps.get_model('subscription', 'Plan')
+    PlanEmailDomain = apps.get_model('subscription', 'PlanEmailDomain')
+    for plan in Plan.objects.exclude(eligible_email_domains=''):
+        domains = {domain.strip().lstrip('@').lower() for domain in plan.eligible_email_domains.split(';')}
+        PlanEmailDomain.objects.bulk_create([
+            PlanEmailDomain(plan=plan, domain=domain) for domain in sorted(domains) if domain
+        ])
+
+
+def copy_email_domains_back(apps, schema_editor):
+    Plan = apps.get_model('subscription', 'Plan')
+    for plan in Plan.objects.all():
+        plan.eligible_email_domains = ';'.join(plan.email_domains.order_by('domain').values_list('domain', flat=True))
+        plan.save(update_fields=['eligible_email_domains'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscription', '0005_expirationreminder'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlanEmailDomain',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('domain', models.CharField(db_index=True, help_text='Zum Beispiel student.ethz.ch (ohne @).', max_length=100, verbose_name='Domain')),
+                ('plan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='email_domains', to='subscription.plan', verbose_name='Abotyp')),
+            ],
+            options={
+                'verbose_name': 'Berechtigte E-Mail-Domain',
+                'verbose_name_plural': 'Berechtigte E-Mail-Domains',
+                'unique_together': {('plan', 'domain')},
+            },
+        ),
+        migrations.RunPython(copy_email_domains, copy_email_domains_back),
+        migrations.RemoveField(
+            model_name='plan',
+            name='eligible_email_domains',
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 3.1.1 on 2026-10-18 15:36
+
+import unicodedata
+
+from django.db import migrations, models
+
+
+def normalize_search_text(text):
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(character for character in text if not unicodedata.combining(character))
+    return ' '.join(text.casefold().split())
+
+
+def fill_search_documents(apps, schema_editor):
+    """
+    Fills the search documents of existing subscriptions.
+    """
+    Subscription = apps.get_model('subscription', 'Subscription')
+    subscriptions = list(Subscription.objects.select_related('user'))
+    for subscription in subscriptions:
+        values = [
+            subscription.first_name, subscription.last_name, subscription.address_line,
+            subscription.additional_address_line, subscription.postcode, subscription.town, subscription.country
+        ]
+        if subscription.user is not None:
+            values += [subscription.user.first_name, subscription.user.last_name, subscription.user.email]
+        subscription.search_document = normalize_search_text(' '.join(value for value in values if value))
+    Subscription.objects.bulk_update(subscriptions, ['search_document'], batch_size=1000)
+
+
+def create_trigram_index(apps, schema_editor):
+    """
+    Creates a trigram index of the search documents on PostgreSQL, which
+    is used by LIKE queries with leading wildcards. Other databases scan
+    the table instead.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute(
+        'CREATE INDEX subscription_search_document_trgm '
+        'ON subscription_subscription USING gin (search_document gin_trgm_ops)'
+    )
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS subscription_search_document_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscription', '0006_planemaildomain'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subscription',
+            name='search_document',
+            field=models.TextField(default='', editable=False, verbose_name='Suchtext'),
+        ),
+        migrations.RunPython(fill_search_documents, migrations.RunPython.noop),
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
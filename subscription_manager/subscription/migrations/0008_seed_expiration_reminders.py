@@ -0,0 +1,40 @@
+import datetime
+
+from django.db import migrations
+from django.utils import timezone
+
+
+def seed_expiration_reminders(apps, schema_editor):
+    """
+    Records the 30-day reminder for all subscriptions which expire
+    within the window of the 30-day reminder (in 2 to 30 days). They
+    have already been reminded by the previous job, which sent the
+    reminder exactly 30 days before the end date, so the first run of
+    the catching-up job must not remind them again.
+    """
+    Subscription = apps.get_model('subscription', 'Subscription')
+    ExpirationReminder = apps.get_model('subscription', 'ExpirationReminder')
+
+    today = timezone.now().date()
+    subscriptions = Subscription.objects.filter(
+        canceled_at__isnull=True,
+        end_date__gt=today + datetime.timedelta(days=1),
+        end_date__lte=today + datetime.timedelta(days=30)
+    ).values_list('pk', 'end_date')
+
+    # Reminders which have already been recorded are skipped
+    ExpirationReminder.objects.bulk_create([
+        ExpirationReminder(subscription_id=pk, end_date=end_date, kind='30_days')
+        for pk, end_date in subscriptions
+    ], batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscription', '0007_subscription_search_document'),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_expiration_reminders, migrations.RunPython.noop),
+    ]
@@ -2,7 +2,8 @@ from django.contrib.auth import get_user_model
 from django.db import models
 from django.utils import timezone
 
-from .managers import PlanManager, SubscriptionManager, PeriodManager
+from .managers import MonthlySubscriptionStatsManager, PlanManager, SubscriptionManager, PeriodManager, \
+    normalize_search_text
 
 
 class Plan(models.Model):
@@ -44,12 +45,6 @@ class Plan(models.Model):
         verbose_name='Anzahl aktiver Abos pro Leserin',
         help_text='Kein Wert bedeutet, dass es keine Begrenzung gibt.'
     )
-    eligible_email_domains = models.TextField(
-        blank=True,
-        default='',
-        verbose_name='Berechtigte E-Mail-Domains',
-        help_text='E-Mail-Adressen müssen mit einem Semikolon getrennt sein.'
-    )
     created_at = models.DateTimeField(
         default=timezone.now,
         verbose_name='Erstellt am'
@@ -66,13 +61,10 @@ class Plan(models.Model):
 
     def get_eligible_email_domains(self):
         """
-        Returns a list of the eligible email domains.
+        Returns a list of the eligible email domains. Uses
+        prefetched domains if there are any.
         """
-        if self.eligible_email_domains is None:
-            return []
-
-        eligible_email_domains_list = self.eligible_email_domains.split(';')
-        return list(filter(None, eligible_email_domains_list))
+        return sorted(email_domain.domain for email_domain in self.email_domains.all())
 
     def get_readable_eligible_email_domains(self, conjunction='oder'):
         """
@@ -94,12 +86,48 @@ class Plan(models.Model):
         Checks whether a given user is eligible
         to purchase the subscription.
         """
-        if user is not None and self in Plan.objects.filter_eligible(user, purpose):
+        if user is not None and self.pk in Plan.objects.get_eligible_ids(user, purpose):
             return True
         return False
     is_eligible.boolean = True
 
 
+class PlanEmailDomain(models.Model):
+    """
+    Email domain which is eligible for a plan. If a plan has eligible
+    domains, only users with a recently verified email address of one
+    of them can purchase or renew it.
+    """
+    plan = models.ForeignKey(
+        to='Plan',
+        on_delete=models.CASCADE,
+        related_name='email_domains',
+        verbose_name='Abotyp'
+    )
+    domain = models.CharField(
+        max_length=100,
+        db_index=True,
+        verbose_name='Domain',
+        help_text='Zum Beispiel student.ethz.ch (ohne @).'
+    )
+
+    class Meta:
+        verbose_name = 'Berechtigte E-Mail-Domain'
+        verbose_name_plural = 'Berechtigte E-Mail-Domains'
+        unique_together = [['plan', 'domain']]
+
+    def __str__(self):
+        return self.domain
+
+    def clean(self):
+        # Store domains like the domains of email addresses
+        self.domain = self.domain.strip().lstrip('@').lower()
+
+    def save(self, *args, **kwargs):
+        self.clean()
+        super().save(*args, **kwargs)
+
+
 class Subscription(models.Model):
     """
     Model that holds the data for a user's subscription (an instance of a plan).
@@ -157,6 +185,41 @@ class Subscription(models.Model):
         default=timezone.now,
         verbose_name='Erstellt am'
     )
+    # Status fields, which are derived from the periods and payments and
+    # kept up to date by SubscriptionManager.update_status.
+    is_active = models.BooleanField(
+        default=False,
+        editable=False,
+        db_index=True,
+        verbose_name='Ist aktiv'
+    )
+    is_paid = models.BooleanField(
+        default=False,
+        editable=False,
+        db_index=True,
+        verbose_name='Ist bezahlt'
+    )
+    start_date = models.DateField(
+        null=True,
+        blank=True,
+        editable=False,
+        db_index=True,
+        verbose_name='Anfangsdatum'
+    )
+    end_date = models.DateField(
+        null=True,
+        blank=True,
+        editable=False,
+        db_index=True,
+        verbose_name='Enddatum'
+    )
+    # Names, email address and address of the subscription in the form
+    # of normalize_search_text, see SubscriptionManager.search
+    search_document = models.TextField(
+        default='',
+        editable=False,
+        verbose_name='Suchtext'
+    )
 
     objects = SubscriptionManager()
 
@@ -170,6 +233,29 @@ class Subscription(models.Model):
     def full_name(self):
         return '{} {}'.format(self.first_name, self.last_name)
 
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        """
+        Overrides the save method. Updates the search document.
+        """
+        self.search_document = self.get_search_document()
+        if update_fields is not None:
+            update_fields = set(update_fields) | {'search_document'}
+
+        super().save(force_insert, force_update, using, update_fields)
+
+    def get_search_document(self):
+        """
+        Returns the text in which subscriptions are searched: the names
+        and the email address of the user and the address.
+        """
+        values = [
+            self.first_name, self.last_name, self.address_line, self.additional_address_line,
+            self.postcode, self.town, self.country
+        ]
+        if self.user is not None:
+            values += [self.user.first_name, self.user.last_name, self.user.email]
+        return normalize_search_text(' '.join(value for value in values if value))
+
     def has_ended(self):
         """
         True if the subscription has ended.
@@ -192,7 +278,11 @@ class Subscription(models.Model):
     def is_renewable(self):
         """
         Returns true if the subscription can be renewed by its user.
+        Uses the annotation of SubscriptionManager.with_renewability
+        if the subscription has been loaded with it.
         """
+        if hasattr(self, 'renewable'):
+            return self.renewable
         if self.plan.is_eligible(self.user, 'renewal') and self.expires_in_lte(30) and self.is_paid:
             return True
         return False
@@ -280,3 +370,117 @@ class Period(models.Model):
         """
         return self.has_started() and not self.has_ended() and self.payment.is_paid()
     is_active.boolean = True
+
+
+class MonthlySubscriptionStats(models.Model):
+    """
+    Model that holds the statistics of one month, either of all subscriptions
+    or of the subscriptions of one plan. The statistics are computed from the
+    periods and payments and are recomputed once they are marked as stale.
+    """
+    month = models.DateField(
+        verbose_name='Monat'
+    )
+    plan = models.ForeignKey(
+        to='Plan',
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        verbose_name='Abotyp',
+        help_text='Kein Wert bedeutet, dass die Statistik alle Abotypen umfasst.'
+    )
+    active = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Aktive Abos'
+    )
+    new = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Neue Abos'
+    )
+    renewed = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Erneuerte Abos'
+    )
+    expired = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Abgelaufene Abos'
+    )
+    canceled = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Gekündigte Abos'
+    )
+    is_stale = models.BooleanField(
+        default=False,
+        db_index=True,
+        verbose_name='Veraltet'
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Aktualisiert am'
+    )
+
+    objects = MonthlySubscriptionStatsManager()
+
+    class Meta:
+        verbose_name = 'Monatsstatistik'
+        verbose_name_plural = 'Monatsstatistiken'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['month', 'plan'],
+                name='unique_monthly_stats_per_plan'
+            ),
+            models.UniqueConstraint(
+                fields=['month'],
+                condition=models.Q(plan__isnull=True),
+                name='unique_monthly_stats_total'
+            )
+        ]
+
+    def __str__(self):
+        return 'Statistik {:%m/%Y} ({})'.format(self.month, self.plan or 'alle Abotypen')
+
+
+class ExpirationReminder(models.Model):
+    """
+    Model that records an expiration reminder which has been queued for
+    a subscription. There is at most one reminder of each kind per end
+    date, so reruns of the reminder job never send duplicates.
+    """
+    KINDS = {
+        30: '30_days',
+        1: '1_day'
+    }
+
+    subscription = models.ForeignKey(
+        to='Subscription',
+        on_delete=models.CASCADE,
+        verbose_name='Abo'
+    )
+    end_date = models.DateField(
+        verbose_name='Enddatum'
+    )
+    kind = models.CharField(
+        max_length=10,
+        choices=(
+            ('30_days', '30 Tage vor Ablauf'),
+            ('1_day', '1 Tag vor Ablauf')
+        ),
+        verbose_name='Art'
+    )
+    sent_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name='Gesendet am'
+    )
+
+    class Meta:
+        verbose_name = 'Ablauferinnerung'
+        verbose_name_plural = 'Ablauferinnerungen'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['subscription', 'end_date', 'kind'],
+                name='unique_expiration_reminder'
+            )
+        ]
+
+    def __str__(self):
+        return '{} ({}, {})'.format(self.subscription, self.get_kind_display(), self.end_date)
@@ -0,0 +1,61 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from subscription_manager.utils.cache import bump_versions_on_commit
+
+from .models import Period, Plan, PlanEmailDomain, Subscription
+
+
+@receiver(post_save, sender=Subscription)
+def subscription_saved(sender, instance, **kwargs):
+    """
+    Updates the stored status and statistics of a saved
+    subscription, e.g. after it has been canceled.
+    """
+    Subscription.objects.handle_changes(Subscription.objects.filter(pk=instance.pk))
+
+
+@receiver(post_save, sender=Period)
+@receiver(post_delete, sender=Period)
+def period_changed(sender, instance, **kwargs):
+    """
+    Updates the stored status and statistics of the subscription
+    to which a created, changed or deleted period belongs.
+    """
+    Subscription.objects.handle_changes(Subscription.objects.filter(pk=instance.subscription_id))
+
+
+@receiver(post_delete, sender=Subscription)
+def subscription_deleted(sender, instance, **kwargs):
+    """
+    Invalidates the cached eligibility of the user
+    of a deleted subscription and the version of
+    all subscriptions.
+    """
+    bump_versions_on_commit('subscriptions')
+    if instance.user_id is not None:
+        Plan.objects.invalidate_eligibility([instance.user_id])
+
+
+@receiver(post_save, sender=Plan)
+@receiver(post_delete, sender=Plan)
+@receiver(post_save, sender=PlanEmailDomain)
+@receiver(post_delete, sender=PlanEmailDomain)
+def plan_changed(sender, instance, **kwargs):
+    """
+    Invalidates the cached eligibility of all users
+    and the plan catalogs of all processes.
+    """
+    Plan.objects.invalidate_eligibility()
+
+
+@receiver(post_save, sender=get_user_model())
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Updates the search documents of the subscriptions of a user
+    whose name or email address may have changed.
+    """
+    if created or update_fields is not None and not {'first_name', 'last_name', 'email'} & set(update_fields):
+        return
+    Subscription.objects.update_search_documents(Subscription.objects.filter(user=instance))
@@ -0,0 +1,299 @@
+import collections
+import datetime
+import itertools
+
+from django.conf import settings
+from django.db.models import Count
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Period, Subscription
+
+
+FIELDS = ('active', 'new', 'renewed', 'expired', 'canceled')
+
+
+def month_index(date):
+    """
+    Returns the number of months since year zero for a given date.
+    """
+    return date.year * 12 + date.month - 1
+
+
+def month_from_index(index):
+    """
+    Returns the first day of the month with the given index.
+    """
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def month_range(start, end):
+    """
+    Returns the first days of all months from start to end (inclusive).
+    """
+    return [month_from_index(index) for index in range(month_index(start), month_index(end) + 1)]
+
+
+def get_backend(path=None):
+    """
+    Returns an instance of the statistics backend with the given dotted
+    path, by default the one configured in the STATISTICS_BACKEND setting.
+    """
+    return import_string(path or settings.STATISTICS_BACKEND)()
+
+
+def get_monthly_statistics(start, end, backend=None):
+    """
+    Returns a dictionary which maps the first day of each month from start
+    to end (inclusive) to the number of active, new, renewed, expired, and
+    canceled subscriptions in that month.
+
+    The numbers are the same as those of the get_*_by_month methods of the
+    subscription manager, but they are computed by the configured backend.
+    """
+    statistics = {
+        month: {field: 0 for field in FIELDS}
+        for month in month_range(start, end)
+    }
+    for plan_statistics in get_monthly_statistics_by_plan(start, end, backend).values():
+        for month, values in plan_statistics.items():
+            for field in FIELDS:
+                statistics[month][field] += values[field]
+    return statistics
+
+
+def get_monthly_statistics_by_plan(start, end, backend=None):
+    """
+    Returns a dictionary which maps the id of each plan with at least one
+    subscription counted from start to end to its monthly statistics (see
+    get_monthly_statistics).
+    """
+    return get_backend(backend).get_monthly_statistics_by_plan(start, end)
+
+
+class StatisticsBackend:
+    """
+    Base class of the statistics backends. A backend computes the monthly
+    statistics of all plans from start to end in one go.
+    """
+
+    def get_monthly_statistics_by_plan(self, start, end):
+        raise NotImplementedError
+
+    @staticmethod
+    def to_dictionary(first, months, statistics):
+        """
+        Converts a dictionary which maps plan ids to lists of values per
+        field into the format returned by get_monthly_statistics_by_plan.
+        """
+        return {
+            plan_id: {
+                month_from_index(first + i): {field: int(plan_statistics[field][i]) for field in FIELDS}
+                for i in range(months)
+            }
+            for plan_id, plan_statistics in statistics.items()
+        }
+
+
+class QueryBackend(StatisticsBackend):
+    """
+    Runs the get_*_by_month queries of the subscription manager for every
+    month, grouped by plan. Slow, but serves as reference.
+    """
+
+    def get_monthly_statistics_by_plan(self, start, end):
+        first = month_index(start)
+        months = month_index(end) - first + 1
+
+        statistics = collections.defaultdict(lambda: {field: [0] * months for field in FIELDS})
+
+        for i in range(months):
+            month = month_from_index(first + i)
+            querysets = {
+                'active': Subscription.objects.get_active_by_month(month.year, month.month),
+                'new': Subscription.objects.get_new_by_month(month.year, month.month),
+                'renewed': Subscription.objects.get_renewed_by_month(month.year, month.month),
+                'expired': Subscription.objects.get_expired_by_month(month.year, month.month),
+                'canceled': Subscription.objects.get_canceled_by_month(month.year, month.month),
+            }
+            for field, queryset in querysets.items():
+                numbers = Subscription.objects.filter(
+                    pk__in=queryset.values('pk')
+                ).order_by().values_list('plan_id').annotate(number=Count('pk'))
+                for plan_id, number in numbers:
+                    statistics[plan_id][field][i] = number
+
+        return self.to_dictionary(first, months, statistics)
+
+
+class PythonBackend(StatisticsBackend):
+    """
+    Computes the statistics in one pass over all subscriptions and one
+    pass over all paid periods.
+    """
+
+    def get_monthly_statistics_by_plan(self, start, end):
+        first = month_index(start)
+        last = month_index(end)
+        months = last - first + 1
+
+        statistics = collections.defaultdict(lambda: {field: [0] * months for field in FIELDS})
+
+        def count(plan_id, field, index):
+            if first <= index <= last:
+                statistics[plan_id][field][index - first] += 1
+
+        # A subscription is active in every month between its start and end
+        # date. Store only where the interval starts and ends and sum it up.
+        active_changes = collections.defaultdict(lambda: [0] * (months + 1))
+
+        subscriptions = Subscription.objects.values_list('plan_id', 'start_date', 'end_date', 'canceled_at')
+        for plan_id, start_date, end_date, canceled_at in subscriptions.iterator():
+            if start_date is not None:
+                count(plan_id, 'new', month_index(start_date))
+            if end_date is not None and canceled_at is None:
+                count(plan_id, 'expired', month_index(end_date))
+            if canceled_at is not None:
+                count(plan_id, 'canceled', month_index(timezone.localtime(canceled_at)))
+            if start_date is not None and end_date is not None:
+                lower = max(month_index(start_date), first)
+                upper = min(month_index(end_date), last)
+                if lower <= upper:
+                    active_changes[plan_id][lower - first] += 1
+                    active_changes[plan_id][upper - first + 1] -= 1
+
+        for plan_id, changes in active_changes.items():
+            active = 0
+            for i in range(months):
+                active += changes[i]
+                statistics[plan_id]['active'][i] = active
+
+        # A subscription is renewed in a month if two of its paid periods start
+        # or end in that month. Periods are grouped by subscription so that only
+        # the months of one subscription have to be kept in memory.
+        periods = Period.objects.filter(
+            start_date__isnull=False,
+            end_date__isnull=False,
+            payment__paid_at__isnull=False
+        ).order_by('subscription_id').values_list('subscription_id', 'subscription__plan_id', 'start_date', 'end_date')
+
+        for _, subscription_periods in itertools.groupby(periods.iterator(), key=lambda period: period[0]):
+            periods_by_month = collections.Counter()
+            for _, plan_id, start_date, end_date in subscription_periods:
+                periods_by_month.update({month_index(start_date), month_index(end_date)})
+            for index, number in periods_by_month.items():
+                if number == 2:
+                    count(plan_id, 'renewed', index)
+
+        return self.to_dictionary(first, months, statistics)
+
+
+class NumpyBackend(StatisticsBackend):
+    """
+    Loads all paid periods once into NumPy arrays and computes the
+    statistics with sorted arrays and cumulative sums. The start and end
+    dates of the subscriptions are derived from the periods themselves.
+    """
+
+    def get_monthly_statistics_by_plan(self, start, end):
+        import numpy
+
+        first = month_index(start)
+        last = month_index(end)
+        months = last - first + 1
+
+        # Load the paid periods sorted by subscription
+        periods = Period.objects.filter(
+            payment__paid_at__isnull=False
+        ).order_by('subscription_id').values_list('subscription_id', 'subscription__plan_id', 'start_date', 'end_date')
+        subscription_ids, plan_ids, start_dates, end_dates = zip(*periods) if periods else ((), (), (), ())
+        subscription_ids = numpy.array(subscription_ids, dtype=numpy.int64)
+        plan_ids = numpy.array(plan_ids, dtype=numpy.int64)
+        start_months = self.to_months(start_dates)
+        end_months = self.to_months(end_dates)
+
+        # Load the canceled subscriptions with the month of cancellation in local time
+        canceled_subscriptions = Subscription.objects.filter(
+            canceled_at__isnull=False
+        ).values_list('pk', 'plan_id', 'canceled_at')
+        canceled_ids, canceled_plan_ids, canceled_months = (numpy.array([
+            (pk, plan_id, month_index(timezone.localtime(canceled_at)))
+            for pk, plan_id, canceled_at in canceled_subscriptions
+        ], dtype=numpy.int64).reshape(-1, 3)).T
+
+        # Map the plan ids to consecutive indices
+        plans = numpy.unique(numpy.concatenate([plan_ids, canceled_plan_ids]))
+        counts = numpy.zeros((len(FIELDS), len(plans), months), dtype=numpy.int64)
+
+        def count(field, plan_indices, indices):
+            mask = (indices >= first) & (indices <= last)
+            positions = plan_indices[mask] * months + indices[mask] - first
+            counts[FIELDS.index(field)] += numpy.bincount(
+                positions, minlength=len(plans) * months
+            ).reshape(len(plans), months)
+
+        # The start of a subscription is the earliest start of its periods,
+        # the end the latest end.
+        subscriptions, offsets = numpy.unique(subscription_ids, return_index=True)
+        subscription_plans = numpy.searchsorted(plans, plan_ids[offsets])
+        missing = numpy.iinfo(numpy.int64).max
+        if len(subscriptions) > 0:
+            subscription_starts = numpy.minimum.reduceat(numpy.where(start_months < 0, missing, start_months), offsets)
+            subscription_ends = numpy.maximum.reduceat(end_months, offsets)
+        else:
+            subscription_starts = subscription_ends = numpy.zeros(0, dtype=numpy.int64)
+        has_start = subscription_starts != missing
+        has_end = subscription_ends >= 0
+        expires = has_end & ~numpy.isin(subscriptions, canceled_ids)
+
+        count('new', subscription_plans[has_start], subscription_starts[has_start])
+        count('expired', subscription_plans[expires], subscription_ends[expires])
+        count('canceled', numpy.searchsorted(plans, canceled_plan_ids), canceled_months)
+
+        # A subscription is active in every month between its start and end
+        # month. Count where the intervals start and end and sum it up.
+        has_interval = has_start & has_end
+        lower = numpy.maximum(subscription_starts[has_interval], first) - first
+        upper = numpy.minimum(subscription_ends[has_interval], last) - first
+        interval_plans = subscription_plans[has_interval]
+        overlaps = lower <= upper
+        size = len(plans) * (months + 1)
+        changes = (
+            numpy.bincount(interval_plans[overlaps] * (months + 1) + lower[overlaps], minlength=size) -
+            numpy.bincount(interval_plans[overlaps] * (months + 1) + upper[overlaps] + 1, minlength=size)
+        )
+        counts[FIELDS.index('active')] = numpy.cumsum(changes.reshape(len(plans), months + 1), axis=1)[:, :months]
+
+        # A subscription is renewed in a month if two of its paid periods start
+        # or end in that month. Encode subscription and month in one key and
+        # count how often every key occurs.
+        complete = (start_months >= 0) & (end_months >= 0)
+        differs = end_months != start_months
+        factor = 1 << 20
+        keys = numpy.concatenate([
+            subscription_ids[complete] * factor + start_months[complete],
+            subscription_ids[complete & differs] * factor + end_months[complete & differs],
+        ])
+        keys, numbers = numpy.unique(keys, return_counts=True)
+        keys = keys[numbers == 2]
+        renewed_subscriptions = numpy.searchsorted(subscriptions, keys // factor)
+        count('renewed', subscription_plans[renewed_subscriptions], keys % factor)
+
+        statistics = {}
+        for plan_index, plan_id in enumerate(plans.tolist()):
+            if counts[:, plan_index].any():
+                statistics[plan_id] = {field: counts[i, plan_index].tolist() for i, field in enumerate(FIELDS)}
+
+        return self.to_dictionary(first, months, statistics)
+
+    @staticmethod
+    def to_months(dates):
+        """
+        Converts a sequence of dates into an array of month indices.
+        Missing dates are converted to -1.
+        """
+        import numpy
+
+        dates = numpy.array(dates, dtype='datetime64[D]')
+        indices = dates.astype('datetime64[M]').astype(numpy.int64) + month_index(datetime.date(1970, 1, 1))
+        return numpy.where(numpy.isnat(dates), -1, indices)
@@ -1,56 +1,118 @@
 from django.conf import settings
-from django.core.mail import send_mass_mail
-from django.template.loader import render_to_string
+from django.core.mail import EmailMessage
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.template.loader import get_template
 from django.utils import timezone
 
-from subscription_manager.user.models import Token
+from subscription_manager.mail.models import OutboundEmail
+from subscription_manager.user.models import EmailAddress, Token
 
-from .models import Subscription
+from .models import ExpirationReminder, Subscription
 
 
 def send_expiration_emails(queryset=None, remaining_days=None):
     """
-    Sends an email to users whose subscriptions expire.
+    Queues an email to users whose subscriptions expire.
+
+    If the number of remaining days is given, all subscriptions which
+    have reached that reminder threshold without having been reminded
+    are selected, at most EXPIRATION_REMINDERS_PER_RUN per call. Every
+    queued reminder is recorded per subscription, end date and kind, so
+    the function can be run again after a failure without sending
+    duplicates, and subscriptions missed by an earlier run are caught
+    up. The subscriptions are processed in chunks, each of which is
+    committed on its own.
     """
     if remaining_days is None and queryset is None:
         return
-    # Get all expiring subscriptions which are renewable
+
+    kind = None
     if queryset is None:
-        queryset = Subscription.objects.get_expiring(timezone.timedelta(days=remaining_days)).filter(plan__is_renewable=True)
+        kind = ExpirationReminder.KINDS[remaining_days]
+        queryset = Subscription.objects.get_due_for_reminder(remaining_days)
+        subscription_ids = list(queryset.values_list('pk', flat=True)[:settings.EXPIRATION_REMINDERS_PER_RUN])
+    else:
+        # Subscriptions which are not owned by a user are skipped
+        subscription_ids = list(queryset.filter(user__isnull=False).order_by('pk').values_list('pk', flat=True))
+
+    batch_size = settings.EXPIRATION_REMINDER_BATCH_SIZE
+    for i in range(0, len(subscription_ids), batch_size):
+        send_expiration_email_batch(subscription_ids[i:i + batch_size], remaining_days, kind)
+
+
+@transaction.atomic
+def send_expiration_email_batch(subscription_ids, remaining_days=None, kind=None):
+    """
+    Queues the expiration emails of the given subscriptions within one
+    transaction: login tokens, emails and reminder records are created
+    with one query each.
+    """
+    subscriptions = Subscription.objects.filter(pk__in=subscription_ids).select_related('user').order_by('pk')
+    if kind is not None:
+        # Check again inside the transaction
+        subscriptions = subscriptions.exclude(
+            Exists(ExpirationReminder.objects.filter(
+                subscription=OuterRef('pk'),
+                end_date=OuterRef('end_date'),
+                kind=kind
+            ))
+        )
+    subscriptions = list(subscriptions)
+
+    # Get the primary email addresses of all users at once
+    primary_email_addresses = {
+        email_address.user_id: email_address
+        for email_address in EmailAddress.objects.filter(
+            user__in={subscription.user_id for subscription in subscriptions},
+            is_primary=True
+        )
+    }
+    subscriptions = [subscription for subscription in subscriptions if subscription.user_id in primary_email_addresses]
 
-    # Loop through subscriptions and send an reminder email to all users
-    messages = []
-    for subscription in queryset:
-        # If subscription is not owned by a user, skip
-        user = subscription.user
-        if user is None:
-            continue
+    # Create login tokens
+    tokens = Token.objects.bulk_create_for(
+        [primary_email_addresses[subscription.user_id] for subscription in subscriptions],
+        purpose='login'
+    )
 
-        # Create login token
-        token = Token.objects.create(email_address=user.primary_email(), purpose='login')
+    today = timezone.now().date()
+    if remaining_days == 1:
+        subject = settings.EMAIL_SUBJECT_PREFIX + 'Abo endet heute'
+    else:
+        subject = settings.EMAIL_SUBJECT_PREFIX + 'Abo verlängern'
 
-        # Add expiration email message
+    def get_remaining_days_text(subscription):
         if remaining_days is None:
-            subject = settings.EMAIL_SUBJECT_PREFIX + 'Abo verlängern'
-            remaining_days_text = 'bald'
-        elif remaining_days == 1:
-            subject = settings.EMAIL_SUBJECT_PREFIX + 'Abo endet heute'
-            remaining_days_text = 'heute'
-        else:
-            subject = settings.EMAIL_SUBJECT_PREFIX + 'Abo verlängern'
-            remaining_days_text = 'in {} Tagen'.format(remaining_days)
-
-        messages.append((
-            subject,
-            render_to_string('emails/subscription_expiration.txt', {
-                'to_name': user.first_name,
+            return 'bald'
+        if remaining_days == 1:
+            return 'heute'
+        # Reminders caught up late state the actual number of days
+        return 'in {} Tagen'.format((subscription.end_date - today).days)
+
+    # Render all expiration emails with the same template instance
+    template = get_template('emails/subscription_expiration.txt')
+    messages = [
+        EmailMessage(
+            subject=subject,
+            body=template.render({
+                'to_name': subscription.user.first_name,
                 'subscription_id': subscription.id,
                 'token': token,
-                'remaining_days': remaining_days_text
+                'remaining_days': get_remaining_days_text(subscription)
             }),
-            settings.DEFAULT_FROM_EMAIL,
-            [user.email]
-        ))
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            to=[subscription.user.email]
+        )
+        for subscription, token in zip(subscriptions, tokens)
+    ]
+    OutboundEmail.objects.queue_many(messages)
+
+    # Record the reminders
+    if kind is not None:
+        ExpirationReminder.objects.bulk_create([
+            ExpirationReminder(subscription=subscription, end_date=subscription.end_date, kind=kind)
+            for subscription in subscriptions
+        ])
 
-    # Send all expiration emails
-    send_mass_mail(tuple(messages), fail_silently=False)
+    return len(messages)
@@ -0,0 +1,414 @@
+import datetime
+import importlib
+from io import BytesIO
+from unittest import mock
+
+from django.apps import apps
+from django.contrib.admin.sites import site
+from django.http import StreamingHttpResponse
+from django.core.cache import caches
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+from import_export.formats.base_formats import XLSX
+from openpyxl import load_workbook
+
+from subscription_manager.mail.models import OutboundEmail
+from subscription_manager.payment.models import Payment
+from subscription_manager.user.models import User
+from subscription_manager.utils.cache import get_versions
+from subscription_manager.utils.pagination import KeysetPaginator
+
+from .models import ExpirationReminder, Period, Plan, Subscription
+from .statistics import FIELDS, get_monthly_statistics_by_plan, month_range
+from .tasks import send_expiration_emails
+
+
+BACKENDS = (
+    'subscription_manager.subscription.statistics.QueryBackend',
+    'subscription_manager.subscription.statistics.PythonBackend',
+    'subscription_manager.subscription.statistics.NumpyBackend',
+)
+
+
+def utc(*args):
+    return datetime.datetime(*args, tzinfo=datetime.timezone.utc)
+
+
+class StatisticsBackendTests(TestCase):
+    """
+    Compares the monthly statistics of all backends with the
+    per-month queries of the subscription manager.
+    """
+    start = datetime.date(2019, 11, 1)
+    end = datetime.date(2021, 2, 1)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.plans = [
+            Plan.objects.create(name='Studierende', slug='studierende', price=20),
+            Plan.objects.create(name='Gönner', slug='goenner', price=100),
+        ]
+        plan_a, plan_b = cls.plans
+
+        # Periods across month and year boundaries
+        cls.create_subscription(plan_a, [(datetime.date(2019, 12, 31), datetime.date(2020, 12, 31), True)])
+        cls.create_subscription(plan_a, [(datetime.date(2020, 1, 31), datetime.date(2020, 3, 1), True)])
+        cls.create_subscription(plan_b, [(datetime.date(2020, 2, 29), datetime.date(2021, 1, 1), True)])
+
+        # Renewals: two paid periods meet in March and in the same month twice
+        cls.create_subscription(plan_a, [
+            (datetime.date(2020, 2, 1), datetime.date(2020, 3, 15), True),
+            (datetime.date(2020, 3, 15), datetime.date(2020, 4, 15), True),
+        ])
+        cls.create_subscription(plan_b, [
+            (datetime.date(2020, 5, 1), datetime.date(2020, 5, 20), True),
+            (datetime.date(2020, 5, 20), datetime.date(2020, 6, 30), True),
+            (datetime.date(2020, 6, 30), datetime.date(2020, 9, 1), False),
+        ])
+
+        # Unpaid periods and periods without dates
+        cls.create_subscription(plan_a, [(datetime.date(2020, 4, 1), datetime.date(2021, 4, 1), False)])
+        cls.create_subscription(plan_b, [(None, None, False)])
+        cls.create_subscription(plan_b, [(None, None, True)])
+
+        # Cancellations around the changes to and from daylight saving time
+        # in Europe/Zurich: the local month differs from the UTC month
+        for canceled_at in [
+            utc(2020, 3, 29, 0, 30),  # 01:30 CET, before the change
+            utc(2020, 3, 31, 22, 30),  # 00:30 CEST on April 1
+            utc(2020, 10, 25, 0, 30),  # 02:30 CEST, before the change
+            utc(2020, 10, 31, 23, 30),  # 00:30 CET on November 1
+        ]:
+            subscription = cls.create_subscription(
+                plan_b, [(datetime.date(2020, 1, 15), datetime.date(2021, 1, 15), True)]
+            )
+            subscription.canceled_at = canceled_at
+            subscription.save()
+
+    @staticmethod
+    def create_subscription(plan, periods):
+        subscription = Subscription.objects.create(
+            plan=plan,
+            first_name='Vorname',
+            last_name='Nachname',
+            address_line='Strasse 1',
+            postcode='8000',
+            town='Zürich'
+        )
+        for start_date, end_date, paid in periods:
+            period = Period.objects.create(subscription=subscription, start_date=start_date, end_date=end_date)
+            Payment.objects.create(
+                period=period,
+                amount=plan.price,
+                due_on=datetime.date(2020, 1, 1),
+                paid_at=timezone.now() if paid else None
+            )
+        return subscription
+
+    def get_expected(self, plan, month):
+        queries = {
+            'active': Subscription.objects.get_active_by_month,
+            'new': Subscription.objects.get_new_by_month,
+            'renewed': Subscription.objects.get_renewed_by_month,
+            'expired': Subscription.objects.get_expired_by_month,
+            'canceled': Subscription.objects.get_canceled_by_month,
+        }
+        return {
+            field: query(month.year, month.month).filter(plan=plan).count()
+            for field, query in queries.items()
+        }
+
+    def test_backends_match_per_month_queries(self):
+        expected = {
+            plan.pk: {month: self.get_expected(plan, month) for month in month_range(self.start, self.end)}
+            for plan in self.plans
+        }
+        # The data covers every field at least once
+        for field in FIELDS:
+            self.assertTrue(any(
+                values[field] for statistics in expected.values() for values in statistics.values()
+            ), field)
+
+        zero = {field: 0 for field in FIELDS}
+        for backend in BACKENDS:
+            statistics = get_monthly_statistics_by_plan(self.start, self.end, backend)
+            for plan in self.plans:
+                for month in month_range(self.start, self.end):
+                    with self.subTest(backend=backend, plan=plan.slug, month=month):
+                        self.assertEqual(
+                            statistics.get(plan.pk, {}).get(month, zero),
+                            expected[plan.pk][month]
+                        )
+
+
+class SubscriptionExportTests(TestCase):
+    """
+    Tests the .xlsx export of the subscription admin.
+    """
+
+    def test_xlsx_export_is_streamed(self):
+        plan = Plan.objects.create(name='Studierende', slug='studierende', price=20)
+        for i in range(3):
+            Subscription.objects.create(
+                plan=plan,
+                first_name='Vorname {}'.format(i),
+                last_name='Nachname',
+                address_line='Strasse 1',
+                postcode='8000',
+                town='Zürich'
+            )
+        admin_user = User.objects.create_superuser('admin@example.com', 'password', first_name='A', last_name='B')
+        self.client.force_login(admin_user)
+
+        formats = site._registry[Subscription].get_export_formats()
+        file_format = next(i for i, file_format in enumerate(formats) if issubclass(file_format, XLSX))
+        response = self.client.post(reverse('admin:subscription_subscription_export'), {'file_format': file_format})
+
+        self.assertIsInstance(response, StreamingHttpResponse)
+        self.assertIn('attachment', response['Content-Disposition'])
+        rows = list(load_workbook(BytesIO(b''.join(response.streaming_content)), read_only=True).active.values)
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(sorted(row[0] for row in rows[1:]), ['Vorname 0', 'Vorname 1', 'Vorname 2'])
+
+
+class ExpirationReminderTests(TestCase):
+    """
+    Tests that expiration reminders are sent once per subscription,
+    end date and kind.
+    """
+
+    def setUp(self):
+        self.plan = Plan.objects.create(name='Studierende', slug='studierende', price=20)
+        self.today = timezone.now().date()
+
+    def create_subscription(self, remaining_days):
+        user = User.objects.create_user(
+            'abo-{}@example.com'.format(remaining_days), first_name='Vorname', last_name='Nachname'
+        )
+        subscription = Subscription.objects.create(
+            user=user,
+            plan=self.plan,
+            first_name='Vorname',
+            last_name='Nachname',
+            address_line='Strasse 1',
+            postcode='8000',
+            town='Zürich'
+        )
+        period = Period.objects.create(
+            subscription=subscription,
+            start_date=self.today - datetime.timedelta(days=300),
+            end_date=self.today + datetime.timedelta(days=remaining_days)
+        )
+        Payment.objects.create(period=period, amount=20, due_on=self.today, paid_at=timezone.now())
+        return subscription
+
+    def test_repeated_runs_send_no_duplicates(self):
+        for remaining_days in (30, 12, 2, 1):
+            self.create_subscription(remaining_days)
+
+        send_expiration_emails(remaining_days=30)
+        send_expiration_emails(remaining_days=1)
+        self.assertEqual(OutboundEmail.objects.count(), 4)
+
+        send_expiration_emails(remaining_days=30)
+        send_expiration_emails(remaining_days=1)
+        self.assertEqual(OutboundEmail.objects.count(), 4)
+        self.assertEqual(ExpirationReminder.objects.filter(kind='30_days').count(), 3)
+        self.assertEqual(ExpirationReminder.objects.filter(kind='1_day').count(), 1)
+
+    def test_seeded_reminders_are_not_sent_again(self):
+        reminded = [self.create_subscription(remaining_days) for remaining_days in (30, 12, 2)]
+        migration = importlib.import_module(
+            'subscription_manager.subscription.migrations.0008_seed_expiration_reminders'
+        )
+        migration.seed_expiration_reminders(apps, None)
+        self.assertEqual(
+            set(ExpirationReminder.objects.filter(kind='30_days').values_list('subscription', flat=True)),
+            {subscription.pk for subscription in reminded}
+        )
+
+        send_expiration_emails(remaining_days=30)
+        self.assertEqual(OutboundEmail.objects.count(), 0)
+
+
+class SearchTests(TestCase):
+    """
+    Tests the search in the stored search documents and its ranking.
+    """
+
+    def setUp(self):
+        self.plan = Plan.objects.create(name='Studierende', slug='studierende', price=20)
+        self.ann = self.create_subscription('Ann', 'Müller', 'ann@example.com', town='Zürich')
+        self.johann = self.create_subscription('Johann', 'Zoë', 'johann@example.com', town='Bern')
+        self.hanna = self.create_subscription('Hanna', 'Roth', 'hanna@example.com', town='Basel')
+
+    def create_subscription(self, first_name, last_name, email, town):
+        user = User.objects.create_user(email, first_name=first_name, last_name=last_name)
+        subscription = Subscription.objects.create(
+            user=user,
+            plan=self.plan,
+            first_name=first_name,
+            last_name=last_name,
+            address_line='Strasse 1',
+            postcode='8000',
+            town=town
+        )
+        period = Period.objects.create(subscription=subscription)
+        Payment.objects.create(period=period, amount=20, due_on=datetime.date(2020, 1, 1))
+        return subscription
+
+    def search(self, query):
+        return list(Subscription.objects.search(query))
+
+    def test_accents_and_case_are_folded(self):
+        self.assertEqual(self.search('MULLER'), [self.ann])
+        self.assertEqual(self.search('müller zürich'), [self.ann])
+        self.assertEqual(self.search('zoe'), [self.johann])
+        self.assertEqual(self.search('Zoë JOHANN@example.com'), [self.johann])
+        self.assertEqual(self.search('muller bern'), [])
+
+    def test_results_are_ranked_by_word_starts(self):
+        # "ann" begins a word of Ann Müller, but only occurs within the
+        # words of Hanna Roth and Johann Zoë, which are ordered by name
+        results = Subscription.objects.search('ann')
+        self.assertEqual(list(results), [self.ann, self.hanna, self.johann])
+        self.assertEqual([subscription.search_rank for subscription in results], [1, 0, 0])
+
+        self.assertEqual(self.search('ann ann@'), [self.ann, self.johann])
+        self.assertEqual(self.search('hann'), [self.hanna, self.johann])
+
+    def test_search_without_trigram_index(self):
+        # The trigram index is only created on PostgreSQL; other
+        # databases search the documents without an index
+        migration = importlib.import_module('subscription_manager.subscription.migrations.0007_subscription_search_document')
+        schema_editor = mock.Mock()
+        schema_editor.connection.vendor = 'sqlite'
+        migration.create_trigram_index(apps, schema_editor)
+        migration.drop_trigram_index(apps, schema_editor)
+        schema_editor.execute.assert_not_called()
+
+        schema_editor.connection.vendor = 'postgresql'
+        migration.create_trigram_index(apps, schema_editor)
+        self.assertEqual(schema_editor.execute.call_count, 2)
+
+        self.assertEqual(self.search('bern'), [self.johann])
+
+    def test_user_changes_update_search_documents(self):
+        user = self.ann.user
+        user.last_name = 'Weber'
+        user.email = 'ann.weber@example.com'
+        user.save()
+        self.ann.refresh_from_db()
+        self.assertIn('weber', self.ann.search_document)
+        self.assertEqual(self.search('ann.weber@'), [self.ann])
+
+        user.first_name = 'Annette'
+        user.save(update_fields=['first_name'])
+        self.assertEqual(self.search('annette'), [self.ann])
+
+        # Other fields do not change the document
+        with mock.patch.object(Subscription.objects, 'update_search_documents') as update_search_documents:
+            user.save(update_fields=['is_active'])
+        update_search_documents.assert_not_called()
+
+    def test_admin_orders_by_rank(self):
+        admin_user = User.objects.create_superuser('admin@example.com', 'password', first_name='A', last_name='B')
+        self.client.force_login(admin_user)
+
+        response = self.client.get(reverse('admin:subscription_subscription_changelist'), {'q': 'ann'})
+        self.assertEqual(list(response.context['cl'].result_list), [self.ann, self.hanna, self.johann])
+
+        # A chosen column takes precedence over the rank
+        response = self.client.get(reverse('admin:subscription_subscription_changelist'), {'q': 'ann', 'o': '-6'})
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(reverse('admin:payment_payment_changelist'), {'q': 'ann'})
+        self.assertEqual(
+            [payment.period.subscription for payment in response.context['cl'].result_list],
+            [self.ann, self.hanna, self.johann]
+        )
+
+    def test_payment_list_orders_by_rank(self):
+        admin_user = User.objects.create_superuser('admin@example.com', 'password', first_name='A', last_name='B')
+        self.client.force_login(admin_user)
+
+        response = self.client.get(reverse('administration_payment_list'), {'query': 'ann'})
+        self.assertEqual(
+            [payment.period.subscription for payment in response.context['payments']],
+            [self.ann, self.hanna, self.johann]
+        )
+
+        # The cursors contain the rank
+        queryset = Payment.objects.annotate(
+            search_rank=Subscription.objects.get_search_rank('ann', prefix='period__subscription__')
+        )
+        paginator = KeysetPaginator(queryset, 1, ('-search_rank', '-created_at', '-pk'))
+        page = paginator.get_page()
+        pages = [page]
+        while page.has_next():
+            page = paginator.get_page(after=page.next_cursor)
+            pages.append(page)
+        self.assertEqual(
+            [payment.period.subscription for page in pages for payment in page],
+            [self.ann, self.hanna, self.johann]
+        )
+        previous_page = paginator.get_page(before=pages[-1].previous_cursor)
+        self.assertEqual([payment.period.subscription for payment in previous_page], [self.hanna])
+
+
+class CacheInvalidationTests(TransactionTestCase):
+    """
+    Tests that cache versions are only bumped once changes have been
+    committed, so that no other process caches the old data under the
+    new versions.
+    """
+
+    def setUp(self):
+        caches['shared'].clear()
+        self.user = User.objects.create_user('cache@example.com', first_name='Vorname', last_name='Nachname')
+        self.plan = Plan.objects.create(name='Studierende', slug='studierende', price=20)
+        self.subscription = Subscription.objects.create(
+            user=self.user,
+            plan=self.plan,
+            first_name='Vorname',
+            last_name='Nachname',
+            address_line='Strasse 1',
+            postcode='8000',
+            town='Zürich'
+        )
+        self.names = (
+            'subscriptions',
+            'subscription:{}'.format(self.subscription.pk),
+            'eligibility:user:{}'.format(self.user.pk),
+            'plans'
+        )
+
+    def get_versions(self):
+        return get_versions(*self.names)
+
+    def assertBumpedOnCommit(self, change, bumped):
+        versions = self.get_versions()
+        with transaction.atomic():
+            change()
+            self.assertEqual(self.get_versions(), versions)
+        self.assertEqual([new != old for new, old in zip(self.get_versions(), versions)], bumped)
+
+    def test_subscription_changed(self):
+        self.assertBumpedOnCommit(lambda: Period.objects.create(subscription=self.subscription), [True, True, True, False])
+
+    def test_subscription_deleted(self):
+        self.assertBumpedOnCommit(self.subscription.delete, [True, False, True, False])
+
+    def test_plan_changed(self):
+        self.plan.price = 30
+        self.assertBumpedOnCommit(self.plan.save, [False, False, False, True])
+
+    def test_rollback(self):
+        versions = self.get_versions()
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            Period.objects.create(subscription=self.subscription)
+            self.plan.save()
+            raise RuntimeError
+        self.assertEqual(self.get_versions(), versions)
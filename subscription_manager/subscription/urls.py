@@ -2,10 +2,10 @@ from django.urls import path
 from django.views.generic.base import RedirectView
 
 from .views import SubscriptionListView, SubscriptionCreateView, SubscriptionUpdateView, SubscriptionDetailView,\
-    SubscriptionCancelView, PlanListView, PeriodCreateView
+    SubscriptionCancelView, PeriodCreateView, plan_list_view
 
 urlpatterns = [
-    path('bestellen/', PlanListView.as_view(), name='plan_list'),
+    path('bestellen/', plan_list_view, name='plan_list'),
     path('bestellen/<slug:plan_slug>/', SubscriptionCreateView.as_view(), name='subscription_create'),
     path('abos/', SubscriptionListView.as_view(), name='subscription_list'),
     path('abos/<int:subscription_id>/', SubscriptionDetailView.as_view(), name='subscription_detail'),
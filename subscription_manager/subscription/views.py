@@ -1,3 +1,4 @@
+from asgiref.sync import sync_to_async
 from django.db import transaction
 from django.conf import settings
 from django.contrib import messages
@@ -12,6 +13,7 @@ from django.views import View
 from django.views.generic import detail, edit, list
 
 from subscription_manager.payment.forms import PaymentForm
+from subscription_manager.utils.conditional import async_etag, versioned_etag
 
 from .forms import SubscriptionForm
 from .models import Subscription, Plan, Period
@@ -30,12 +32,7 @@ class SubscriptionCreateView(View):
         plan_slug = self.kwargs.get('plan_slug')
 
         # Check if plan exists
-        try:
-            plan = Plan.objects.get(slug=plan_slug)
-        except Plan.DoesNotExist:
-            plan = None
-
-        return plan
+        return Plan.objects.get_catalog().get(slug=plan_slug)
 
     def dispatch(self, request, *args, **kwargs):
         """
@@ -129,24 +126,39 @@ class SubscriptionCreateView(View):
         })
 
 
-class PlanListView(list.ListView):
+def get_plan_list_versions(request, *args, **kwargs):
     """
-    Lists all plans for which the user can potentially purchase.
+    Returns the values on which the plan list depends: the plans, the
+    user's eligibility, which may change with the date, and the user's
+    name and role in the navigation.
     """
-    context_object_name = 'plans'
-    template_name = 'subscription/plan_list.html'
-
-    def get_queryset(self):
-        """
-        Returns only plans for which the user is potentially eligible.
-        """
-        return Plan.objects.filter_eligible(self.request.user)
+    user = request.user
+    return (
+        *Plan.objects.get_eligibility_versions(user),
+        timezone.now().date(),
+        user.pk,
+        user.full_name() if user.is_authenticated else '',
+        user.is_staff
+    )
+
+
+@async_etag(versioned_etag(get_plan_list_versions))
+async def plan_list_view(request):
+    """
+    Lists all plans for which the user can potentially purchase and
+    the purchasable plans for which the user is not eligible. The plans
+    are taken from the catalog and the eligibility from the cache, so
+    usually no queries are needed. Unchanged lists are answered with
+    304 Not Modified.
+    """
+    catalog = await sync_to_async(Plan.objects.get_catalog, thread_sensitive=True)()
+    eligible_plan_ids = await sync_to_async(Plan.objects.get_eligible_ids, thread_sensitive=True)(request.user)
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        eligible_plans_pk = Plan.objects.filter_eligible(self.request.user).values('pk')
-        context['not_eligible_plans'] = Plan.objects.filter(is_purchasable=True).exclude(pk__in=eligible_plans_pk)
-        return context
+    # The context processors use the session
+    return await sync_to_async(render, thread_sensitive=True)(request, 'subscription/plan_list.html', {
+        'plans': catalog.filter(eligible_plan_ids),
+        'not_eligible_plans': [plan for plan in catalog.exclude(eligible_plan_ids) if plan.is_purchasable]
+    })
 
 
 @method_decorator(login_required, name='dispatch')
@@ -160,7 +172,11 @@ class SubscriptionListView(list.ListView):
     ordering = ['canceled_at', '-created_at']
 
     def get_queryset(self):
-        queryset = Subscription.objects.filter(user=self.request.user).select_related('plan', 'user')
+        """
+        Returns the subscriptions as fragments, which are only loaded
+        if they are not cached.
+        """
+        queryset = Subscription.objects.filter(user=self.request.user)
 
         ordering = self.get_ordering()
         if ordering:
@@ -168,7 +184,7 @@ class SubscriptionListView(list.ListView):
                 ordering = (ordering,)
             queryset = queryset.order_by(*ordering)
 
-        return queryset
+        return Subscription.objects.get_fragments('subscription_list_item', queryset, self.request.user)
 
 
 @method_decorator(login_required, name='dispatch')
@@ -191,17 +207,26 @@ class SubscriptionDetailView(detail.DetailView):
         subscription_id = self.kwargs['subscription_id']
         user = self.request.user
         # Get object or raise 404
-        subscription = get_object_or_404(Subscription.objects.select_related('plan'), id=subscription_id, user=user)
-        return subscription
+        fragments = Subscription.objects.get_fragments(
+            'subscription_detail', Subscription.objects.filter(id=subscription_id, user=user), user
+        )
+        if not fragments:
+            raise Http404
+        self.fragment = fragments[0]
+        return self.fragment.subscription
 
     def get_context_data(self, **kwargs):
         """
-        Adds all associated payments to the context.
+        Adds the fragment and all associated payments to the context.
+        The subscription and the payments are only loaded if the fragment
+        is not cached, so unlike SingleObjectMixin.get_context_data, the
+        subscription is not evaluated here.
         """
-        data = super().get_context_data(**kwargs)
-        periods = Period.objects.filter(subscription=self.object).order_by('-end_date').select_related('payment')
-        data['periods'] = periods
-        return data
+        kwargs.setdefault('view', self)
+        kwargs[self.context_object_name] = self.object
+        kwargs['fragment'] = self.fragment
+        kwargs['periods'] = Period.objects.filter(subscription=self.fragment.pk).order_by('-end_date').select_related('payment')
+        return kwargs
 
 
 @method_decorator(login_required, name='dispatch')
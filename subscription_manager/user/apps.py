@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class UserConfig(AppConfig):
     name = 'subscription_manager.user'
+
+    def ready(self):
+        # Connect signal receivers
+        from . import signals  # noqa: F401
@@ -1,32 +1,16 @@
 from django.contrib.auth import backends
 
-from .models import Token
-
 
 class TokenBackend(backends.ModelBackend):
     """
-    Custom authentication backend that handles
-    authentication by token.
+    Custom authentication backend for users who are logged in by token.
+    Tokens are redeemed by the token verification views (see
+    Token.objects.redeem), which log the user in with this backend, so
+    it only loads the users of sessions.
     """
-    def authenticate(self, request, code=None, **kwargs):
+    def authenticate(self, request, **kwargs):
         """
-        Checks if a given token is valid. If so, the user is returned,
-        otherwise None.
+        Users are only logged in by redeeming tokens, never
+        by credentials.
         """
-        # If code is None, authentication fails
-        if code is None:
-            return None
-
-        # Encode code and find it in database
-        try:
-            token = Token.objects.get(code=code)
-            # If token is valid, delete token and return user
-            if token.is_valid():
-                user = token.email_address.user
-                token.delete()
-                if user.is_active:
-                    return user
-        except Token.DoesNotExist:
-            pass
-
         return None
@@ -1,20 +1,39 @@
+import asyncio
 from functools import wraps
 
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.shortcuts import HttpResponseRedirect, redirect
 
 
+def is_authenticated(request):
+    """
+    Returns whether the user of a request is logged in. Loads
+    the user from the session if that has not happened yet.
+    """
+    return hasattr(request, 'user') and request.user.is_authenticated
+
+
 def anonymous_required(func):
     """
     Decorator for views that checks whether the user is already
     logged in. If so, the user is redirected to the restricted area.
+    Supports both sync and async views.
     """
+    if asyncio.iscoroutinefunction(func):
+        @wraps(func)
+        async def async_inner(request, *args, **kwargs):
+            # The session and the user are loaded synchronously
+            if await sync_to_async(is_authenticated, thread_sensitive=True)(request):
+                return redirect('home')
+            return await func(request, *args, **kwargs)
+        return async_inner
+
     @wraps(func)
     def inner(request, *args, **kwargs):
         # Redirect logged in users to login home
-        if hasattr(request, 'user'):
-            if request.user.is_authenticated:
-                return redirect('home')
+        if is_authenticated(request):
+            return redirect('home')
         # Return function if user is anonymous
         return func(request, *args, **kwargs)
     return inner
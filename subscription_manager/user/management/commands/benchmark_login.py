@@ -0,0 +1,119 @@
+import http.cookiejar
+import re
+import statistics
+import time
+import urllib.parse
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max
+from django.shortcuts import reverse
+
+from subscription_manager.mail.models import OutboundEmail
+from subscription_manager.user.managers import token_quota
+from subscription_manager.user.models import Token, User
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures the throughput of concurrent logins (loading the login form and requesting a token) on '
+        'running servers, e.g. gunicorn with sync workers (WSGI) and with uvicorn workers (ASGI). Every '
+        'login is made by a new user. The users, their tokens and the queued emails are deleted afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'urls',
+            nargs='+',
+            help='Base URLs of the running servers, e.g. http://localhost:8000 http://localhost:8001'
+        )
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=200,
+            help='Number of logins per server (default: 200)'
+        )
+        parser.add_argument(
+            '--threads',
+            type=int,
+            default=20,
+            help='Number of parallel logins (default: 20)'
+        )
+
+    def handle(self, *args, **options):
+        last_email_id = OutboundEmail.objects.aggregate(pk=Max('pk'))['pk'] or 0
+        prefix = 'benchmark-login-{}'.format(uuid.uuid4().hex)
+        users = [
+            User.objects.create_user('{}-{}@example.com'.format(prefix, i), first_name='Benchmark', last_name='Login')
+            for i in range(options['requests'] * len(options['urls']))
+        ]
+
+        try:
+            for number, base_url in enumerate(options['urls']):
+                url = base_url.rstrip('/') + reverse('login')
+                emails = [user.email for user in users[number * options['requests']:(number + 1) * options['requests']]]
+                self.benchmark(url, emails, options['threads'])
+        finally:
+            self.clean_up(users, prefix, last_email_id)
+
+    def benchmark(self, url, emails, threads):
+        # Warm up the server, e.g. the compressed assets
+        self.login(url, None)
+
+        started_at = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            results = list(executor.map(lambda email: self.login(url, email), emails))
+        duration = time.perf_counter() - started_at
+
+        durations = sorted(result for result in results if result is not None)
+        errors = len(results) - len(durations)
+        if not durations:
+            raise CommandError('{}: all logins failed.'.format(url))
+
+        self.stdout.write('{}\n  {} logins in {:.2f} s: {:.1f} logins/s, median {:.0f} ms, 95th percentile {:.0f} ms, {} errors'.format(
+            url,
+            len(results),
+            duration,
+            len(durations) / duration,
+            statistics.median(durations) * 1000,
+            durations[min(len(durations) - 1, int(len(durations) * 0.95))] * 1000,
+            errors
+        ))
+
+    @staticmethod
+    def login(url, email):
+        """
+        Loads the login form and, if an email address is given, submits
+        it. Returns the duration in seconds or None if a request failed.
+        """
+        opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        started_at = time.perf_counter()
+        try:
+            # Get a CSRF token
+            with opener.open(url) as response:
+                csrf_token = re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', response.read().decode()).group(1)
+
+            if email is not None:
+                data = urllib.parse.urlencode({'email': email, 'csrfmiddlewaretoken': csrf_token}).encode()
+                opener.open(urllib.request.Request(url, data=data, headers={'Referer': url})).close()
+        except (OSError, AttributeError):
+            # Connection and HTTP errors or a missing CSRF token
+            return None
+        return time.perf_counter() - started_at
+
+    @staticmethod
+    def clean_up(users, prefix, last_email_id):
+        OutboundEmail.objects.filter(
+            pk__in=[
+                outbound_email.pk
+                for outbound_email in OutboundEmail.objects.filter(pk__gt=last_email_id)
+                if any(address.startswith(prefix) for address in outbound_email.to)
+            ]
+        ).delete()
+        for user in users:
+            token_quota.cache.delete_many(
+                token_quota.window_keys(Token.objects.quota_keys(user)) + [token_quota.seeded_key(user.pk)]
+            )
+        User.objects.filter(pk__in=[user.pk for user in users]).delete()
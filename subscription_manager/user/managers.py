@@ -1,10 +1,20 @@
+import datetime
+import logging
 import uuid
 
 from django.conf import settings
 from django.contrib.auth.models import BaseUserManager
-from django.db import models, IntegrityError
+from django.db import models, IntegrityError, transaction
 from django.utils import timezone
 
+from subscription_manager.utils.cache import CONNECTION_ERRORS
+from subscription_manager.utils.ratelimit import SlidingWindowCounter
+
+logger = logging.getLogger(__name__)
+
+# Tokens created per user and purpose within the last hour
+token_quota = SlidingWindowCounter('tokens', window=timezone.timedelta(hours=1), cache_alias='shared')
+
 
 class UserManager(BaseUserManager):
     use_in_migrations = True
@@ -60,6 +70,27 @@ class UserManager(BaseUserManager):
         return self._create_user(email, password, **extra_fields)
 
 
+def get_email_domain(email):
+    """
+    Returns the lower-case domain of an email address.
+    """
+    return email.rsplit('@', 1)[-1].lower()
+
+
+class EmailAddressManager(models.Manager):
+
+    def filter_recently_verified(self, timedelta=timezone.timedelta(days=30)):
+        """
+        Returns the email addresses which have been verified within the
+        given timedelta (counted in days, like
+        EmailAddress.recently_verified).
+        """
+        first_day = timezone.now().date() - timedelta + timezone.timedelta(days=1)
+        return self.filter(
+            verified_at__gte=timezone.make_aware(datetime.datetime.combine(first_day, datetime.time()), timezone.utc)
+        )
+
+
 class TokenManager(models.Manager):
     """
     Custom manager for tokens.
@@ -75,16 +106,84 @@ class TokenManager(models.Manager):
 
         return token
 
+    def bulk_create_for(self, email_addresses, purpose):
+        """
+        Creates one token per email address with a single query and
+        returns the tokens in the same order. In contrast to create, the
+        token quota is not checked; use it only for tokens the system
+        sends on its own, e.g. in reminders. If TOKEN_MODE is 'signed',
+        signed tokens are returned and nothing is stored.
+        """
+        if settings.TOKEN_MODE == 'signed':
+            from .tokens import SignedToken
+            return [SignedToken.create(email_address, purpose, check_quota=False) for email_address in email_addresses]
+
+        now = timezone.now()
+        tokens = [
+            self.model(
+                email_address=email_address,
+                purpose=purpose,
+                code=uuid.uuid4(),
+                valid_until=now + settings.TOKEN_EXPIRATION,
+                sent_at=now
+            )
+            for email_address in email_addresses
+        ]
+        self.bulk_create(tokens)
+        return tokens
+
     def create_and_send(self, next_page=None, **obj_data):
         """
-        Creates and sends a token object.
+        Creates and sends a token object. If TOKEN_MODE is 'signed',
+        a signed token is sent instead, which is not stored in the
+        database.
         """
         # Create and send token
-        token = self.create(**obj_data)
+        if settings.TOKEN_MODE == 'signed':
+            token = self.create_signed(**obj_data)
+        else:
+            token = self.create(**obj_data)
         if token is not None:
             token.send(next_page)
         return token is not None
 
+    def create_signed(self, email_address, purpose):
+        """
+        Creates a signed token. Returns None if the quota
+        has been exceeded.
+        """
+        from .tokens import SignedToken
+        try:
+            return SignedToken.create(email_address, purpose)
+        except self.model.TokenQuotaExceededError:
+            return None
+
+    def redeem(self, code):
+        """
+        Redeems a token: fetches it together with its email address and
+        user, verifies the email address and deletes the token within one
+        transaction. The token's row is locked, so parallel requests with
+        the same code cannot both redeem it. Returns the token, which can
+        be used afterwards even though it has been deleted. Raises
+        Token.DoesNotExist if the code is unknown or has been redeemed
+        and Token.TokenExpiredError if the token has expired.
+        """
+        with transaction.atomic():
+            token = self.select_related('email_address__user').select_for_update(of=('self',)).get(code=code)
+            if not token.is_valid():
+                raise self.model.TokenExpiredError
+
+            # Verify email if it has not been verified already
+            if not token.email_address.recently_verified(timezone.timedelta(days=1)):
+                token.email_address.verify()
+
+            # Databases without row locks are covered by the number of deleted rows
+            deleted, _ = self.filter(pk=token.pk).delete()
+            if not deleted:
+                raise self.model.DoesNotExist
+
+        return token
+
     def filter_valid(self, user, purpose=None):
         """
         Returns all valid tokens for a given user. Furthermore,
@@ -107,8 +206,20 @@ class TokenManager(models.Manager):
     def count_created_in_last_hour(self, user, purpose=None):
         """
         Returns the count of tokens which were created in the
-        last hour. The amount of hours can be specified as a
-        parameter. The count can also be filtered by purpose.
+        last hour. The count can also be filtered by purpose.
+        It is read from the cache; the database is only queried
+        if the cache is empty or cannot be reached.
+        """
+        try:
+            self.seed_quota(user)
+            return token_quota.count(*self.quota_keys(user, purpose))
+        except CONNECTION_ERRORS:
+            logger.warning('Token quota cache unavailable, counting the tokens in the database.', exc_info=True)
+            return self.count_created_in_last_hour_in_database(user, purpose)
+
+    def count_created_in_last_hour_in_database(self, user, purpose=None):
+        """
+        Counts the tokens created in the last hour in the database.
         """
         email_addresses = user.emailaddress_set.all()
         if purpose is None:
@@ -124,6 +235,58 @@ class TokenManager(models.Manager):
             created_at__gte=timezone.now() - timezone.timedelta(hours=1)
         ).count()
 
+    def quota_keys(self, user, purpose=None):
+        """
+        Returns the keys of the token quota counter of a user
+        for the given purpose or for all purposes.
+        """
+        purposes = self.purposes() if purpose is None else [purpose]
+        return ['{}:{}'.format(user.pk, purpose) for purpose in purposes]
+
+    def purposes(self):
+        return [purpose for purpose, name in self.model._meta.get_field('purpose').choices]
+
+    def seed_quota(self, user):
+        """
+        Fills the token quota counter of a user with the tokens created
+        in the last hour, unless it has already been done since the
+        cache has been cleared.
+        """
+        if token_quota.is_seeded(user.pk):
+            return
+
+        # Get the creation times of the last hour's tokens per purpose
+        timestamps = {purpose: [] for purpose in self.purposes()}
+        for purpose, created_at in self.filter(
+            email_address__user=user,
+            created_at__gte=timezone.now() - timezone.timedelta(hours=1)
+        ).values_list('purpose', 'created_at'):
+            timestamps[purpose].append(created_at.timestamp())
+
+        for purpose, purpose_timestamps in timestamps.items():
+            token_quota.seed(self.quota_keys(user, purpose)[0], purpose_timestamps)
+        token_quota.mark_seeded(user.pk)
+
+    def use_quota(self, user, purpose):
+        """
+        Counts a new token of a user and returns true, if the user has
+        not exceeded TOKENS_PER_USER_PER_HOUR yet. Otherwise, the token
+        is not counted and false is returned. The quota holds across
+        processes sharing the cache. If the cache cannot be reached,
+        the tokens are counted in the database, which is not exact for
+        concurrent requests.
+        """
+        try:
+            self.seed_quota(user)
+            return token_quota.increment(
+                self.quota_keys(user, purpose)[0],
+                settings.TOKENS_PER_USER_PER_HOUR,
+                counted_keys=self.quota_keys(user)
+            )
+        except CONNECTION_ERRORS:
+            logger.warning('Token quota cache unavailable, counting the tokens in the database.', exc_info=True)
+            return self.count_created_in_last_hour_in_database(user) < settings.TOKENS_PER_USER_PER_HOUR
+
     def all_expired(self):
         """
         Selects all expired tokens.
@@ -0,0 +1,30 @@
+# Generated by Django 3.1.1 on 2026-10-18 15:23
+
+from django.db import migrations, models
+
+
+def fill_domains(apps, schema_editor):
+    """
+    Fills the domain of existing email addresses.
+    """
+    EmailAddress = apps.get_model('user', 'EmailAddress')
+    email_addresses = list(EmailAddress.objects.only('email'))
+    for email_address in email_addresses:
+        email_address.domain = email_address.email.rsplit('@', 1)[-1].lower()
+    EmailAddress.objects.bulk_update(email_addresses, ['domain'], batch_size=1000)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailaddress',
+            name='domain',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=100, verbose_name='Domain'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_domains, migrations.RunPython.noop),
+    ]
@@ -8,7 +8,9 @@ from django.shortcuts import reverse
 from django.template.loader import render_to_string
 from django.utils import timezone
 
-from .managers import UserManager, TokenManager
+from subscription_manager.mail.models import OutboundEmail
+
+from .managers import EmailAddressManager, TokenManager, UserManager, get_email_domain
 
 
 class User(AbstractUser):
@@ -51,19 +53,12 @@ class User(AbstractUser):
 
     def verified_email_domains(self):
         """
-        Returns a list of all verified email domain.
+        Returns a list of the domains of all email addresses
+        which have been verified in the last 30 days.
         """
-        email_addresses = self.emailaddress_set.filter(verified_at__isnull=False)
-
-        # Exclude email addresses which have not been verified in the last 30 days.
-        exclude_pks = []
-        for email_address in email_addresses:
-            if not email_address.recently_verified(timezone.timedelta(days=30)):
-                exclude_pks.append(email_address.pk)
-        email_addresses = email_addresses.exclude(pk__in=exclude_pks)
-
-        email_addresses = map(lambda email: email['email'].split('@')[-1], email_addresses.values('email'))
-        return list(email_addresses)
+        return list(
+            EmailAddress.objects.filter_recently_verified().filter(user=self).values_list('domain', flat=True).distinct()
+        )
 
     def full_name(self):
         """
@@ -111,6 +106,14 @@ class EmailAddress(models.Model):
             'unique': 'Diese E-Mail-Adresse existiert bereits.'
         }
     )
+    # Lower-case domain of the email address, which is
+    # matched against the eligible domains of plans
+    domain = models.CharField(
+        max_length=100,
+        editable=False,
+        db_index=True,
+        verbose_name='Domain'
+    )
     is_primary = models.BooleanField(
         default=False,
         verbose_name='ist primär'
@@ -126,6 +129,8 @@ class EmailAddress(models.Model):
         verbose_name='erstellt am'
     )
 
+    objects = EmailAddressManager()
+
     class Meta:
         verbose_name = 'E-Mail-Adresse'
         verbose_name_plural = 'E-Mail-Adressen'
@@ -133,6 +138,11 @@ class EmailAddress(models.Model):
     def __str__(self):
         return self.email
 
+    def save(self, *args, **kwargs):
+        # Keep the domain in sync with the email address
+        self.domain = get_email_domain(self.email)
+        super().save(*args, **kwargs)
+
     def is_verified(self):
         """
         Returns true if a verified at attribute is set.
@@ -191,7 +201,54 @@ class EmailAddress(models.Model):
         pass
 
 
-class Token(models.Model):
+class TokenMessageMixin:
+    """
+    Builds the link and the email of a token. Used by database
+    and signed tokens.
+    """
+    url_name = 'token_verification'
+
+    def url(self):
+        """
+        Returns the url for a given code.
+        Example: https://www.hostname.tld/token/1836af19-67df-4090-8229-16ed13036480/
+        """
+        return '{}{}'.format(
+            settings.BASE_URL,
+            reverse(
+                self.url_name,
+                kwargs={
+                    'code': self.code
+                }
+            )
+        )
+
+    def message(self, next_page=None):
+        """
+        Returns the email with the token's link.
+        """
+        # Select template
+        template = 'emails/token_' + self.purpose + '.txt'
+        subject = self.get_purpose_display()
+
+        # Generate url
+        url = self.url()
+        if next_page is not None:
+            url += '?next=' + next_page
+
+        return EmailMessage(
+            subject=settings.EMAIL_SUBJECT_PREFIX + subject,
+            body=render_to_string(template, {
+                'to_name': self.email_address.user.first_name,
+                'token': self
+            }),
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            reply_to=[settings.DEFAULT_REPLY_TO_EMAIL],
+            to=[self.email_address.email]
+        )
+
+
+class Token(TokenMessageMixin, models.Model):
     """
     Tokens are used for login or email verification. It is
     associated with an email address and can be sent to it.
@@ -254,7 +311,7 @@ class Token(models.Model):
             user = self.email_address.user
             if user is None:
                 raise ValueError
-            if Token.objects.count_created_in_last_hour(user) >= settings.TOKENS_PER_USER_PER_HOUR:
+            if not Token.objects.use_quota(user, self.purpose):
                 raise self.TokenQuotaExceededError
 
             # Set valid until
@@ -276,47 +333,12 @@ class Token(models.Model):
         else:
             super().save(force_insert, force_update, using, update_fields)
 
-    def url(self):
-        """
-        Returns the url for a given code.
-        Example: https://www.hostname.tld/token/1836af19-67df-4090-8229-16ed13036480/
-        """
-        return '{}{}'.format(
-            settings.BASE_URL,
-            reverse(
-                'token_verification',
-                kwargs={
-                    'code': self.code
-                }
-            )
-        )
-
     def send(self, next_page=None):
         """
-        Sends an email with the token code and updates the
+        Queues an email with the token code and updates the
         sent_at field.
         """
-        # Select template
-        template = 'emails/token_' + self.purpose + '.txt'
-        subject = self.get_purpose_display()
-
-        # Generate url
-        url = self.url()
-        if next_page is not None:
-            url += '?next=' + next_page
-
-        # Send email
-        email = EmailMessage(
-            subject=settings.EMAIL_SUBJECT_PREFIX + subject,
-            body=render_to_string(template, {
-                'to_name': self.email_address.user.first_name,
-                'token': self
-            }),
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            reply_to=[settings.DEFAULT_REPLY_TO_EMAIL],
-            to=[self.email_address.email]
-        )
-        email.send(fail_silently=False)
+        OutboundEmail.objects.queue(self.message(next_page))
 
         # Update sent_at field
         self.sent_at = timezone.now()
@@ -328,3 +350,9 @@ class Token(models.Model):
         """
         pass
 
+    class TokenExpiredError(Exception):
+        """
+        Raised when an expired token is redeemed.
+        """
+        pass
+
@@ -0,0 +1,16 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from subscription_manager.subscription.models import Plan
+
+from .models import EmailAddress
+
+
+@receiver(post_save, sender=EmailAddress)
+@receiver(post_delete, sender=EmailAddress)
+def email_address_changed(sender, instance, **kwargs):
+    """
+    Invalidates the cached eligibility of the user whose email
+    address has been added, verified or removed.
+    """
+    Plan.objects.invalidate_eligibility([instance.user_id])
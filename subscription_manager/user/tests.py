@@ -0,0 +1,261 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.contrib.messages import get_messages
+from django.core import signing
+from django.core.cache import caches
+from django.db import close_old_connections, connection
+from django.db.backends.signals import connection_created
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from .managers import token_quota
+from .models import Token, User
+from .tokens import SignedToken
+
+
+class TokenQuotaConcurrencyTests(TransactionTestCase):
+    """
+    Tests that the token quota is enforced exactly for parallel requests
+    of the same user, which share the cache.
+    """
+
+    def setUp(self):
+        caches['shared'].clear()
+        self.user = User.objects.create_user('token-quota@example.com', first_name='Token', last_name='Quota')
+
+    def run_in_threads(self, func, count):
+        def run(number):
+            try:
+                return func(number)
+            finally:
+                close_old_connections()
+
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            return list(executor.map(run, range(count)))
+
+    def test_parallel_use_quota(self):
+        results = self.run_in_threads(lambda number: Token.objects.use_quota(self.user, 'login'), 50)
+        self.assertEqual(results.count(True), settings.TOKENS_PER_USER_PER_HOUR)
+        self.assertEqual(token_quota.count(*Token.objects.quota_keys(self.user)), settings.TOKENS_PER_USER_PER_HOUR)
+
+    def test_parallel_logins(self):
+        # Render the page once, so that the assets are not compressed concurrently
+        Client().get(reverse('login'))
+
+        self.run_in_threads(lambda number: Client().post(reverse('login'), {'email': self.user.email}), 40)
+        self.assertEqual(Token.objects.filter(email_address__user=self.user).count(), settings.TOKENS_PER_USER_PER_HOUR)
+        self.assertEqual(Token.objects.count_created_in_last_hour(self.user), settings.TOKENS_PER_USER_PER_HOUR)
+
+
+class TokenQuotaTests(TestCase):
+    """
+    Tests the token quota counter with an empty or unavailable cache.
+    """
+
+    def setUp(self):
+        caches['shared'].clear()
+        self.user = User.objects.create_user('token-quota@example.com', first_name='Token', last_name='Quota')
+        self.email_address = self.user.primary_email()
+
+    def test_seed_quota_after_cache_clear(self):
+        for purpose in ('login', 'login', 'login', 'signup'):
+            Token.objects.create(email_address=self.email_address, purpose=purpose)
+        caches['shared'].clear()
+
+        self.assertEqual(Token.objects.count_created_in_last_hour(self.user), 4)
+        self.assertEqual(Token.objects.count_created_in_last_hour(self.user, 'login'), 3)
+
+        caches['shared'].clear()
+        results = [Token.objects.use_quota(self.user, 'login') for i in range(settings.TOKENS_PER_USER_PER_HOUR)]
+        self.assertEqual(results.count(True), settings.TOKENS_PER_USER_PER_HOUR - 4)
+
+    def test_fallback_if_cache_unavailable(self):
+        Token.objects.create(email_address=self.email_address, purpose='login')
+
+        with mock.patch('subscription_manager.user.managers.CONNECTION_ERRORS', (ConnectionError,)), \
+                mock.patch.object(token_quota, 'increment', side_effect=ConnectionError), \
+                self.assertLogs('subscription_manager.user.managers', 'WARNING'):
+            self.assertTrue(Token.objects.use_quota(self.user, 'login'))
+
+        with mock.patch.object(token_quota, 'increment', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                Token.objects.use_quota(self.user, 'login')
+
+
+class TokenRedemptionConcurrencyTests(TransactionTestCase):
+    """
+    Tests that a token link which is clicked several times in parallel
+    logs in only once.
+    """
+
+    def setUp(self):
+        caches['shared'].clear()
+        self.state = threading.local()
+
+    def test_parallel_clicks_log_in_once(self):
+        user = User.objects.create_user('token@example.com', first_name='Token', last_name='Einlösung')
+        token = Token.objects.create(email_address=user.primary_email(), purpose='login')
+        url = reverse('token_verification', args=[token.code])
+        clients = [Client(), Client()]
+
+        if connection.vendor == 'sqlite':
+            # SQLite locks tables instead of rows, and parallel transactions
+            # fail instead of waiting. Both clicks fetch the token before
+            # either of them deletes it, and then take turns.
+            self.take_turns_after_fetching(len(clients))
+
+        def click(client):
+            try:
+                return client.get(url)
+            finally:
+                if getattr(self.state, 'has_turn', False):
+                    self.turn.release()
+                close_old_connections()
+
+        with ThreadPoolExecutor(max_workers=len(clients)) as executor:
+            responses = list(executor.map(click, clients))
+
+        logged_in = [client for client in clients if client.session.get(SESSION_KEY) == str(user.pk)]
+        self.assertEqual(len(logged_in), 1)
+        self.assertEqual(sorted(response.url for response in responses), [reverse('home'), reverse('login')])
+        self.assertFalse(Token.objects.filter(pk=token.pk).exists())
+
+    def take_turns_after_fetching(self, count):
+        self.turn = threading.Lock()
+        fetched = threading.Barrier(count, timeout=10)
+        is_valid = Token.is_valid
+
+        def is_valid_after_all_fetched(token):
+            # Checked after fetching the token, before deleting it
+            fetched.wait()
+            self.turn.acquire()
+            self.state.has_turn = True
+            return is_valid(token)
+
+        def read_uncommitted(sender, connection, **kwargs):
+            # Reading the token does not lock the table for the other click
+            connection.cursor().execute('PRAGMA read_uncommitted = 1')
+
+        patcher = mock.patch.object(Token, 'is_valid', is_valid_after_all_fetched)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        connection_created.connect(read_uncommitted)
+        self.addCleanup(connection_created.disconnect, read_uncommitted)
+
+class TokenRedemptionTests(TestCase):
+    """
+    Tests redeeming database tokens.
+    """
+
+    def setUp(self):
+        caches['shared'].clear()
+        self.user = User.objects.create_user('token@example.com', first_name='Token', last_name='Einlösung')
+        self.token = Token.objects.create(email_address=self.user.primary_email(), purpose='login')
+
+    def test_redeem_queries(self):
+        # Savepoint, fetching the token with its email address and user,
+        # verifying the email address, deleting the token and releasing
+        # the savepoint. Before, the token alone took seven queries: two
+        # token fetches, two email address loads, a user load, the
+        # verification and the deletion.
+        with self.assertNumQueries(5):
+            token = Token.objects.redeem(self.token.code)
+        with self.assertNumQueries(0):
+            self.assertEqual(token.email_address.user, self.user)
+
+    def test_login_click_queries(self):
+        # 5 queries to redeem the token (see test_redeem_queries) and 8 to
+        # store the session and log in
+        with self.assertNumQueries(13):
+            response = self.client.get(reverse('token_verification', args=[self.token.code]))
+        self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+        self.assertEqual(self.client.session[SESSION_KEY], str(self.user.pk))
+
+    def test_link_cannot_be_used_twice(self):
+        url = reverse('token_verification', args=[self.token.code])
+        self.client.get(url)
+        self.client.logout()
+
+        response = self.client.get(url)
+        self.assertRedirects(response, reverse('login'), fetch_redirect_response=False)
+        self.assertNotIn(SESSION_KEY, self.client.session)
+
+
+@override_settings(TOKEN_MODE='signed')
+class SignedTokenTests(TestCase):
+    """
+    Tests signed tokens, which are not stored in the database.
+    """
+
+    def setUp(self):
+        caches['default'].clear()
+        caches['shared'].clear()
+        self.user = User.objects.create_user('signed@example.com', first_name='Signiertes', last_name='Token')
+        self.email_address = self.user.primary_email()
+
+    def click(self, code):
+        """
+        Returns the response and its latest message.
+        """
+        response = self.client.get(reverse('signed_token_verification', args=[code]))
+        return response, [str(message) for message in get_messages(response.wsgi_request)][-1]
+
+    def test_login(self):
+        token = SignedToken.create(self.email_address, 'login')
+        response, message = self.click(token.code)
+        self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+        self.assertEqual(self.client.session[SESSION_KEY], str(self.user.pk))
+        self.assertFalse(Token.objects.exists())
+
+    def test_tampered_code(self):
+        code = SignedToken.create(self.email_address, 'login').code
+        payload, signature = code.rsplit(':', 1)
+        tampered = signing.dumps({'e': self.email_address.pk, 'p': 'signup', 'n': 'nonce'}, salt='other').rsplit(':', 1)[0]
+
+        for code in (payload + ':' + signature[::-1], tampered + ':' + signature):
+            with self.assertRaises(signing.BadSignature):
+                SignedToken.load(code)
+            response, message = self.click(code)
+            self.assertRedirects(response, reverse('login'), fetch_redirect_response=False)
+            self.assertEqual(message, 'Der Link ist ungültig.')
+            self.assertNotIn(SESSION_KEY, self.client.session)
+
+    def test_expired_code(self):
+        code = SignedToken.create(self.email_address, 'login').code
+        later = signing.time.time() + settings.TOKEN_EXPIRATION.total_seconds() + 1
+        with mock.patch('django.core.signing.time.time', return_value=later):
+            with self.assertRaises(signing.SignatureExpired):
+                SignedToken.load(code)
+            response, message = self.click(code)
+        self.assertEqual(message, 'Der Link ist abgelaufen.')
+        self.assertNotIn(SESSION_KEY, self.client.session)
+
+    def test_replayed_link(self):
+        code = SignedToken.create(self.email_address, 'login').code
+        self.click(code)
+        self.client.logout()
+
+        response, message = self.click(code)
+        self.assertRedirects(response, reverse('login'), fetch_redirect_response=False)
+        self.assertEqual(message, 'Der Link wurde bereits verwendet.')
+        self.assertNotIn(SESSION_KEY, self.client.session)
+        self.assertFalse(SignedToken.load(code).redeem())
+
+    def test_bulk_create_for(self):
+        other = User.objects.create_user('other@example.com', first_name='Anderes', last_name='Token')
+        email_addresses = [self.email_address, other.primary_email()]
+
+        tokens = Token.objects.bulk_create_for(email_addresses, 'login')
+        self.assertFalse(Token.objects.exists())
+        self.assertEqual([type(token) for token in tokens], [SignedToken, SignedToken])
+        self.assertEqual(len({token.code for token in tokens}), 2)
+        for token, email_address in zip(tokens, email_addresses):
+            loaded = SignedToken.load(token.code)
+            self.assertEqual((loaded.email_address, loaded.purpose), (email_address, 'login'))
+
+        # Tokens sent by the system do not count towards the quota
+        self.assertEqual(Token.objects.count_created_in_last_hour(self.user), 0)
@@ -0,0 +1,107 @@
+import secrets
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.utils import timezone
+
+from subscription_manager.mail.models import OutboundEmail
+
+from .models import EmailAddress, Token, TokenMessageMixin
+
+
+class SignedToken(TokenMessageMixin):
+    """
+    Token which is not stored in the database. The code is a signed,
+    time-limited payload with the email address id, the purpose and a
+    random nonce. A token can only be used once: its nonce is stored in
+    the cache when it is used and expires together with the token.
+    """
+    url_name = 'signed_token_verification'
+    salt = 'subscription_manager.user.tokens.SignedToken'
+
+    def __init__(self, email_address_id, purpose, nonce, code=None, valid_until=None):
+        self.email_address_id = email_address_id
+        self.purpose = purpose
+        self.nonce = nonce
+        self.code = code
+        self.valid_until = valid_until
+        self.redeemed = False
+        self._email_address = None
+
+    def __str__(self):
+        return self.code
+
+    @classmethod
+    def create(cls, email_address, purpose, check_quota=True):
+        """
+        Creates a signed token for the given email address. Like
+        database tokens, the token counts towards the user's quota.
+        """
+        if email_address.user_id is None:
+            raise ValueError
+        if check_quota and not Token.objects.use_quota(email_address.user, purpose):
+            raise Token.TokenQuotaExceededError
+
+        token = cls(email_address.pk, purpose, secrets.token_urlsafe(9))
+        token.code = signing.dumps({'e': token.email_address_id, 'p': purpose, 'n': token.nonce}, salt=cls.salt)
+        token.valid_until = timezone.now() + settings.TOKEN_EXPIRATION
+        token._email_address = email_address
+        return token
+
+    @classmethod
+    def load(cls, code):
+        """
+        Returns the token of a code. Raises signing.SignatureExpired if
+        the token has expired and signing.BadSignature if the code is
+        invalid.
+        """
+        payload = signing.loads(code, salt=cls.salt, max_age=settings.TOKEN_EXPIRATION)
+        return cls(payload['e'], payload['p'], payload['n'], code=code)
+
+    @property
+    def email_address(self):
+        """
+        The email address together with its user. Raises
+        EmailAddress.DoesNotExist if it has been deleted.
+        """
+        if self._email_address is None:
+            self._email_address = EmailAddress.objects.select_related('user').get(pk=self.email_address_id)
+        return self._email_address
+
+    def get_purpose_display(self):
+        return dict(Token._meta.get_field('purpose').choices)[self.purpose]
+
+    def is_valid(self):
+        """
+        True if the token has not expired. Expired codes cannot be loaded.
+        """
+        return self.valid_until is None or timezone.now() <= self.valid_until
+
+    def redeem(self):
+        """
+        Marks the token as used and verifies the email address, like
+        Token.objects.redeem. Returns false if it has been used before,
+        also by another process sharing the cache. Redeeming the same
+        instance again returns true.
+        """
+        if not self.redeemed:
+            timeout = settings.TOKEN_EXPIRATION.total_seconds() + 60
+            self.redeemed = cache.add('signed-token:{}'.format(self.nonce), True, timeout)
+
+            # Verify email if it has not been verified already
+            if self.redeemed and not self.email_address.recently_verified(timezone.timedelta(days=1)):
+                self.email_address.verify()
+        return self.redeemed
+
+    def delete(self):
+        """
+        Counterpart of Token.delete: the token cannot be used anymore.
+        """
+        self.redeem()
+
+    def send(self, next_page=None):
+        """
+        Queues an email with the token code.
+        """
+        OutboundEmail.objects.queue(self.message(next_page))
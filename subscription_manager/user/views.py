@@ -1,8 +1,10 @@
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect, reverse, HttpResponse, HttpResponseRedirect, get_object_or_404
 from django.conf import settings
-from django.contrib.auth import authenticate, login, logout
+from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from django.core import signing
 from django.views.generic import detail, edit, list
 from django.urls import reverse_lazy
 from django.utils.decorators import method_decorator
@@ -12,15 +14,18 @@ from django.utils import timezone
 from subscription_manager.subscription.models import Plan
 
 from .models import EmailAddress, Token, User
+from .tokens import SignedToken
 from .forms import SignUpForm, LoginForm
 from .decorators import anonymous_required
 
 
 @anonymous_required
-def signup_view(request):
+async def signup_view(request):
     """
     Renders or processes the signup form through which
-    a user can register himself.
+    a user can register himself. The database is accessed
+    synchronously in a thread, and the verification email
+    is only queued.
     """
     # Read next parameter
     next_page = request.GET.get('next')
@@ -30,18 +35,22 @@ def signup_view(request):
 
         form = SignUpForm(request.POST)
 
-        if form.is_valid():
+        # Validation checks whether the email address exists
+        if await sync_to_async(form.is_valid, thread_sensitive=True)():
 
             # Save user
-            user = form.save()
+            user = await sync_to_async(form.save, thread_sensitive=True)()
 
             # If successful
             if user is not None:
+                email_address = await sync_to_async(user.primary_email, thread_sensitive=True)()
                 # Create and send verification token
                 # Token quota can not be reached as the email address cannot already exist
-                success = Token.objects.create_and_send(email_address=user.primary_email(), purpose='signup', next_page=next_page)
+                success = await sync_to_async(Token.objects.create_and_send, thread_sensitive=True)(
+                    email_address=email_address, purpose='signup', next_page=next_page
+                )
                 # Create success message
-                messages.success(request, 'Wir haben dir eine E-Mail an {} geschickt, um deine E-Mail-Adresse zu verfizieren.'.format(user.primary_email()))
+                messages.success(request, 'Wir haben dir eine E-Mail an {} geschickt, um deine E-Mail-Adresse zu verfizieren.'.format(email_address))
                 # Redirect to this page
                 return redirect('login')
 
@@ -52,17 +61,21 @@ def signup_view(request):
     else:
         form = SignUpForm()
 
-    plans = Plan.objects.all()
+    catalog = await sync_to_async(Plan.objects.get_catalog, thread_sensitive=True)()
 
-    return render(request, 'user/signup.html', {'form': form, 'next': next_page, 'plans': plans})
+    # The context processors use the session
+    return await sync_to_async(render, thread_sensitive=True)(
+        request, 'user/signup.html', {'form': form, 'next': next_page, 'plans': catalog.plans}
+    )
 
 
 @anonymous_required
-def login_view(request):
+async def login_view(request):
     """
     Renders or processes the login form. If the data is valid,
     a token is sent and the user redirected to the token verification
-    page. Otherwise, the login form is rendered.
+    page. Otherwise, the login form is rendered. The database is
+    accessed synchronously in a thread, and the email is only queued.
     """
     # Read next parameter
     next_page = request.GET.get('next', None)
@@ -72,18 +85,22 @@ def login_view(request):
 
         form = LoginForm(request.POST)
 
-        if form.is_valid():
+        # Validation checks the user and the token quota
+        if await sync_to_async(form.is_valid, thread_sensitive=True)():
 
             # Get user
             try:
-                user = User.objects.get(email=form.cleaned_data['email'])
+                user = await sync_to_async(User.objects.get, thread_sensitive=True)(email=form.cleaned_data['email'])
             except User.DoesNotExist:
                 user = None
 
             # If user exists
             if user is not None:
+                email_address = await sync_to_async(user.primary_email, thread_sensitive=True)()
                 # Create and send token
-                success = Token.objects.create_and_send(email_address=user.primary_email(), purpose='login', next_page=next_page)
+                success = await sync_to_async(Token.objects.create_and_send, thread_sensitive=True)(
+                    email_address=email_address, purpose='login', next_page=next_page
+                )
                 if success:
                     # Create success message
                     messages.success(request, 'Wir haben dir einen Anmeldelink per E-Mail an {} geschickt.'.format(user.email))
@@ -95,66 +112,81 @@ def login_view(request):
     else:
         form = LoginForm()
 
-    return render(request, 'user/login.html', {'form': form, 'next': next_page})
+    # The context processors use the session
+    return await sync_to_async(render, thread_sensitive=True)(request, 'user/login.html', {'form': form, 'next': next_page})
 
 
-def token_verification_view(request, code):
+async def token_verification_view(request, code):
     """
-    Checks tokens and performs corresponding action.
+    Checks tokens and performs corresponding action. The token,
+    its email address and user are fetched with one query, and
+    the token is used up in the same transaction. The database
+    is accessed synchronously in a thread.
     """
-    # Get token
+    # Get and redeem token
     try:
-        token = Token.objects.get(code=code)
+        token = await sync_to_async(Token.objects.redeem, thread_sensitive=True)(code)
     except Token.DoesNotExist:
         messages.error(request, 'Der Link ist ungültig.')
         return redirect('login')
+    except Token.TokenExpiredError:
+        messages.error(request, 'Der Link ist abgelaufen.')
+        return redirect('login')
+
+    # Logging in changes the session
+    return await sync_to_async(perform_token_action, thread_sensitive=True)(request, token)
+
 
-    # Check if token is valid
-    if not token.is_valid():
+def signed_token_verification_view(request, code):
+    """
+    Checks signed tokens and performs corresponding action.
+    Only the email address and its user are read from the
+    database.
+    """
+    # Get token
+    try:
+        token = SignedToken.load(code)
+        # Load the email address and its user at once
+        token.email_address
+    except signing.SignatureExpired:
         messages.error(request, 'Der Link ist abgelaufen.')
         return redirect('login')
+    except (signing.BadSignature, EmailAddress.DoesNotExist):
+        messages.error(request, 'Der Link ist ungültig.')
+        return redirect('login')
+
+    # Every link can only be used once
+    if not token.redeem():
+        messages.error(request, 'Der Link wurde bereits verwendet.')
+        return redirect('login')
+
+    return perform_token_action(request, token)
+
+
+def perform_token_action(request, token):
+    """
+    Performs the action of a redeemed token. Its email
+    address has already been verified.
+    """
+    user = token.email_address.user
 
     # Do login
-    if token.purpose == 'login':
-        # Verify email if it has not been verified already
-        if not token.email_address.recently_verified(timezone.timedelta(days=1)):
-            token.email_address.verify()
-        # Get user
-        user = authenticate(request, code=code)
-        # If authentication is successful, log user in
-        if user is not None:
-            login(request, user)
+    if token.purpose in ['login', 'signup'] and user.is_active:
+        login(request, user, backend='subscription_manager.user.backends.TokenBackend')
+        if token.purpose == 'login':
             messages.success(request, 'Du bist angemeldet.')
-            # Handle next parameter
-            next_page = request.GET.get('next', None)
-            if next_page is not None:
-                return redirect(next_page)
-            # Redirect user to login home otherwise
-            return redirect('home')
-
-    # Do login but add different success message
-    elif token.purpose == 'signup':
-        # Verify email if it has not been verified already
-        if not token.email_address.recently_verified(timezone.timedelta(days=1)):
-            token.email_address.verify()
-        # Get user
-        user = authenticate(request, code=code)
-        # If authentication is successful, log user in
-        if user is not None:
-            login(request, user)
+        else:
+            # Add different success message after signup
             messages.success(request, 'Du bist angemeldet und deine E-Mail-Adresse {} wurde verifiziert. Bestelle jetzt ein Abo.'.format(user.email))
-            # Handle next parameter
-            next_page = request.GET.get('next', None)
-            if next_page is not None:
-                return redirect(next_page)
-            # Redirect user to login home otherwise
-            return redirect('home')
+        # Handle next parameter
+        next_page = request.GET.get('next', None)
+        if next_page is not None:
+            return redirect(next_page)
+        # Redirect user to login home otherwise
+        return redirect('home')
 
     # Do email verification
     elif token.purpose == 'verification':
-        if not token.email_address.recently_verified(timezone.timedelta(days=1)):
-            token.email_address.verify()
-        token.delete()
         messages.success(request, 'Die E-Mail-Adresse {} wurde verifiziert.'.format(token.email_address.email))
         # Redirect to email address list
         return redirect('email_address_list')
@@ -0,0 +1,178 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+try:
+    from django_redis.exceptions import ConnectionInterrupted
+    from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
+except ImportError:
+    # Redis is only used in production
+    CONNECTION_ERRORS = ()
+else:
+    # Raised by the shared cache if Redis cannot be reached
+    CONNECTION_ERRORS = (ConnectionInterrupted, RedisConnectionError, RedisTimeoutError)
+
+
+# Sentinel for cache misses, as None can be cached
+MISSING = object()
+
+
+def get_shared_cache():
+    """
+    Returns the cache which is shared by all processes, or the default
+    cache if there is no cache with the alias 'shared'.
+    """
+    return caches['shared' if 'shared' in settings.CACHES else 'default']
+
+
+def get_versions(*names):
+    """
+    Returns the current versions of the given names. Versions are part of
+    cache keys: entries depending on a name are invalidated by bumping its
+    version instead of deleting them. A missing version is initialized
+    with the current time, so that it does not repeat an earlier version
+    after it has been evicted. Versions are stored in the shared cache,
+    so that all processes see a bump at once.
+    """
+    cache = get_shared_cache()
+    keys = ['version:{}'.format(name) for name in names]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, int(time.time() * 1000000), None)
+            versions[key] = cache.get(key, 0)
+    return [versions[key] for key in keys]
+
+
+def bump_versions(*names):
+    """
+    Increments the versions of the given names, which invalidates all
+    cache entries depending on them.
+    """
+    cache = get_shared_cache()
+    for name in names:
+        key = 'version:{}'.format(name)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, int(time.time() * 1000000), None)
+
+
+def bump_versions_on_commit(*names):
+    """
+    Increments the versions of the given names once the current
+    transaction has been committed, or at once outside of transactions.
+    Otherwise, other processes could cache data of the old rows under
+    the new versions until the next bump.
+    """
+    transaction.on_commit(lambda: bump_versions(*names))
+
+
+class TieredCache(BaseCache):
+    """
+    Cache backend with two tiers: a small per-process memory cache (least
+    recently used entries are evicted first) in front of a shared cache,
+    which is configured as another alias (OPTIONS['SHARED_ALIAS'], e.g. a
+    Redis cache). Entries are read from the memory cache if possible and
+    written to both tiers.
+
+    Other processes keep their copy of a changed or deleted entry for up
+    to OPTIONS['LOCAL_TIMEOUT'] seconds. Entries which have to be current
+    in all processes therefore either have versioned keys (see
+    get_versions) or are stored in the shared cache directly, like the
+    versions themselves, sessions and rate limits. add, incr and decr
+    are atomic operations of the shared cache.
+    """
+
+    def __init__(self, location, params):
+        params = dict(params)
+        options = dict(params.pop('OPTIONS', {}))
+        self.shared_alias = options.pop('SHARED_ALIAS', 'shared')
+        self.local_timeout = options.pop('LOCAL_TIMEOUT', 5)
+        super().__init__(params)
+        self.local = LocMemCache(location or 'tiered', {
+            'TIMEOUT': self.local_timeout,
+            'OPTIONS': {'MAX_ENTRIES': options.pop('MAX_ENTRIES', 1000)}
+        })
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias]
+
+    def get_local_timeout(self, timeout=DEFAULT_TIMEOUT):
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        if timeout is None:
+            return self.local_timeout
+        return min(timeout, self.local_timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.shared.add(key, value, self.get_timeout_value(timeout), version=version)
+        if added:
+            self.local.set(key, value, self.get_local_timeout(timeout), version=version)
+        return added
+
+    def get(self, key, default=None, version=None):
+        value = self.local.get(key, MISSING, version=version)
+        if value is MISSING:
+            value = self.shared.get(key, MISSING, version=version)
+            if value is MISSING:
+                return default
+            self.local.set(key, value, version=version)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, self.get_timeout_value(timeout), version=version)
+        self.local.set(key, value, self.get_local_timeout(timeout), version=version)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        self.local.touch(key, self.get_local_timeout(timeout), version=version)
+        return self.shared.touch(key, self.get_timeout_value(timeout), version=version)
+
+    def delete(self, key, version=None):
+        self.local.delete(key, version=version)
+        return self.shared.delete(key, version=version)
+
+    def get_many(self, keys, version=None):
+        values = self.local.get_many(keys, version=version)
+        missing = [key for key in keys if key not in values]
+        if missing:
+            shared_values = self.shared.get_many(missing, version=version)
+            self.local.set_many(shared_values, version=version)
+            values.update(shared_values)
+        return values
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed_keys = self.shared.set_many(data, self.get_timeout_value(timeout), version=version)
+        self.local.set_many(data, self.get_local_timeout(timeout), version=version)
+        return failed_keys
+
+    def delete_many(self, keys, version=None):
+        self.local.delete_many(keys, version=version)
+        self.shared.delete_many(keys, version=version)
+
+    def has_key(self, key, version=None):
+        return self.local.has_key(key, version=version) or self.shared.has_key(key, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        self.local.delete(key, version=version)
+        return self.shared.incr(key, delta, version=version)
+
+    def decr(self, key, delta=1, version=None):
+        self.local.delete(key, version=version)
+        return self.shared.decr(key, delta, version=version)
+
+    def get_timeout_value(self, timeout):
+        # The default timeout of this cache applies to both tiers
+        return self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+
+    def clear(self):
+        self.local.clear()
+        self.shared.clear()
+
+    def close(self, **kwargs):
+        self.shared.close(**kwargs)
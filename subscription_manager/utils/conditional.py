@@ -0,0 +1,49 @@
+import hashlib
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib import messages
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+
+
+def versioned_etag(get_values):
+    """
+    Returns an ETag function for django.views.decorators.http.condition.
+    The ETag is a hash of the values returned by
+    get_values(request, *args, **kwargs), e.g. cache versions (see
+    get_versions), so that it is computed without building the response
+    and usually without queries. Requests with pending messages get no
+    ETag, as the messages are rendered into the page and would otherwise
+    be hidden behind a 304 response.
+    """
+    def etag_func(request, *args, **kwargs):
+        if len(messages.get_messages(request)):
+            return None
+        values = get_values(request, *args, **kwargs)
+        return hashlib.md5(':'.join(str(value) for value in values).encode()).hexdigest()
+    return etag_func
+
+
+def async_etag(etag_func):
+    """
+    Decorator for async views which answers requests with a matching
+    ETag with 304 Not Modified, like django.views.decorators.http.etag,
+    which only supports sync views. The ETag function is synchronous,
+    as it may use the session or the database, and runs in a thread.
+    """
+    def decorator(func):
+        @wraps(func)
+        async def inner(request, *args, **kwargs):
+            etag = await sync_to_async(etag_func, thread_sensitive=True)(request, *args, **kwargs)
+            etag = quote_etag(etag) if etag is not None else None
+
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                response = await func(request, *args, **kwargs)
+
+            if etag and request.method in ('GET', 'HEAD'):
+                response.setdefault('ETag', etag)
+            return response
+        return inner
+    return decorator
@@ -0,0 +1,40 @@
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Font
+
+
+def write_xlsx(file, headers, rows, title='Tablib Dataset'):
+    """
+    Writes the headers and rows into an Excel workbook, which is saved
+    to the given file name or file object. In contrast to tablib, the
+    workbook is write-only: every row is written out immediately and not
+    kept in memory, so rows can come straight from a database iterator.
+    The formatting is the same as tablib's (bold and frozen headers,
+    wrapped multi-line values). Returns the number of rows written.
+    """
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet(title)
+    worksheet.freeze_panes = 'A2'
+
+    bold = Font(bold=True)
+    wrap_text = Alignment(wrap_text=True)
+
+    def cell(value, font=None, alignment=None):
+        cell = WriteOnlyCell(worksheet, value=value)
+        if font is not None:
+            cell.font = font
+        if alignment is not None:
+            cell.alignment = alignment
+        return cell
+
+    worksheet.append([cell(header, font=bold) for header in headers])
+
+    number = 0
+    for number, row in enumerate(rows, start=1):
+        worksheet.append([
+            cell(value, alignment=wrap_text) if isinstance(value, str) and '\n' in value else value
+            for value in row
+        ])
+
+    workbook.save(file)
+    return number
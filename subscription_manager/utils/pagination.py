@@ -0,0 +1,160 @@
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.encoding import force_str
+from django.utils.functional import cached_property
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+
+
+class KeysetPage:
+    """
+    Page of a KeysetPaginator. Instead of page numbers, it provides
+    cursors which point to the pages before and after it.
+    """
+
+    def __init__(self, object_list, previous_cursor, next_cursor):
+        self.object_list = object_list
+        self.previous_cursor = previous_cursor
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+
+class KeysetPaginator:
+    """
+    Paginates a queryset by seeking to the position of a cursor, which
+    holds the ordering values of the first or last object of a page,
+    instead of skipping rows with OFFSET. The ordering has to be unique,
+    e.g. ('-created_at', '-pk'), and may begin with integer annotations,
+    e.g. a search rank. Every page costs one query, regardless of its
+    position, as long as an index matches the ordering. The number of
+    pages is not counted.
+    """
+
+    def __init__(self, queryset, per_page, ordering=('-created_at', '-pk')):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = ordering
+        self.fields = [field.lstrip('-') for field in ordering]
+
+    def encode_cursor(self, obj):
+        # Dates and times are converted with str, which unlike
+        # DjangoJSONEncoder keeps the microseconds
+        values = [getattr(obj, field) for field in self.fields]
+        return urlsafe_base64_encode(json.dumps(values, default=str).encode())
+
+    def decode_cursor(self, cursor):
+        """
+        Returns the ordering values of a cursor or None if it is invalid.
+        """
+        try:
+            values = json.loads(force_str(urlsafe_base64_decode(cursor)))
+            if not isinstance(values, list) or len(values) != len(self.fields):
+                return None
+            opts = self.queryset.model._meta
+            return [
+                int(value) if field in self.queryset.query.annotations else
+                (opts.pk if field == 'pk' else opts.get_field(field)).to_python(value)
+                for field, value in zip(self.fields, values)
+            ]
+        except (ValueError, TypeError, ValidationError, FieldDoesNotExist):
+            return None
+
+    def get_seek_condition(self, values, reverse=False):
+        """
+        Returns a condition which matches all objects after the given
+        ordering values, or before them if reverse is true.
+        """
+        condition = Q()
+        for i, (ordering, value) in enumerate(zip(self.ordering, values)):
+            descending = ordering.startswith('-') != reverse
+            lookup = '{}__{}'.format(self.fields[i], 'lt' if descending else 'gt')
+            condition |= Q(**dict(zip(self.fields[:i], values[:i])), **{lookup: value})
+        return condition
+
+    def get_page(self, after=None, before=None):
+        """
+        Returns the page after the object of the cursor after, or the page
+        before the object of the cursor before. Returns the first page
+        without (valid) cursors.
+        """
+        after = after and self.decode_cursor(after)
+        before = before and self.decode_cursor(before)
+
+        if before:
+            # Seek backwards in reversed order
+            ordering = [field[1:] if field.startswith('-') else '-' + field for field in self.ordering]
+            queryset = self.queryset.filter(self.get_seek_condition(before, reverse=True)).order_by(*ordering)
+        elif after:
+            queryset = self.queryset.filter(self.get_seek_condition(after)).order_by(*self.ordering)
+        else:
+            queryset = self.queryset.order_by(*self.ordering)
+
+        # Fetch one more object to find out whether there are more pages
+        object_list = list(queryset[:self.per_page + 1])
+        has_more = len(object_list) > self.per_page
+        object_list = object_list[:self.per_page]
+        if not object_list:
+            return KeysetPage(object_list, None, None)
+
+        if before:
+            object_list.reverse()
+            has_previous, has_next = has_more, True
+        else:
+            has_previous, has_next = bool(after), has_more
+
+        return KeysetPage(
+            object_list,
+            self.encode_cursor(object_list[0]) if has_previous else None,
+            self.encode_cursor(object_list[-1]) if has_next else None
+        )
+
+
+class ApproximateCountPaginator(Paginator):
+    """
+    Paginator for admin changelists which does not count large tables.
+    Without filters, the number of rows is estimated from the table
+    statistics on PostgreSQL if there are more than estimate_threshold
+    rows. Otherwise, the rows are counted without computing the
+    annotations of the queryset.
+    """
+    estimate_threshold = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = self.get_estimate(queryset)
+            if estimate is not None and estimate > self.estimate_threshold:
+                return estimate
+        return queryset.order_by().values('pk').count()
+
+    @staticmethod
+    def get_estimate(queryset):
+        """
+        Returns the estimated number of rows of the queryset's table
+        on PostgreSQL, or None.
+        """
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s', [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+        return int(row[0]) if row else None
@@ -0,0 +1,116 @@
+import time
+
+from django.core.cache import caches
+from django.utils import timezone
+
+
+class SlidingWindowCounter:
+    """
+    Counts events per key within a sliding time window. The events are
+    stored in the cache in buckets of a fixed size (one minute by
+    default), each of which expires once it has left the window. A
+    count sums up all buckets of the window with a single cache lookup.
+
+    Buckets are increased with atomic cache operations, so a limit is
+    enforced exactly across processes as long as they share the cache
+    (e.g. Redis or Memcached, not the local memory cache or the tiered
+    default cache, whose memory tier may return outdated counts).
+    """
+
+    def __init__(self, name, window=timezone.timedelta(hours=1), bucket_size=timezone.timedelta(minutes=1), cache_alias='default'):
+        self.name = name
+        self.bucket_size = int(bucket_size.total_seconds())
+        # Number of complete buckets in the window. The current bucket is
+        # counted in addition, so events are rather counted too long than
+        # too short.
+        self.bucket_count = int(window.total_seconds()) // self.bucket_size
+        self.timeout = (self.bucket_count + 2) * self.bucket_size
+        self.cache_alias = cache_alias
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def bucket(self, timestamp=None):
+        """
+        Returns the number of the bucket the given timestamp (in seconds)
+        falls into. Defaults to the current bucket.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        return int(timestamp) // self.bucket_size
+
+    def bucket_key(self, key, bucket):
+        return 'ratelimit:{}:{}:{}'.format(self.name, key, bucket)
+
+    def seeded_key(self, key):
+        return 'ratelimit:{}:{}:seeded'.format(self.name, key)
+
+    def window_keys(self, keys):
+        """
+        Returns the cache keys of all buckets within the current window.
+        """
+        current = self.bucket()
+        return [
+            self.bucket_key(key, bucket)
+            for key in keys
+            for bucket in range(current - self.bucket_count, current + 1)
+        ]
+
+    def count(self, *keys):
+        """
+        Returns the number of events of all given keys within the window.
+        """
+        return sum(self.cache.get_many(self.window_keys(keys)).values())
+
+    def is_seeded(self, key):
+        return self.cache.get(self.seeded_key(key)) is not None
+
+    def seed(self, key, timestamps):
+        """
+        Initializes the buckets of a key with the timestamps of already
+        known events, e.g. from the database after the cache has been
+        cleared. Existing buckets are not overwritten.
+        """
+        current = self.bucket()
+        counts = {}
+        for timestamp in timestamps:
+            bucket = self.bucket(timestamp)
+            if current - self.bucket_count <= bucket <= current:
+                counts[bucket] = counts.get(bucket, 0) + 1
+        for bucket, count in counts.items():
+            self.cache.add(self.bucket_key(key, bucket), count, self.timeout)
+
+    def mark_seeded(self, *keys):
+        self.cache.set_many({self.seeded_key(key): True for key in keys}, self.timeout)
+
+    def increment(self, key, limit, counted_keys=None):
+        """
+        Records an event of the given key if the events of the counted
+        keys (by default only the key itself) stay within the limit.
+        Returns whether the event has been recorded.
+
+        The bucket is increased first and only afterwards compared to the
+        limit, so concurrent events can never exceed it. If the limit has
+        been exceeded, the event is taken back again. The bucket's value
+        is the one returned by the atomic increment, so concurrent events
+        of the same key are ordered and exactly as many as the limit
+        allows are recorded.
+        """
+        bucket_key = self.bucket_key(key, self.bucket())
+
+        # The bucket may expire between add and incr
+        while True:
+            self.cache.add(bucket_key, 0, self.timeout)
+            try:
+                value = self.cache.incr(bucket_key)
+            except ValueError:
+                continue
+            break
+
+        counts = self.cache.get_many(self.window_keys(counted_keys or [key]))
+        counts[bucket_key] = value
+        if sum(counts.values()) > limit:
+            self.cache.decr(bucket_key)
+            return False
+        return True
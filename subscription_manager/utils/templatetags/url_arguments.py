@@ -5,10 +5,13 @@ register = template.Library()
 
 
 @register.simple_tag
-def url_replace_arg(request, field, value):
+def url_replace_arg(request, field, value, remove=None):
     """
-    Creates or updates a url argument.
+    Creates or updates a url argument. Optionally removes
+    another argument.
     """
     dictionary = request.GET.copy()
     dictionary[field] = value
+    if remove is not None:
+        dictionary.pop(remove, None)
     return dictionary.urlencode()